@@ -1,25 +1,53 @@
-from fastapi import FastAPI, Request, Depends , Response
+import time
+_import_started = time.monotonic()  # start-up timing, reported by GET /ready
+from fastapi import FastAPI, Request, Depends , Response, Query
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any, AsyncIterator
-import pyodbc
-from fastapi.responses import StreamingResponse
-from typing import Dict, Callable
+from typing import List, Optional, Dict, Any, AsyncIterator, Literal, Callable
 import asyncio
 import json
+import math
 import uuid
 import os
-import json
-import asyncio
+import re
+import sys
 from datetime import datetime, timedelta, date
 from decimal import Decimal
 import base64
-from contextlib import asynccontextmanager
+import hashlib
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from collections import namedtuple
 from fastapi.responses import JSONResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
-# from openai import OpenAI
-from openai import AzureOpenAI
+# pyodbc and openai are imported on first use (see create_connection and
+# get_llm_client) so importing this module stays fast for tooling and tests
+from db_pool import ConnectionPool, PoolTimeoutError
+from db_registry import (
+    DatabaseRegistry, InvalidSchemaError, UnknownDatabaseError, load_database_configs, validate_schema_name
+)
+from ttl_cache import TTLCache
+from schema_cache import SchemaCache, SchemaSnapshot, load_schema_snapshot
+from row_converters import RowConverter, columnar_length, slice_columnar
+from llm_cache import LLMResponseCache, llm_cache_key, normalize_goal
+from query_cache import QueryResultCache, load_table_versions, query_result_key
+from metrics import NULL_TIMINGS, Registry, Timings, current_timings
+from schema_pruning import (
+    count_tokens, encode_samples, encode_schema, fit_context, fit_profile_context, load_tokenizer, rank_tables
+)
+from table_profiles import TableProfileCache, TableVersion, encode_profiles, load_table_stats, profile_table
+from sse_sessions import SessionLimitError, SessionManager
+from rate_limit import LLMRateLimiter, retry_after_seconds
+from analysis_jobs import JobManager, JobQueueFullError
+from sql_guard import GuardedQuery, SqlRejectedError, estimate_query_cost, guard_query, qualify_tables
+from warmup import Warmup
+from admission import AdmissionController, AdmissionRejectedError
+from compression import CompressionMiddleware
+from result_store import InvalidCursorError, ResultStore, decode_cursor, encode_cursor
+from shared_cache import SharedCache, create_backend
 
 # Custom JSON encoder to handle datetime objects, Decimal objects, and bytes objects
 class CustomJSONEncoder(json.JSONEncoder):
@@ -49,7 +77,23 @@ def format_sse_event(data: Any) -> str:
     json_data = json.dumps(data, cls=CustomJSONEncoder)
     return f"data: {json_data}\n\n"
 
-app = FastAPI()
+# NDJSON event helper function
+def format_ndjson_event(data: Any) -> str:
+    return json.dumps(data, cls=CustomJSONEncoder, separators=(",", ":")) + "\n"
+
+# The warm-up runs in the background so the server accepts requests (and
+# readiness probes) right away; @app.on_event handlers still run from here
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await app.router.startup()
+    startup.start()
+    try:
+        yield
+    finally:
+        await startup.close()
+        await app.router.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware to allow cross-origin requests
 app.add_middleware(
@@ -58,6 +102,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["Server-Timing"],  # Readable by the React app
 )
 
 # Override default JSONResponse with our custom one
@@ -72,6 +117,33 @@ DB_CONFIG = {
     "password": os.getenv("DB_PASSWORD", "app_password"),
     "port": os.getenv("DB_PORT", "1433")
 }
+DB_SCHEMA = os.getenv("DB_SCHEMA", "SalesLT")  # Schema whose tables are analyzed
+
+# Connection pool sizing and recycling (seconds)
+DB_POOL_CONFIG = {
+    "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+    "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+    "idle_timeout": float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300")),
+    "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+    "acquire_timeout": float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "30")),
+    "health_check_after": float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30")),
+}
+
+# Routing: a request may name a database ("database") and a schema ("schemaName").
+# DB_DATABASES maps names to connection settings (a JSON object, inline or in a
+# file; missing keys default to the settings above, "schema" to DB_SCHEMA). With
+# DB_ALLOW_ANY_DATABASE, any other database on DB_HOST can be named. At most
+# DB_MAX_POOLS pools are open per worker: idle ones are closed least recently
+# used first, and after DB_POOL_EVICT_AFTER seconds without use.
+DB_DATABASES = load_database_configs(os.getenv("DB_DATABASES", ""))
+DB_ALLOW_ANY_DATABASE = os.getenv("DB_ALLOW_ANY_DATABASE", "false").lower() in ("1", "true", "yes")
+DB_MAX_POOLS = int(os.getenv("DB_MAX_POOLS", "50"))
+DB_POOL_EVICT_AFTER = float(os.getenv("DB_POOL_EVICT_AFTER", "600"))
+
+# Concurrency limits: blocking pyodbc calls run on a bounded thread pool and
+# at most LLM_MAX_CONCURRENCY chat completions are in flight per worker
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "20"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
 
 # Azure OpenAI Configuration
 AZURE_OPENAI_KEY = os.getenv("AZURE_OPENAI_KEY", "your_azure_openai_key_here")
@@ -79,168 +151,1260 @@ AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "https://your-azure-o
 AZURE_DEPLOYMENT_NAME = os.getenv("AZURE_DEPLOYMENT_NAME", "DataChat")  # This is the deployment name for your model
 API_VERSION = os.getenv("AZURE_API_VERSION", "2024-12-01-preview")  # Azure OpenAI API version
 
-# Initialize Azure OpenAI client
-client = AzureOpenAI(
-    api_version=API_VERSION,
-    azure_endpoint=AZURE_OPENAI_ENDPOINT,
-    api_key=AZURE_OPENAI_KEY,
+# Azure OpenAI client (async, so completions never block the event loop), built
+# on first use or by the warm-up. Retries are done by create_completion, which
+# coordinates them with the rate limiter.
+_llm_client = None
+
+def get_llm_client():
+    global _llm_client
+    if _llm_client is None:
+        from openai import AsyncAzureOpenAI
+        _llm_client = AsyncAzureOpenAI(
+            api_version=API_VERSION,
+            azure_endpoint=AZURE_OPENAI_ENDPOINT,
+            api_key=AZURE_OPENAI_KEY,
+            max_retries=0,
+        )
+    return _llm_client
+
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+LLM_TEMPERATURE = 0.2
+LLM_MAX_TOKENS = 1500
+
+# Deployment quotas (0 = unlimited). Completions wait for quota locally instead
+# of being rejected with 429; 429s and transient errors are retried with backoff
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "0"))
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "0"))
+llm_limiter = LLMRateLimiter(
+    tokens_per_minute=LLM_TPM_LIMIT,
+    requests_per_minute=LLM_RPM_LIMIT,
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", "4")),
+    base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "1")),
+    max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "60")),
 )
 
 print(f"Azure OpenAI API configured with endpoint: {AZURE_OPENAI_ENDPOINT}")
 
-# Cache for schema
-schema_cache = None
-schema_cache_time = None
-SCHEMA_CACHE_TTL = timedelta(hours=1)
+# JSON responses sent in one piece (not SSE/NDJSON streams) of at least
+# COMPRESSION_MIN_BYTES are compressed with brotli (if installed) or gzip,
+# whichever the client accepts; 0 disables compression
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+
+# Cache for schema (seconds); entries are refreshed in the background during
+# the last SCHEMA_REFRESH_AHEAD seconds before they expire
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "3600"))
+SCHEMA_REFRESH_AHEAD = float(os.getenv("SCHEMA_REFRESH_AHEAD", "300"))
+
+# Cache for sampled table rows (TTL in seconds, size bound in bytes of JSON)
+SAMPLE_CACHE_TTL = float(os.getenv("SAMPLE_CACHE_TTL", "600"))
+SAMPLE_CACHE_MAX_ENTRIES = int(os.getenv("SAMPLE_CACHE_MAX_ENTRIES", "1000"))
+SAMPLE_CACHE_MAX_BYTES = int(os.getenv("SAMPLE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+SAMPLE_CONCURRENCY = int(os.getenv("SAMPLE_CONCURRENCY", "4"))  # tables sampled in parallel per request
+
+# What the prompt shows of each table's data: "profiles" (per-column statistics,
+# computed once per table from PROFILE_SAMPLE_ROWS rows read through TABLESAMPLE)
+# or "samples" (the first rows, cached as above). Row counts and last writes are
+# checked every PROFILE_CHECK_INTERVAL seconds; a table is re-profiled when its
+# row count moves by more than PROFILE_CHANGE_FRACTION, or when it was written to
+# and its profile is PROFILE_REFRESH_INTERVAL seconds old
+PROMPT_TABLE_DATA = os.getenv("PROMPT_TABLE_DATA", "profiles")
+if PROMPT_TABLE_DATA not in ("profiles", "samples"):
+    raise ValueError("PROMPT_TABLE_DATA must be profiles or samples")
+PROFILE_SAMPLE_ROWS = int(os.getenv("PROFILE_SAMPLE_ROWS", "1000"))
+PROFILE_TOP_VALUES = int(os.getenv("PROFILE_TOP_VALUES", "5"))  # frequent values listed per column
+PROFILE_TTL = float(os.getenv("PROFILE_TTL", "86400"))
+PROFILE_MAX_ENTRIES = int(os.getenv("PROFILE_MAX_ENTRIES", "5000"))
+PROFILE_CHECK_INTERVAL = float(os.getenv("PROFILE_CHECK_INTERVAL", "60"))
+PROFILE_REFRESH_INTERVAL = float(os.getenv("PROFILE_REFRESH_INTERVAL", "600"))
+PROFILE_CHANGE_FRACTION = float(os.getenv("PROFILE_CHANGE_FRACTION", "0.1"))
+PROFILE_CONCURRENCY = int(os.getenv("PROFILE_CONCURRENCY", "2"))  # tables profiled at once per worker
+
+# Executed queries are read in batches; each query stops (truncated) at the row or byte cap
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "500"))
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "10000"))
+QUERY_MAX_BYTES = int(os.getenv("QUERY_MAX_BYTES", str(10 * 1024 * 1024)))
+QUERY_EVENT_BUFFER = int(os.getenv("QUERY_EVENT_BUFFER", "8"))  # queued result events per analysis
+
+# Suggested queries run concurrently, each on its own pooled connection, and are
+# cancelled after QUERY_TIMEOUT seconds spent in the database
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "30"))
+QUERY_CONCURRENCY = int(os.getenv("QUERY_CONCURRENCY", "4"))  # parallel queries per analysis
+QUERY_CANCEL_GRACE = 5.0  # seconds to wait for a cancelled statement to unwind
+
+# Generated queries must be a single SELECT and are limited to QUERY_MAX_ROWS rows
+# in SQL. Before running, the estimated plan cost (SHOWPLAN_XML) is compared with
+# QUERY_COST_LIMIT (0 disables the check); costlier queries are skipped, or with
+# QUERY_COST_ACTION=downgrade retried with TOP (QUERY_DOWNGRADE_ROWS) first
+QUERY_COST_LIMIT = float(os.getenv("QUERY_COST_LIMIT", "50"))
+QUERY_COST_ACTION = os.getenv("QUERY_COST_ACTION", "downgrade")
+QUERY_DOWNGRADE_ROWS = int(os.getenv("QUERY_DOWNGRADE_ROWS", "100"))
+
+# Cache for executed query results keyed by normalized SQL (TTL in seconds, 0 disables).
+# With QUERY_CACHE_TRACK_CHANGES, entries are dropped when a table they read is written to.
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "60"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "500"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+QUERY_CACHE_MAX_ENTRY_BYTES = int(os.getenv("QUERY_CACHE_MAX_ENTRY_BYTES", str(2 * 1024 * 1024)))
+QUERY_CACHE_TRACK_CHANGES = os.getenv("QUERY_CACHE_TRACK_CHANGES", "false").lower() in ("1", "true", "yes")
+QUERY_CACHE_CHANGE_POLL = float(os.getenv("QUERY_CACHE_CHANGE_POLL", "15"))
+
+# Executed results are also written to a result store under a resultId, whose rows
+# GET /results/{id} serves page by page. A result stays in memory up to
+# RESULT_SPILL_BYTES (RESULT_MEMORY_BYTES for all of them), then moves to a file in
+# RESULT_STORE_DIR (default: a temporary directory removed on shutdown). Results
+# expire RESULT_STORE_TTL seconds after they were last read (0 disables the store).
+RESULT_STORE_TTL = float(os.getenv("RESULT_STORE_TTL", "3600"))
+RESULT_STORE_DIR = os.getenv("RESULT_STORE_DIR", "") or None
+RESULT_MEMORY_BYTES = int(os.getenv("RESULT_MEMORY_BYTES", str(32 * 1024 * 1024)))
+RESULT_SPILL_BYTES = int(os.getenv("RESULT_SPILL_BYTES", str(1024 * 1024)))
+RESULT_STORE_MAX_ENTRIES = int(os.getenv("RESULT_STORE_MAX_ENTRIES", "1000"))
+RESULT_STORE_MAX_BYTES = int(os.getenv("RESULT_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))  # on disk
+RESULT_PAGE_ROWS = int(os.getenv("RESULT_PAGE_ROWS", "500"))  # default page size
+RESULT_PAGE_MAX_ROWS = int(os.getenv("RESULT_PAGE_MAX_ROWS", "5000"))
+
+# Prompt size: at most PROMPT_MAX_TABLES goal-relevant tables are considered when
+# none are requested, and schema + table data are fitted into PROMPT_TOKEN_BUDGET tokens
+PROMPT_MAX_TABLES = int(os.getenv("PROMPT_MAX_TABLES", "8"))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+
+# Cache for LLM responses (TTL in seconds); set LLM_CACHE_PATH to persist entries to a local SQLite file
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+LLM_CACHE_DISK_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DISK_MAX_ENTRIES", "10000"))
+
+# Cache tier shared by the workers of a host (uvicorn --workers N): the schema,
+# sample rows and LLM responses one worker loads are served to the others, and a
+# key missing everywhere is loaded by one worker while the rest wait (for at most
+# SHARED_CACHE_LOCK_LEASE seconds). Enabled by SHARED_CACHE_PATH, a file every
+# worker can reach; SHARED_CACHE_BACKEND names the implementation.
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "")
+SHARED_CACHE_BACKEND = os.getenv("SHARED_CACHE_BACKEND", "sqlite")
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "10000"))
+SHARED_CACHE_LOCK_LEASE = float(os.getenv("SHARED_CACHE_LOCK_LEASE", "30"))
+
+# Background analysis jobs (POST /analyze/jobs): JOB_WORKERS run at once; finished
+# jobs are kept for JOB_RESULT_TTL seconds, bounded by count and JSON size
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+JOB_MAX_KEPT = int(os.getenv("JOB_MAX_KEPT", "1000"))
+JOB_STORE_MAX_BYTES = int(os.getenv("JOB_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# POST /analyze/batch: goals per request and goals analyzed at once
+BATCH_MAX_GOALS = int(os.getenv("BATCH_MAX_GOALS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# Admission control for /analyze, /analyze/sse and /analyze/stream: at most
+# ADMISSION_MAX_IN_FLIGHT analyses run at once (0 disables admission control),
+# up to ADMISSION_MAX_QUEUE more wait at most ADMISSION_QUEUE_TIMEOUT seconds,
+# served round-robin across clients and contextIds, and the rest are shed with
+# 503. A client (ADMISSION_CLIENT_HEADER, else its address) has at most
+# ADMISSION_MAX_PER_CLIENT analyses running or waiting (0: no cap), beyond that
+# 429. ADMISSION_ADAPTIVE lowers the limit while the average completion latency
+# or connection checkout time exceeds ADMISSION_LLM_TARGET / ADMISSION_DB_TARGET.
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+ADMISSION_MAX_PER_CLIENT = int(os.getenv("ADMISSION_MAX_PER_CLIENT", "0"))
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "X-Client-Id")
+ADMISSION_ADAPTIVE = os.getenv("ADMISSION_ADAPTIVE", "false").lower() in ("1", "true", "yes")
+ADMISSION_MIN_IN_FLIGHT = int(os.getenv("ADMISSION_MIN_IN_FLIGHT", "2"))
+ADMISSION_LLM_TARGET = float(os.getenv("ADMISSION_LLM_TARGET", "20"))
+ADMISSION_DB_TARGET = float(os.getenv("ADMISSION_DB_TARGET", "1"))
+
+# /connect sessions: each holds at most SSE_QUEUE_SIZE undelivered messages
+# (SSE_OVERFLOW: drop_oldest, drop_newest or close), gets a heartbeat comment
+# after SSE_HEARTBEAT_INTERVAL quiet seconds and is closed after SSE_IDLE_TIMEOUT
+# seconds without messages (0 keeps idle sessions open). A disconnected session is
+# kept SSE_RESUME_TIMEOUT seconds (0: removed at once) for the client to reconnect
+# with Last-Event-ID, and gets its last SSE_REPLAY_SIZE delivered messages again.
+SSE_MAX_SESSIONS = int(os.getenv("SSE_MAX_SESSIONS", "20000"))
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "64"))
+SSE_OVERFLOW = os.getenv("SSE_OVERFLOW", "drop_oldest")
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+SSE_IDLE_TIMEOUT = float(os.getenv("SSE_IDLE_TIMEOUT", "900"))
+SSE_RESUME_TIMEOUT = float(os.getenv("SSE_RESUME_TIMEOUT", "30"))
+SSE_REPLAY_SIZE = int(os.getenv("SSE_REPLAY_SIZE", "16"))
+
+# Start-up warm-up (GET /ready answers 503 until it has finished; failed steps are
+# retried every WARMUP_RETRY_INTERVAL seconds). Steps: WARMUP_POOL opens
+# DB_POOL_MIN_SIZE connections, WARMUP_SCHEMA loads the schema cache, WARMUP_TABLES
+# (comma-separated, "*" for every table) fills the sample or profile cache, WARMUP_LLM builds
+# the Azure OpenAI client and opens its connection. WARMUP_ENABLED=false skips all.
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+WARMUP_POOL = os.getenv("WARMUP_POOL", "true").lower() in ("1", "true", "yes")
+WARMUP_SCHEMA = os.getenv("WARMUP_SCHEMA", "true").lower() in ("1", "true", "yes")
+WARMUP_TABLES = [t.strip() for t in os.getenv("WARMUP_TABLES", "").split(",") if t.strip()]
+WARMUP_LLM = os.getenv("WARMUP_LLM", "true").lower() in ("1", "true", "yes")
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "10"))
+WARMUP_LLM_TIMEOUT = 10.0  # seconds for the connection-opening request
+
+# Per-request stage timings (Server-Timing header, `timing` event, /metrics latency
+# histograms); when disabled no timing objects are created at all
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+metrics_registry = Registry()
+stage_duration = metrics_registry.histogram(
+    "aidb_stage_duration_seconds", "Time spent in each analysis stage", ("endpoint", "stage")
+)
+query_duration = metrics_registry.histogram(
+    "aidb_query_duration_seconds", "Execution time of suggested queries", ("outcome",)
+)
+llm_tokens = metrics_registry.counter("aidb_llm_tokens_total", "Tokens used by chat completions", ("kind",))
+
+def start_timings(endpoint: str):
+    timings = Timings(endpoint, stage_duration) if METRICS_ENABLED else NULL_TIMINGS
+    current_timings.set(timings)
+    return timings
+
+shared_cache = SharedCache(
+    create_backend(SHARED_CACHE_BACKEND, SHARED_CACHE_PATH, max_entries=SHARED_CACHE_MAX_ENTRIES),
+    lock_lease=SHARED_CACHE_LOCK_LEASE,
+) if SHARED_CACHE_PATH else None
+
+llm_cache = LLMResponseCache(
+    ttl=LLM_CACHE_TTL,
+    max_entries=LLM_CACHE_MAX_ENTRIES,
+    path=LLM_CACHE_PATH or None,
+    disk_max_entries=LLM_CACHE_DISK_MAX_ENTRIES,
+    shared=shared_cache,
+)
 
 # Pydantic models
 class AnalyzeThis(BaseModel):
     analysisGoal: str
+    database: Optional[str] = None  # DB_DATABASES name (or any database with DB_ALLOW_ANY_DATABASE); default DB_NAME
+    schemaName: Optional[str] = None  # default: the database's schema
     tables: Optional[List[str]] = None
     contextId: Optional[str] = None
     executeQueries: Optional[bool] = False
+    streamResults: Optional[bool] = False  # SSE: send query rows as queryResultChunk events
+    resultFormat: Literal["rows", "columns"] = "rows"  # "columns": {column: [values]} instead of row dicts
+    useCache: Optional[bool] = True  # False: always call the LLM and run queries, skipping the caches
+    schemaFormat: Literal["full", "fingerprint"] = "full"  # /analyze: "fingerprint" leaves the schema to GET /schema
+    slimResult: Optional[bool] = False  # SSE/NDJSON: the final result event refers to earlier events instead of repeating them
+    resultPageSize: Optional[int] = None  # results carry only their first N rows and a nextCursor for GET /results/{id}
+
+class AnalyzeJob(AnalyzeThis):
+    priority: int = 0  # higher runs first
+
+class AnalyzeBatch(BaseModel):
+    goals: List[AnalyzeThis]  # their database/schemaName are ignored: the batch's apply
+    contextId: Optional[str] = None
+    database: Optional[str] = None
+    schemaName: Optional[str] = None
 
-def create_connection():
+def create_connection(config: Dict[str, Any] = DB_CONFIG):
     conn_str = (
-        f"DRIVER={DB_CONFIG['driver']};"
-        f"SERVER={DB_CONFIG['server']},{DB_CONFIG['port']};"
-        f"DATABASE={DB_CONFIG['database']};"
-        f"UID={DB_CONFIG['user']};"
-        f"PWD={DB_CONFIG['password']}"
+        f"DRIVER={config['driver']};"
+        f"SERVER={config['server']},{config['port']};"
+        f"DATABASE={config['database']};"
+        f"UID={config['user']};"
+        f"PWD={config['password']}"
     )
+    import pyodbc
     return pyodbc.connect(conn_str)
 
+# Blocking database calls of every pool share one bounded thread pool
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+async def run_db(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(db_executor, fn, *args)
+
+# One connection pool per database; connections are reused across requests
+# instead of paying the TCP + TLS + login handshake on every call. Only the
+# default database keeps DB_POOL_MIN_SIZE connections open.
+def create_pool(config: Dict[str, Any], pinned: bool) -> ConnectionPool:
+    options = dict(DB_POOL_CONFIG, min_size=DB_POOL_CONFIG["min_size"] if pinned else 0)
+    return ConnectionPool(partial(create_connection, config), executor=db_executor, **options)
+
+# Cached schema, samples, profiles and change tracking of a database whose pool was closed
+def forget_database(database):
+    schema_cache.invalidate_where(lambda key: key[:2] == database.key)
+    sample_cache.pop_where(lambda key: key[:2] == database.key)
+    profile_cache.invalidate_where(lambda key: key[:2] == database.key)
+    query_cache.forget(database.key)
+
+databases = DatabaseRegistry(
+    dict(DB_CONFIG, schema=DB_SCHEMA),
+    create_pool,
+    configs=DB_DATABASES,
+    allow_any=DB_ALLOW_ANY_DATABASE,
+    max_pools=DB_MAX_POOLS,
+    evict_after=DB_POOL_EVICT_AFTER,
+    on_evict=forget_database,
+)
+db_pool = databases.default.pool
+
+# The database (and schema) the current request works on; get_db_pool,
+# get_db_schema, sample_tables, the query cache and the prompt follow it
+Route = namedtuple("Route", ["database", "schema"])
+current_route: "ContextVar[Optional[Route]]" = ContextVar("current_route", default=None)
+
+def get_route() -> Route:
+    route = current_route.get()
+    return route if route is not None else Route(databases.default, databases.default.schema)
+
+def check_route(database: Optional[str], schema: Optional[str]):
+    # Raises UnknownDatabaseError/InvalidSchemaError before a response has started
+    databases.config_for(database)
+    if schema is not None:
+        validate_schema_name(schema)
+
+@contextmanager
+def database_route(database: Optional[str], schema: Optional[str]):
+    # Lease the database for the request (it is not evicted meanwhile) and make it current
+    if schema is not None:
+        validate_schema_name(schema)
+    leased = databases.acquire(database)
+    token = current_route.set(Route(leased, schema or leased.schema))
+    try:
+        yield leased
+    finally:
+        databases.release(leased)
+        try:
+            current_route.reset(token)
+        except ValueError:
+            pass  # an abandoned stream finalized from another context, where it was never set
+
+# For cache loads that can outlive the request that started them (refresh-ahead,
+# re-profiling, change polls, and shared loads whose caller went away). Their
+# tasks run in a copy of the starting request's context, so get_route() is
+# still that request's route; the database is leased again until the load
+# finishes, so it is not evicted meanwhile (or is reopened if it already was).
+def leased_load(loader):
+    async def load(*args):
+        route = get_route()
+        with database_route(route.database.name, route.schema):
+            return await loader(*args)
+    return load
+
 @asynccontextmanager
 async def get_db_pool():
-    conn = create_connection()
-    try:
+    timings = current_timings.get()
+    started = time.perf_counter()
+    async with get_route().database.pool.connection() as conn:
+        checkout = time.perf_counter() - started
+        if timings.enabled:
+            timings.add("connect", checkout)
+        observe_latency("db", checkout)
         yield conn
-    finally:
-        conn.close()
 
-async def get_db_schema(pool):
-    global schema_cache, schema_cache_time
-    now = datetime.utcnow()
-    if schema_cache and schema_cache_time and now - schema_cache_time < SCHEMA_CACHE_TTL:
-        return schema_cache
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    return CustomJSONResponse(
+        status_code=503,
+        content={"status": "error", "message": str(exc)},
+        headers={"Retry-After": "1"},
+    )
 
-    cursor = pool.cursor()
-    columns_query = """
-    SELECT TABLE_NAME as table_name, COLUMN_NAME as column_name, 
-    DATA_TYPE as data_type, IS_NULLABLE as is_nullable, 
-    COLUMN_DEFAULT as column_default
-    FROM INFORMATION_SCHEMA.COLUMNS
-    WHERE TABLE_SCHEMA = 'SalesLT'  -- Replace with your schema name
-    ORDER BY TABLE_NAME, ORDINAL_POSITION;
-    """
-    fks_query = """
-    SELECT
-        tc.TABLE_NAME as table_name, kcu.COLUMN_NAME as column_name, 
-        ccu.TABLE_NAME AS foreign_table_name, 
-        ccu.COLUMN_NAME AS foreign_column_name
-    FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS AS tc
-    JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE AS kcu ON tc.CONSTRAINT_NAME = kcu.CONSTRAINT_NAME
-    JOIN INFORMATION_SCHEMA.CONSTRAINT_COLUMN_USAGE AS ccu ON ccu.CONSTRAINT_NAME = tc.CONSTRAINT_NAME
-    WHERE tc.CONSTRAINT_TYPE = 'FOREIGN KEY';
-    """
-    cursor.execute(columns_query)
-    columns = cursor.fetchall()
-    cursor.execute(fks_query)
-    fks = cursor.fetchall()
-    # Define namedtuples for better readability
-    Column = namedtuple("Column", ["table_name", "column_name", "data_type", "is_nullable", "column_default"])
-    ForeignKey = namedtuple("ForeignKey", ["table_name", "column_name", "foreign_table_name", "foreign_column_name"])
-
-    # Convert raw database rows into namedtuples
-    columns = [Column(*row) for row in columns]
-    fks = [ForeignKey(*row) for row in fks]
-    # # Log columns and foreign keys for debugging
-    # print("Columns fetched from database:")
-
-    schema = {}
-    for row in columns:
-        table = row.table_name
-        if table not in schema:
-            schema[table] = {"columns": [], "relationships": []}
-        schema[table]["columns"].append({
-            "name": row.column_name,
-            "type": row.data_type,
-            "nullable": row.is_nullable == 'YES',
-            "default": row.column_default
-        })
-
-    for fk in fks:
-        table = fk.table_name
-        if table in schema:
-            schema[table]["relationships"].append({
-                "column": fk.column_name,
-                "references": {
-                    "table": fk.foreign_table_name,
-                    "column": fk.foreign_column_name
-                }
-            })
-    # # Log the schema for debugging
-    # print("Schema constructed from database:")
-    # for table, details in schema.items():
-    #     print(f"Table: {table}")
-    #     print("Columns:")
-    #     for column in details["columns"]:
-    #         print(f"  - {column}")
-    #     print("Relationships:")
-    #     for relationship in details["relationships"]:
-    #         print(f"  - {relationship}")
-    schema_cache = schema
-    schema_cache_time = now
-    cursor.close()
-    return schema
+@app.exception_handler(UnknownDatabaseError)
+async def unknown_database_handler(request: Request, exc: UnknownDatabaseError):
+    return CustomJSONResponse(status_code=404, content={"status": "error", "message": str(exc)})
+
+@app.exception_handler(InvalidSchemaError)
+async def invalid_schema_handler(request: Request, exc: InvalidSchemaError):
+    return CustomJSONResponse(status_code=400, content={"status": "error", "message": str(exc)})
+
+# Pool of the default database; every open pool is listed by /databases
+@app.get("/pool/stats")
+async def pool_stats():
+    return db_pool.stats()
+
+@app.get("/databases")
+async def database_stats():
+    return databases.stats()
+
+def collect_cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {
+        "schema": schema_cache.stats(),
+        "samples": sample_cache.stats(),
+        "profiles": profile_cache.stats(),
+        "llm": llm_cache.stats(),
+        "queries": query_cache.stats(),
+        **({"shared": shared_cache.stats()} if shared_cache is not None else {}),
+    }
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return collect_cache_stats()
+
+def _pool_totals() -> Dict[str, float]:
+    totals: Dict[str, float] = {}
+    for database in databases.databases():
+        for stat, value in database.pool.stats().items():
+            totals[stat] = totals.get(stat, 0) + value
+    return totals
+
+# Pool metrics are totals over the pools of all open databases
+def _pool_metric(*stats, scale=1):
+    return lambda: [((), sum(_pool_totals()[stat] for stat in stats) * scale)]
+
+def _cache_metric(stat):
+    return lambda: [((name,), stats.get(stat, 0)) for name, stats in collect_cache_stats().items()]
+
+metrics_registry.callback(
+    "aidb_pool_connections", "gauge", "Pooled database connections by state", ("state",),
+    lambda: [((state,), _pool_totals()[stat]) for state, stat in (("in_use", "inUse"), ("idle", "idle"))]
+)
+metrics_registry.callback("aidb_db_pools_open", "gauge", "Databases with an open pool", (), lambda: [((), len(databases))])
+metrics_registry.callback(
+    "aidb_db_pools_evicted_total", "counter", "Pools closed to make room or after idling", (),
+    lambda: [((), databases.evicted)]
+)
+metrics_registry.callback("aidb_pool_waiting", "gauge", "Requests waiting for a connection", (), _pool_metric("waiting"))
+metrics_registry.callback("aidb_pool_acquired_total", "counter", "Connection checkouts", (), _pool_metric("acquired"))
+metrics_registry.callback("aidb_pool_timeouts_total", "counter", "Checkouts that timed out", (), _pool_metric("timeouts"))
+metrics_registry.callback(
+    "aidb_pool_wait_seconds_total", "counter", "Time spent waiting for connections", (),
+    _pool_metric("waitTimeTotalMs", scale=0.001)
+)
+metrics_registry.callback(
+    "aidb_llm_rate_limited_total", "counter", "Chat completions answered with 429", (),
+    lambda: [((), llm_limiter.rate_limited)]
+)
+metrics_registry.callback(
+    "aidb_llm_throttle_wait_seconds_total", "counter", "Time completions waited for TPM/RPM quota", (),
+    lambda: [((), llm_limiter.wait_time_total)]
+)
+metrics_registry.callback("aidb_cache_hits_total", "counter", "Cache hits", ("cache",), _cache_metric("hits"))
+metrics_registry.callback("aidb_cache_misses_total", "counter", "Cache misses", ("cache",), _cache_metric("misses"))
+metrics_registry.callback("aidb_cache_hit_ratio", "gauge", "Cache hit ratio since start", ("cache",), _cache_metric("hitRatio"))
+metrics_registry.callback("aidb_cache_entries", "gauge", "Entries held in memory", ("cache",), _cache_metric("entries"))
+
+# Prometheus text format
+@app.get("/metrics")
+async def metrics():
+    return Response(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Drop cached query results, for every table or only those reading the given
+# tables, in every database or only the given one
+@app.delete("/cache/queries")
+async def invalidate_query_cache(table: Optional[List[str]] = Query(None), database: Optional[str] = None):
+    config = databases.config_for(database) if database is not None else None
+    key = (config["server"], config["database"]) if config is not None else None
+    if not table:
+        removed = query_cache.clear(key)
+    else:
+        removed = query_cache.invalidate_tables(table, key)
+    return {"status": "success", "removed": removed}
+
+async def _read_schema_snapshot(key, previous):
+    _, _, schema_name = key
+    async with get_db_pool() as pool:
+        return await run_db(load_schema_snapshot, pool, schema_name, previous)
+
+# With the shared cache one worker per host reads the schema and the others take
+# its copy (mode "shared"). The copy expires when local entries start refreshing
+# ahead, so each refresh reloads it, again once per host; a copy taken from the
+# shared cache is as old locally as it is there.
+async def _load_schema_snapshot(key, previous):
+    if shared_cache is None:
+        return await _read_schema_snapshot(key, previous)
+    shared_ttl = max(SCHEMA_CACHE_TTL - SCHEMA_REFRESH_AHEAD, 1.0)
+    loaded = None
+
+    async def load():
+        nonlocal loaded
+        loaded = await _read_schema_snapshot(key, previous)
+        return loaded.schema, loaded.versions
+
+    entry = await shared_cache.load("schema", key, load, shared_ttl)
+    if loaded is not None:
+        return loaded
+    schema, versions = entry.value
+    snapshot = SchemaSnapshot(schema, versions, "shared")
+    snapshot.loaded_at -= shared_ttl - entry.ttl
+    return snapshot
+
+# Schema cache keyed by (server, database, schema); a connection is only
+# checked out when the schema actually has to be (re)loaded
+schema_cache = SchemaCache(
+    leased_load(_load_schema_snapshot),
+    ttl=SCHEMA_CACHE_TTL,
+    refresh_ahead=SCHEMA_REFRESH_AHEAD,
+)
+
+async def get_db_schema(schema_name: Optional[str] = None):
+    route = get_route()
+    return await schema_cache.get(route.database.key + (schema_name or route.schema,))
+
+# Content hash of a schema, the ETag of GET /schema. Memoized per cached schema
+# object (held by the entry, so its id is not reused while the entry lives).
+schema_fingerprints = TTLCache(ttl=None, max_entries=max(DB_MAX_POOLS, 16))
+
+def schema_fingerprint(schema: Dict[str, Any]) -> str:
+    entry = schema_fingerprints.get(id(schema))
+    if entry is not None and entry[0] is schema:
+        return entry[1]
+    canonical = json.dumps(schema, cls=CustomJSONEncoder, sort_keys=True, separators=(",", ":"))
+    fingerprint = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+    schema_fingerprints.set(id(schema), (schema, fingerprint))
+    return fingerprint
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # Weak comparison, as for If-None-Match: W/ prefixes are ignored
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    return any(
+        (tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()) == wanted
+        for tag in if_none_match.split(",")
+    )
+
+# The schema the React app shows, revalidated with If-None-Match: unchanged
+# schemas cost a 304 instead of the full body. The ETag is weak because the
+# body may be sent compressed.
+@app.get("/schema")
+async def get_schema(request: Request, database: Optional[str] = None, schemaName: Optional[str] = None):
+    with database_route(database, schemaName) as routed:
+        schema = await get_db_schema()
+        schema_name = get_route().schema
+    fingerprint = schema_fingerprint(schema)
+    headers = {"ETag": f'W/"{fingerprint}"', "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return CustomJSONResponse(
+        content={
+            "status": "success",
+            "database": routed.name,
+            "schemaName": schema_name,
+            "fingerprint": fingerprint,
+            "schema": schema,
+        },
+        headers=headers,
+    )
+
+if COMPRESSION_MIN_BYTES > 0:
+    app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_BYTES)
+
+def _json_size(value) -> int:
+    return len(json.dumps(value, cls=CustomJSONEncoder))
+
+# Sample rows keyed by (server, database, schema, table, limit), bounded by TTL and total size
+sample_cache = TTLCache(
+    ttl=SAMPLE_CACHE_TTL,
+    max_entries=SAMPLE_CACHE_MAX_ENTRIES,
+    max_bytes=SAMPLE_CACHE_MAX_BYTES,
+    sizeof=_json_size,
+)
+
+async def sample_tables(tables: List[str], limit=5) -> Dict[str, List[Dict[str, Any]]]:
+    semaphore = asyncio.Semaphore(SAMPLE_CONCURRENCY)
+    route = get_route()
+
+    async def read(table):
+        async with semaphore:
+            async with get_db_pool() as pool:
+                rows = await sample_table_data(pool, f"{route.schema}.{table}", limit)
+        # sample_table_data returns [] on failure, so only non-empty samples are cached
+        return rows or None
+
+    async def sample(table):
+        key = route.database.key + (route.schema, table, limit)
+        cached = sample_cache.get(key)
+        if cached is not None:
+            return cached
+        ttl = None
+        if shared_cache is None:
+            rows = await read(table)
+        else:
+            entry = await shared_cache.load("samples", key, partial(read, table), SAMPLE_CACHE_TTL)
+            rows, ttl = entry.value, entry.ttl
+        if rows:
+            sample_cache.set(key, rows, ttl=ttl)
+        return rows or []
+
+    samples = await asyncio.gather(*(sample(table) for table in tables))
+    return dict(zip(tables, samples))
 
 async def sample_table_data(pool, table_name, limit=5):
     try:
-        cursor = pool.cursor()
-        query = f'SELECT TOP {limit} * FROM {table_name}'
-        cursor.execute(query)
-        columns = [column[0] for column in cursor.description]
-        rows = cursor.fetchall()
-        cursor.close()
-        
-        # Convert rows to dictionaries and handle datetime objects
-        result = []
-        for row in rows:
-            row_dict = {}
-            for i, val in enumerate(row):
-                # Convert datetime objects to ISO format strings
-                if isinstance(val, (datetime, date)):
-                    row_dict[columns[i]] = val.isoformat()
-                else:
-                    row_dict[columns[i]] = val
-            result.append(row_dict)
-        return result
+        return await run_db(_fetch_table_sample, pool, table_name, limit)
     except Exception as e:
         return []
 
+def _fetch_table_sample(pool, table_name, limit):
+    cursor = pool.cursor()
+    query = f'SELECT TOP {limit} * FROM {table_name}'
+    cursor.execute(query)
+    converter = RowConverter.from_cursor(cursor)
+    rows = cursor.fetchall()
+    cursor.close()
+    return converter.to_dicts(rows)
+
+async def _read_table_profile(schema_key, table, version):
+    _, _, schema_name = schema_key
+    schema = await get_db_schema(schema_name)
+    columns = [(column["name"], column["type"]) for column in schema.get(table, {}).get("columns", [])]
+    if not columns:
+        raise KeyError(f"{schema_name}.{table} is not in the schema")
+    async with get_db_pool() as pool:
+        return await run_db(
+            profile_table, pool, schema_name, table, columns,
+            version.rows if version is not None else None, PROFILE_SAMPLE_ROWS, PROFILE_TOP_VALUES
+        )
+
+async def _read_table_stats(schema_key):
+    async with get_db_pool() as pool:
+        return await run_db(load_table_stats, pool, schema_key[2])
+
+# With the shared cache the change checks and the profiles themselves are done
+# once per host. A profile is shared under the table version it was computed
+# from, so a changed table is re-profiled by one worker and the others take it.
+async def _profile_table(schema_key, table, version):
+    if shared_cache is None:
+        return await _read_table_profile(schema_key, table, version)
+    entry = await shared_cache.load(
+        "profiles", schema_key + (table, version), partial(_read_table_profile, schema_key, table, version),
+        PROFILE_TTL
+    )
+    return entry.value
+
+async def _load_table_stats(schema_key):
+    if shared_cache is None:
+        return await _read_table_stats(schema_key)
+    entry = await shared_cache.load(
+        "tableStats", schema_key, partial(_read_table_stats, schema_key), PROFILE_CHECK_INTERVAL
+    )
+    if entry.loaded:
+        return entry.value
+    # The versions come back from JSON as [rows, last_update] pairs
+    return {table: TableVersion(*version) for table, version in entry.value.items()}
+
+# Table profiles keyed by (server, database, schema, table)
+profile_cache = TableProfileCache(
+    leased_load(_profile_table),
+    leased_load(_load_table_stats),
+    ttl=PROFILE_TTL,
+    max_entries=PROFILE_MAX_ENTRIES,
+    check_interval=PROFILE_CHECK_INTERVAL,
+    refresh_interval=PROFILE_REFRESH_INTERVAL,
+    change_fraction=PROFILE_CHANGE_FRACTION,
+    concurrency=PROFILE_CONCURRENCY,
+)
+
+async def profile_tables(tables: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    route = get_route()
+    return await profile_cache.get_many(route.database.key + (route.schema,), tables)
+
+# The data shown in the prompt for `tables` (PROMPT_TABLE_DATA), and the part of
+# it and of the schema that fits the token budget
+async def load_table_data(tables: List[str]) -> Dict[str, Any]:
+    if PROMPT_TABLE_DATA == "profiles":
+        return await profile_tables(tables)
+    return await sample_tables(tables)
+
+def build_context(schema: Dict[str, Any], tables: List[str], table_data: Dict[str, Any]) -> Dict[str, Any]:
+    if PROMPT_TABLE_DATA == "profiles":
+        return fit_profile_context(schema, tables, table_data, PROMPT_TOKEN_BUDGET)
+    return fit_context(schema, tables, table_data, PROMPT_TOKEN_BUDGET)
+
+@app.get("/profiles")
+async def get_table_profiles(
+    table: Optional[List[str]] = Query(None), database: Optional[str] = None, schemaName: Optional[str] = None
+):
+    # Profiles of the given tables (default: every table), computed if missing
+    with database_route(database, schemaName) as leased:
+        schema = await get_db_schema()
+        tables = [name for name in table if name in schema] if table else list(schema)
+        profiles = await profile_tables(tables)
+        return {
+            "status": "success",
+            "database": leased.name,
+            "schemaName": get_route().schema,
+            "profiles": profiles,
+        }
+
+# Start-up warm-up: each step fills something the first requests would otherwise
+# pay for (connection handshakes, schema load, table data, LLM connection, tokenizer)
+startup = Warmup(started_at=_import_started, retry_interval=WARMUP_RETRY_INTERVAL)
+
+async def _warm_samples():
+    schema = await get_db_schema()
+    if WARMUP_TABLES == ["*"]:
+        tables = list(schema)
+    else:
+        tables = [table for table in WARMUP_TABLES if table in schema]
+        unknown = sorted(set(WARMUP_TABLES) - set(tables))
+        if unknown:
+            print(f"WARMUP_TABLES not in schema {get_route().schema}: {', '.join(unknown)}")
+    await load_table_data(tables)
+
+async def _warm_llm():
+    from openai import APIStatusError
+    try:
+        await get_llm_client().models.list(timeout=WARMUP_LLM_TIMEOUT)
+    except APIStatusError:
+        pass  # any HTTP answer means the connection is open and pooled
+
+async def _warm_tokenizer():
+    await asyncio.get_running_loop().run_in_executor(None, load_tokenizer)
+
+if WARMUP_ENABLED:
+    if WARMUP_POOL:
+        startup.add("pool", db_pool.start)
+    if WARMUP_SCHEMA:
+        startup.add("schema", get_db_schema)
+    if WARMUP_TABLES:
+        startup.add("samples", _warm_samples)
+    if WARMUP_LLM:
+        startup.add("llm", _warm_llm)
+    startup.add("tokenizer", _warm_tokenizer)
+
+# Readiness probe: 503 until the warm-up has finished
+@app.get("/ready")
+async def ready():
+    stats = startup.stats()
+    if startup.ready:
+        return {"status": "ready", **stats}
+    return CustomJSONResponse(
+        status_code=503,
+        content={"status": "starting", **stats},
+        headers={"Retry-After": "1"},
+    )
+
+class FirstRequestTimer:
+    # ASGI middleware timing the first real request (probes, stats endpoints and
+    # CORS preflights excluded) until its response has been sent, streaming
+    # included; every later request passes straight through
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in ("/ready", "/metrics")
+                or scope["path"].endswith("/stats") or not startup.claim_first_request()):
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            startup.record_first_request(scope["path"], time.perf_counter() - started)
+
+app.add_middleware(FirstRequestTimer)
+
+metrics_registry.callback("aidb_ready", "gauge", "1 once the start-up warm-up has finished", (),
+                          lambda: [((), int(startup.ready))])
+def _startup_metric():
+    stats = startup.stats()
+    phases = (("import", stats["importMs"]), ("ready", stats["startupMs"]))
+    return [((phase,), ms / 1000) for phase, ms in phases if ms is not None]
+
+metrics_registry.callback(
+    "aidb_startup_seconds", "gauge", "Module import time and time from import to ready", ("phase",),
+    _startup_metric
+)
+metrics_registry.callback(
+    "aidb_first_request_seconds", "gauge", "Latency of the first request after start-up", (),
+    lambda: [((), startup.first_request["latencyMs"] / 1000)] if startup.first_request else []
+)
+
+QueryBatch = namedtuple("QueryBatch", ["columns", "rows", "row_count", "byte_count", "truncated"])
+
+class QueryTimeoutError(Exception):
+    pass
+
+def _open_cursor(pool, timeout):
+    # The ODBC query timeout (SQL_ATTR_QUERY_TIMEOUT) is applied to cursors when
+    # they are allocated; restore the connection default for later users
+    previous = pool.timeout
+    pool.timeout = max(1, math.ceil(timeout))
+    try:
+        return pool.cursor()
+    finally:
+        pool.timeout = previous
+
+def _execute_query(cursor, query):
+    cursor.execute(query)
+    return RowConverter.from_cursor(cursor)
+
+def _is_odbc_timeout(error: Exception) -> bool:
+    # Without pyodbc loaded no ODBC error can have been raised
+    pyodbc = sys.modules.get("pyodbc")
+    return pyodbc is not None and isinstance(error, pyodbc.Error) and bool(error.args) and error.args[0] == "HYT00"
+
+class QueryDeadline:
+    # Time budget for one statement, counted only while a database call is in
+    # flight so a slow consumer of streamed results does not use it up. When it
+    # runs out, or the awaiting task is cancelled (client disconnected), the
+    # statement is cancelled on the server with cursor.cancel().
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.remaining = timeout
+        self.cursor = None
+
+    async def run(self, fn, *args):
+        if self.remaining <= 0:
+            raise QueryTimeoutError(f"Query exceeded the {self.timeout:g}s timeout")
+        future = asyncio.ensure_future(run_db(fn, *args))
+        started = time.monotonic()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.remaining)
+        except asyncio.TimeoutError:
+            await self._cancel(future)
+            raise QueryTimeoutError(f"Query exceeded the {self.timeout:g}s timeout and was cancelled") from None
+        except asyncio.CancelledError:
+            await self._cancel(future)
+            raise
+        except Exception as e:
+            if _is_odbc_timeout(e):
+                raise QueryTimeoutError(f"Query exceeded the {self.timeout:g}s timeout") from e
+            raise
+        finally:
+            self.remaining -= time.monotonic() - started
+
+    async def _cancel(self, future):
+        # SQLCancel is safe to call from another thread and returns immediately;
+        # calling it here avoids queueing behind busy executor threads
+        if self.cursor is not None:
+            try:
+                self.cursor.cancel()
+            except Exception as e:
+                print(f"Query cancel failed: {e}")
+        # Let the interrupted call return so the connection is idle before it
+        # goes back to the pool (or is discarded when the task was cancelled)
+        try:
+            await asyncio.wait_for(future, QUERY_CANCEL_GRACE)
+        except BaseException:
+            pass
+
+def _fetch_batch(cursor, converter, size, limit, columnar):
+    # Rows beyond `limit` are only fetched to detect truncation and are never converted
+    rows = cursor.fetchmany(size)
+    over_limit = len(rows) > limit
+    rows = rows[:limit]
+    data = converter.to_columnar(rows) if columnar else converter.to_dicts(rows)
+    return data, len(rows), over_limit
+
+def _trim_to_bytes(data, budget, columnar):
+    rows = list(zip(*data.values())) if columnar else data
+    kept = 0
+    used = 2  # enclosing brackets
+    for row in rows:
+        size = _json_size(row) + 1
+        if used + size > budget:
+            break
+        kept += 1
+        used += size
+    data = slice_columnar(data, kept) if columnar else data[:kept]
+    return data, kept, _json_size(data)
+
+# Read a query's results with fetchmany, yielding QueryBatch objects until the
+# result set ends or the row/byte cap is hit (last batch has truncated=True).
+# With columnar=True each batch holds {column: [values]} instead of row dicts.
+# Time spent in the database is limited to `timeout` seconds (QueryTimeoutError).
+# Callers must consume the iterator to the end so the cursor gets closed.
+async def stream_query(pool, query, batch_size=None, max_rows=None, max_bytes=None, columnar=False, timeout=None) -> AsyncIterator[QueryBatch]:
+    batch_size = batch_size or QUERY_BATCH_SIZE
+    max_rows = max_rows or QUERY_MAX_ROWS
+    max_bytes = max_bytes or QUERY_MAX_BYTES
+    deadline = QueryDeadline(timeout or QUERY_TIMEOUT)
+    cursor = await run_db(_open_cursor, pool, deadline.timeout)
+    deadline.cursor = cursor
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        converter = await deadline.run(_execute_query, cursor, query)
+        row_count = 0
+        byte_count = 0
+        while True:
+            remaining = max_rows - row_count
+            # Ask for one extra row at the cap to tell "exactly max_rows" from "more"
+            data, count, truncated = await deadline.run(
+                _fetch_batch, cursor, converter, min(batch_size, remaining + 1), remaining, columnar
+            )
+            if count == 0 and not truncated:
+                break
+            size = _json_size(data)
+            if byte_count + size > max_bytes:
+                data, count, size = _trim_to_bytes(data, max_bytes - byte_count, columnar)
+                truncated = True
+            row_count += count
+            byte_count += size
+            yield QueryBatch(converter.columns, data, row_count, byte_count, truncated)
+            if truncated:
+                break
+        outcome = "ok"
+    except QueryTimeoutError:
+        outcome = "timeout"
+        raise
+    except (asyncio.CancelledError, GeneratorExit):
+        outcome = "cancelled"
+        raise
+    finally:
+        query_duration.observe(time.perf_counter() - started, outcome=outcome)
+        try:
+            await asyncio.shield(run_db(cursor.close))
+        except Exception:
+            pass
+
+def merge_batches(batches: List[Any], columnar=False):
+    # Concatenate the `rows` of consecutive QueryBatch objects into new lists,
+    # leaving the batches (possibly still queued as events) untouched
+    merged = None
+    for rows in batches:
+        if merged is None:
+            merged = {name: list(values) for name, values in rows.items()} if columnar else list(rows)
+        elif columnar:
+            for name, values in rows.items():
+                merged[name].extend(values)
+        else:
+            merged.extend(rows)
+    if merged is None:
+        merged = {} if columnar else []
+    return merged
+
+# With `stored` the rows are also written to the result store (the summary gets
+# its resultId); with `collect_bytes` the summary only has "results" when they
+# fit in that many bytes, so a paged result is not held whole in memory
+async def execute_query(pool, query, columnar=False, timeout=None, stored=None, collect_bytes=None, max_rows=None) -> Dict[str, Any]:
+    batches = []
+    row_count = 0
+    truncated = False
+    try:
+        async for batch in stream_query(pool, query, max_rows=max_rows, columnar=columnar, timeout=timeout):
+            stored = await store_batch(stored, batch)
+            if batches is not None:
+                batches.append(batch.rows)
+                if collect_bytes is not None and batch.byte_count > collect_bytes:
+                    batches = None
+            row_count = batch.row_count
+            truncated = batch.truncated
+    except BaseException:
+        if stored is not None:
+            result_store.finish(stored, truncated, aborted=True)
+        raise
+    summary = {"rowCount": row_count, "truncated": truncated}
+    if batches is not None:
+        summary["results"] = merge_batches(batches, columnar)
+    if stored is not None:
+        result_store.finish(stored, truncated)
+        summary["resultId"] = stored.result_id
+    return summary
+
+result_store = ResultStore(
+    encode=lambda values: json.dumps(values, cls=CustomJSONEncoder, ensure_ascii=False, separators=(",", ":")),
+    directory=RESULT_STORE_DIR,
+    ttl=RESULT_STORE_TTL,
+    memory_bytes=RESULT_MEMORY_BYTES,
+    spill_bytes=RESULT_SPILL_BYTES,
+    max_entries=RESULT_STORE_MAX_ENTRIES,
+    max_disk_bytes=RESULT_STORE_MAX_BYTES,
+) if RESULT_STORE_TTL > 0 else None
+
+def create_stored_result():
+    return result_store.create() if result_store is not None else None
+
+# Storing is best effort: when a write fails (e.g. the disk is full) the result
+# is dropped from the store and the query carries on without it
+async def store_batch(stored, batch):
+    if stored is None:
+        return None
+    try:
+        await result_store.append(stored, batch.columns, batch.rows)
+        return stored
+    except Exception as e:
+        print(f"Result store write failed: {e}")
+        result_store.delete(stored.result_id)
+        return None
+
+# The stored result of a query summary; a cached summary whose result has expired
+# from the store is stored again under a new resultId
+async def ensure_stored(summary: Dict[str, Any], columnar: bool):
+    if result_store is None:
+        return None
+    stored = result_store.get(summary["resultId"]) if summary.get("resultId") else None
+    if stored is None and "results" in summary:
+        batches = cached_batches(summary, columnar)
+        columns = batches[0].columns if batches else []
+        try:
+            stored = await result_store.store_rows(columns, (batch.rows for batch in batches), summary["truncated"])
+        except Exception as e:
+            print(f"Result store write failed: {e}")
+            return None
+        summary["resultId"] = stored.result_id
+    return stored
+
+def page_rows(columns: List[str], rows: List[List[Any]], columnar: bool):
+    if columnar:
+        return {name: [row[i] for row in rows] for i, name in enumerate(columns)}
+    return [dict(zip(columns, row)) for row in rows]
+
+# Keep only the first `page_size` rows of a query summary, with a nextCursor for
+# the rest (None when there is none); without a result store rows stay whole
+async def page_query_summary(summary: Dict[str, Any], columnar: bool, page_size: int) -> Dict[str, Any]:
+    stored = await ensure_stored(summary, columnar)
+    if stored is None:
+        return summary
+    page_size = min(page_size, RESULT_PAGE_MAX_ROWS)
+    if "results" in summary:
+        results = summary["results"]
+        summary["results"] = slice_columnar(results, page_size) if columnar else results[:page_size]
+    else:
+        summary["results"] = page_rows(stored.columns or [], await result_store.read(stored, 0, page_size) or [], columnar)
+    summary["nextCursor"] = encode_cursor(stored.result_id, page_size) if summary["rowCount"] > page_size else None
+    return summary
+
+def _result_not_found():
+    return CustomJSONResponse(status_code=404, content={"status": "error", "message": "Unknown or expired result"})
+
+@app.get("/results/stats")
+async def result_store_stats():
+    return result_store.stats() if result_store is not None else {"enabled": False}
+
+# One page of a stored result. `cursor` is the nextCursor of the previous page
+# (or of a paged query summary); pages keep their place while the result is
+# still being written, and nextCursor is null after the last one
+@app.get("/results/{result_id}")
+async def get_result_page(
+    result_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(RESULT_PAGE_ROWS, ge=1),
+    resultFormat: Literal["rows", "columns"] = "rows",
+):
+    stored = result_store.get(result_id) if result_store is not None else None
+    if stored is None:
+        return _result_not_found()
+    try:
+        offset = decode_cursor(cursor, result_id) if cursor else 0
+    except InvalidCursorError as e:
+        return CustomJSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+    rows = await result_store.read(stored, offset, min(limit, RESULT_PAGE_MAX_ROWS))
+    if rows is None:
+        return _result_not_found()
+    offset = min(offset, stored.row_count)
+    stop = offset + len(rows)
+    more = stop < stored.row_count or not stored.complete
+    return {
+        "status": "success",
+        **stored.describe(),
+        "offset": offset,
+        "rowCount": len(rows),
+        "results": page_rows(stored.columns or [], rows, resultFormat == "columns"),
+        "nextCursor": encode_cursor(result_id, stop) if more else None,
+    }
+
+@app.delete("/results/{result_id}")
+async def delete_result(result_id: str):
+    if result_store is None or not result_store.delete(result_id):
+        return _result_not_found()
+    return {"status": "success"}
+
+@app.on_event("shutdown")
+async def close_result_store():
+    if result_store is not None:
+        await result_store.close()
+
+if result_store is not None:
+    metrics_registry.callback(
+        "aidb_result_store_bytes", "gauge", "Stored query result rows by tier", ("tier",),
+        lambda: [((tier,), result_store.stats()[stat]) for tier, stat in (("memory", "memoryBytes"), ("disk", "diskBytes"))]
+    )
+    metrics_registry.callback(
+        "aidb_result_store_entries", "gauge", "Stored query results by tier", ("tier",),
+        lambda: [((tier,), result_store.stats()[stat]) for tier, stat in (("memory", "memoryEntries"), ("disk", "diskEntries"))]
+    )
+    metrics_registry.callback(
+        "aidb_result_store_pages_total", "counter", "Result pages served", (), lambda: [((), result_store.pages)]
+    )
+
+# Runs in the context of the lookup, whose route is the database polled
+@leased_load
+async def _load_table_versions(database):
+    async with get_db_pool() as pool:
+        return await run_db(load_table_versions, pool)
+
+query_cache = QueryResultCache(
+    ttl=QUERY_CACHE_TTL,
+    max_entries=QUERY_CACHE_MAX_ENTRIES,
+    max_bytes=QUERY_CACHE_MAX_BYTES,
+    sizeof=_json_size,
+    max_entry_bytes=QUERY_CACHE_MAX_ENTRY_BYTES,
+    change_loader=_load_table_versions if QUERY_CACHE_TRACK_CHANGES else None,
+    change_poll_interval=QUERY_CACHE_CHANGE_POLL,
+)
+
+def query_cache_key(query: str, columnar: bool):
+    server, database = get_route().database.key
+    return query_result_key(server, database, query, "columns" if columnar else "rows")
+
+async def lookup_query_result(query: str, columnar: bool, use_cache: bool) -> Optional[Dict[str, Any]]:
+    if not use_cache:
+        query_cache.bypassed += 1
+        return None
+    return await query_cache.get(query_cache_key(query, columnar))
+
+async def _estimate_query_cost(sql: str):
+    async with get_db_pool() as pool:
+        return await run_db(estimate_query_cost, pool, sql)
+
+# Estimated cost of a guarded query against QUERY_COST_LIMIT: returns the query to
+# run (possibly downgraded to fewer rows) or raises SqlRejectedError. When the
+# plan cannot be estimated (e.g. no SHOWPLAN permission) the query runs with a note.
+async def check_query_cost(guarded: GuardedQuery) -> GuardedQuery:
+    if QUERY_COST_LIMIT <= 0:
+        return guarded
+    try:
+        estimate = await _estimate_query_cost(guarded.sql)
+    except Exception as e:
+        guarded.changes.append(f"Cost not checked: {e}")
+        return guarded
+    guarded.estimated_cost = estimate.cost
+    if estimate.cost <= QUERY_COST_LIMIT:
+        return guarded
+    reason = f"Estimated cost {estimate.cost:.2f} exceeds the limit of {QUERY_COST_LIMIT:g}"
+    if estimate.warnings:
+        reason += f" ({', '.join(estimate.warnings)})"
+    if QUERY_COST_ACTION != "downgrade":
+        raise SqlRejectedError(reason)
+    downgraded = guard_query(guarded.original, QUERY_DOWNGRADE_ROWS, extra_rows=1)
+    downgraded.changes = guarded.changes + downgraded.changes + [f"{reason}; downgraded to {QUERY_DOWNGRADE_ROWS} rows"]
+    downgraded.downgraded = True
+    try:
+        estimate = await _estimate_query_cost(downgraded.sql)
+    except Exception as e:
+        raise SqlRejectedError(f"{reason}; the downgraded query could not be estimated: {e}") from e
+    downgraded.estimated_cost = estimate.cost
+    if estimate.cost > QUERY_COST_LIMIT:
+        raise SqlRejectedError(f"{reason}, and still {estimate.cost:.2f} with TOP ({QUERY_DOWNGRADE_ROWS})")
+    return downgraded
+
+# Guard a generated query and look it up in the result cache; on a miss, check its
+# cost. Returns (query to run, cache key, cached summary or None). Results are
+# cached under the SQL that ran: a hit on the statically guarded SQL needs no
+# SHOWPLAN round trip, a downgraded query is looked up again under its own SQL.
+async def prepare_query(query: str, columnar: bool, use_cache: bool):
+    guarded = guard_query(query, QUERY_MAX_ROWS, extra_rows=1)  # one extra row to detect truncation
+    key = query_cache_key(guarded.sql, columnar)
+    cached = await lookup_query_result(guarded.sql, columnar, use_cache)
+    if cached is None:
+        guarded = await check_query_cost(guarded)
+        if guarded.downgraded:
+            key = query_cache_key(guarded.sql, columnar)
+            if use_cache:
+                cached = await query_cache.get(key)
+    return guarded, key, cached
+
+# execute_query on a pooled connection, served from the query result cache when
+# possible. With `page_size` only the first page of rows is returned (see
+# page_query_summary), and results too large for the cache are not kept whole.
+async def cached_execute_query(query: str, columnar=False, use_cache=True, page_size=None) -> Dict[str, Any]:
+    guarded, key, cached = await prepare_query(query, columnar, use_cache)
+    if cached is not None:
+        summary = {**cached, "cacheHit": True}
+        if await ensure_stored(summary, columnar) is not None:
+            cached["resultId"] = summary["resultId"]  # later hits share the re-stored result
+    else:
+        paged = bool(page_size) and result_store is not None
+        async with get_db_pool() as pool:
+            summary = await execute_query(
+                pool, guarded.sql, columnar=columnar, stored=create_stored_result(),
+                collect_bytes=QUERY_CACHE_MAX_ENTRY_BYTES if paged else None, max_rows=guarded.max_rows
+            )
+        summary.update(guarded.report())
+        if "results" in summary:
+            query_cache.set(key, summary)
+        summary = {**summary, "cacheHit": False}
+    if page_size:
+        summary = await page_query_summary(summary, columnar, page_size)
+    return summary
+
+# Replay a cached execute_query result as QueryBatch objects of `batch_size` rows
+def cached_batches(summary: Dict[str, Any], columnar=False, batch_size=None) -> List[QueryBatch]:
+    batch_size = batch_size or QUERY_BATCH_SIZE
+    results = summary["results"]
+    total = columnar_length(results) if columnar else len(results)
+    columns = list(results) if columnar else list(results[0]) if results else []
+    batches = []
+    for start in range(0, total, batch_size):
+        stop = min(start + batch_size, total)
+        rows = slice_columnar(results, stop, start) if columnar else results[start:stop]
+        last = stop == total
+        batches.append(QueryBatch(columns, rows, stop, None, summary["truncated"] and last))
+    return batches
+
+def query_error_summary(error: Exception) -> Dict[str, Any]:
+    if isinstance(error, SqlRejectedError):
+        return {"error": str(error), "rejected": True}
+    if isinstance(error, QueryTimeoutError):
+        return {"error": str(error), "timedOut": True}
+    return {"error": str(error)}
+
+# Run suggested queries concurrently (at most QUERY_CONCURRENCY at a time), each
+# on its own pooled connection; returns {"query_<n>": result} in query order
+async def execute_queries(queries: List[str], columnar=False, use_cache=True, page_size=None) -> Dict[str, Dict[str, Any]]:
+    semaphore = asyncio.Semaphore(QUERY_CONCURRENCY)
+
+    async def run(query):
+        async with semaphore:
+            try:
+                summary = await cached_execute_query(query, columnar=columnar, use_cache=use_cache, page_size=page_size)
+                return {"sql": query, **summary}
+            except Exception as e:
+                return {"sql": query, **query_error_summary(e)}
+
+    results = await asyncio.gather(*(run(query) for query in queries))
+    return {f"query_{i+1}": result for i, result in enumerate(results)}
+
+# Await `coro`, cancelling it (and with it any running statements) if the
+# client of a non-streaming request goes away first
+async def cancel_on_disconnect(request: Request, coro, poll_interval=0.5):
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                print("Client disconnected, cancelling running queries")
+                task.cancel()
+                return await task
+    finally:
+        if not task.done():
+            task.cancel()
+
+# Tables relevant to the goal: the requested ones, or the best matches from the
+# keyword/FK ranking when none were given
+def select_tables(goal: str, tables: Optional[List[str]], schema: Dict[str, Any]) -> List[str]:
+    if tables:
+        return [table for table in tables if table in schema]
+    return rank_tables(goal, schema, PROMPT_MAX_TABLES)
+
+def count_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(count_tokens(message["content"]) for message in messages)
+
+def encode_table_data(context: Dict[str, Any]) -> str:
+    if "profiles" in context:
+        return (
+            "Column profiles from a sample of each table (null share, value range, distinct values, "
+            "frequent values with their share of rows):\n"
+            + encode_profiles(context["profiles"], context["topValues"])
+        )
+    return "Here are sample rows (column names, then one JSON array per row):\n" + encode_samples(context["samples"])
+
 def generate_prompt(goal: str, context: Dict[str, Any]) -> List[Dict[str, str]]:
-    print("Generating prompt for AI with the following context:")
-    print("Goal:", goal)
-    print("Schema:", json.dumps(context['schema'], indent=2))
-    print("Samples:", json.dumps(context['samples'], indent=2, cls=CustomJSONEncoder))
+    print(f"Generating prompt for goal {goal!r} with tables: {', '.join(context['schema'])}")
     
     return [
         {
             "role": "system",
             "content": f"""You are a data analysis assistant with SQL expertise.
 
-The database schema is:
-{json.dumps(context['schema'], indent=2)}
+The database schema is (one table per line, "?" marks nullable columns, FK lists foreign keys):
+{encode_schema(context['schema'])}
 
-Here are sample rows:
-{json.dumps(context['samples'], indent=2, cls=CustomJSONEncoder)}
+{encode_table_data(context)}
 
 Return:
 1. Summary of structure related to goal
 2. 2 SQL queries to achieve goal
 3. Explanation for each query
 4. queries should use Microsoft T-SQL syntax
-5. Use SalesLT Database schema
+5. Use the {get_route().schema} database schema
 6. Observations on data quality"""
         },
         {
@@ -249,26 +1413,145 @@ Return:
         }
     ]
 
-async def call_openai(messages):
+def analysis_cache_key(request: AnalyzeThis, messages) -> Optional[str]:
+    if not request.useCache:
+        llm_cache.bypassed += 1
+        return None
+    return llm_cache_key(request.analysisGoal, messages, AZURE_DEPLOYMENT_NAME, LLM_TEMPERATURE)
+
+def record_llm_usage(usage):
+    if usage is not None:
+        llm_tokens.inc(usage.prompt_tokens or 0, kind="prompt")
+        llm_tokens.inc(usage.completion_tokens or 0, kind="completion")
+        # The limiter charged LLM_MAX_TOKENS completion tokens up front
+        llm_limiter.refund(LLM_MAX_TOKENS - (usage.completion_tokens or 0))
+
+# One chat completion request, admitted by the rate limiter. A 429 pauses every
+# caller in the worker (not just the one that received it) before the retry.
+async def create_completion(messages, prompt_tokens: Optional[int] = None, **options):
+    from openai import APIConnectionError, InternalServerError, RateLimitError
+    if prompt_tokens is None:
+        prompt_tokens = count_prompt_tokens(messages)
+    attempt = 0
+    while True:
+        await llm_limiter.acquire(prompt_tokens + LLM_MAX_TOKENS)
+        started = time.perf_counter()
+        try:
+            response = await get_llm_client().chat.completions.create(
+                model=AZURE_DEPLOYMENT_NAME,  # For Azure, we still need to provide the model/deployment name
+                messages=messages,
+                temperature=LLM_TEMPERATURE,
+                max_tokens=LLM_MAX_TOKENS,
+                **options
+            )
+            observe_latency("llm", time.perf_counter() - started)
+            return response
+        except (RateLimitError, InternalServerError, APIConnectionError) as e:
+            rate_limited = isinstance(e, RateLimitError)
+            if rate_limited:
+                llm_limiter.rate_limited += 1
+            if attempt >= llm_limiter.max_retries:
+                llm_limiter.failures += 1
+                raise
+            delay = llm_limiter.backoff(attempt, retry_after_seconds(e) if rate_limited else None)
+            if rate_limited:
+                llm_limiter.pause(delay)
+            llm_limiter.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+# Chat completion through the LLM cache; raises on API errors. With the shared
+# cache, workers missing the same key wait for the one that asks the API.
+async def complete_chat(messages, cache_key: Optional[str] = None, prompt_tokens: Optional[int] = None) -> str:
+    if cache_key is None:
+        return await _complete_chat(messages, prompt_tokens)
+    cached = await llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    return await llm_cache.load(cache_key, partial(_complete_chat, messages, prompt_tokens))
+
+async def _complete_chat(messages, prompt_tokens: Optional[int] = None) -> str:
+    async with llm_semaphore:
+        response = await create_completion(messages, prompt_tokens)
+    record_llm_usage(getattr(response, "usage", None))
+    return response.choices[0].message.content
+
+async def call_openai(messages, cache_key: Optional[str] = None, prompt_tokens: Optional[int] = None):
     try:
-        # Azure OpenAI API call - we need to include the model parameter
-        response = client.chat.completions.create(
-            model=AZURE_DEPLOYMENT_NAME,  # For Azure, we still need to provide the model/deployment name
-            messages=messages,
-            temperature=0.2,
-            max_tokens=1500
-        )
-        return response.choices[0].message.content
+        return await complete_chat(messages, cache_key, prompt_tokens)
     except Exception as e:
         print(f"AI API Error details: {str(e)}")
         return f"AI API Error: {str(e)}"
 
+# Streaming variant of call_openai: yields content deltas as they arrive.
+# A cached response is replayed as a single delta.
+async def stream_openai(messages, cache_key: Optional[str] = None, prompt_tokens: Optional[int] = None) -> AsyncIterator[str]:
+    if cache_key is not None:
+        cached = await llm_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+    # With the shared cache one worker on the host streams a given completion;
+    # the others wait and get its whole response as one delta
+    async with llm_cache.lock(cache_key) as cached:
+        if cached is not None:
+            yield cached
+            return
+        chunks = []
+        try:
+            async with llm_semaphore:
+                stream = await create_completion(
+                    messages,
+                    prompt_tokens,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                async with stream:
+                    async for chunk in stream:
+                        # The final chunk carries token usage and no choices
+                        record_llm_usage(getattr(chunk, "usage", None))
+                        # Azure sends an initial chunk with no choices (content filter results)
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta
+                        if delta is not None and delta.content:
+                            chunks.append(delta.content)
+                            yield delta.content
+        except Exception as e:
+            print(f"AI API Error details: {str(e)}")
+            prefix = "\n" if chunks else ""
+            yield f"{prefix}AI API Error: {str(e)}"
+            return
+        if cache_key is not None and chunks:
+            await llm_cache.set(cache_key, "".join(chunks))
+
+SQL_BLOCK_PATTERN = re.compile(r"```sql\s*(.*?)\s*```", re.DOTALL)
+
 def extract_sql_queries(ai_response: str) -> List[str]:
-    import re 
-    from collections import namedtuple
-    matches = re.findall(r"```sql\s*(.*?)\s*```", ai_response, re.DOTALL)
+    matches = SQL_BLOCK_PATTERN.findall(ai_response)
     return [m.strip() for m in matches if m.strip()]
 
+# Prefix the known tables in the extracted SQL queries with the schema ("SalesLT.")
+def qualify_queries(queries: List[str], schema: Dict[str, Any]) -> List[str]:
+    return [qualify_tables(query, get_route().schema, schema) for query in queries]
+
+class SqlBlockScanner:
+    # Incremental extract_sql_queries: feed completion deltas and get back each
+    # query as soon as its closing fence has arrived
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+
+    def feed(self, delta: str) -> List[str]:
+        self._buffer += delta
+        queries = []
+        for match in SQL_BLOCK_PATTERN.finditer(self._buffer, self._pos):
+            self._pos = match.end()
+            query = match.group(1).strip()
+            if query:
+                queries.append(query)
+        return queries
+
 # Add a default analysis request for GET requests
 DEFAULT_ANALYSIS = {
     "analysisGoal": "Find the top 5 customers by order value",
@@ -276,347 +1559,917 @@ DEFAULT_ANALYSIS = {
     "executeQueries": True
 }
 
+# Admission control in front of the analysis pipeline (see ADMISSION_*).
+# Streamed analyses hold their slot until the stream ends.
+admission = AdmissionController(
+    ADMISSION_MAX_IN_FLIGHT,
+    max_queue=ADMISSION_MAX_QUEUE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    max_per_client=ADMISSION_MAX_PER_CLIENT,
+    adaptive=ADMISSION_ADAPTIVE,
+    targets={"llm": ADMISSION_LLM_TARGET, "db": ADMISSION_DB_TARGET},
+    min_limit=ADMISSION_MIN_IN_FLIGHT,
+) if ADMISSION_MAX_IN_FLIGHT > 0 else None
+
+admission_wait = metrics_registry.histogram(
+    "aidb_admission_wait_seconds", "Time analyses waited for admission", ("endpoint",)
+)
+
+def observe_latency(source: str, seconds: float):
+    if admission is not None:
+        admission.observe(source, seconds)
+
+def client_id(http_request: Request) -> Optional[str]:
+    client = http_request.headers.get(ADMISSION_CLIENT_HEADER)
+    if not client and http_request.client is not None:
+        client = http_request.client.host
+    return client
+
+async def acquire_admission(client: Optional[str], context: Optional[str], endpoint: str, wait: bool = False):
+    # Wait for a slot; returns the ticket (None without admission control) or
+    # raises AdmissionRejectedError, unless `wait` (see AdmissionController.acquire)
+    if admission is None:
+        return None
+    ticket = await admission.acquire(client, context, wait=wait)
+    admission_wait.observe(ticket.waited, endpoint=endpoint)
+    return ticket
+
+async def admit(http_request: Request, analyze_request: AnalyzeThis):
+    # acquire_admission for a request; leaving the queue on disconnect frees its place
+    if admission is None:
+        return None
+    return await cancel_on_disconnect(
+        http_request,
+        acquire_admission(client_id(http_request), analyze_request.contextId, http_request.url.path)
+    )
+
+def release_admission(ticket):
+    if ticket is not None:
+        ticket.release()
+
+@app.exception_handler(AdmissionRejectedError)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejectedError):
+    return CustomJSONResponse(
+        status_code=exc.status_code,
+        content={"status": "error", "message": str(exc), "reason": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.get("/admission/stats")
+async def admission_stats():
+    if admission is None:
+        return {"enabled": False}
+    return {"enabled": True, **admission.stats()}
+
+def _admission_metric(fn):
+    return lambda: [((), fn(admission))] if admission is not None else []
+
+metrics_registry.callback(
+    "aidb_admission_in_flight", "gauge", "Analyses admitted and running", (), _admission_metric(lambda a: a.in_flight)
+)
+metrics_registry.callback(
+    "aidb_admission_queued", "gauge", "Analyses waiting for admission", (), _admission_metric(lambda a: a.queued)
+)
+metrics_registry.callback(
+    "aidb_admission_limit", "gauge", "Current limit on running analyses", (), _admission_metric(lambda a: a.limit)
+)
+metrics_registry.callback(
+    "aidb_admission_shed_total", "counter", "Analyses rejected by admission control", ("reason",),
+    lambda: [((reason,), count) for reason, count in admission.shed.items()] if admission is not None else []
+)
+
 # Support GET method for the SSE endpoint
 @app.get("/analyze/sse")
 async def analyze_sse_get(request: Request):
-    return await _analyze_sse_handler(AnalyzeThis(**DEFAULT_ANALYSIS))
+    return await _analyze_sse_handler(AnalyzeThis(**DEFAULT_ANALYSIS), request)
 
 # Support POST method for the SSE endpoint
 @app.post("/analyze/sse")
-async def analyze_sse_post(request: AnalyzeThis):
-    return await _analyze_sse_handler(request)
+async def analyze_sse_post(request: AnalyzeThis, http_request: Request):
+    return await _analyze_sse_handler(request, http_request)
 
 # Common handler function for both GET and POST
-async def _analyze_sse_handler(analyze_request: AnalyzeThis):
+async def _analyze_sse_handler(analyze_request: AnalyzeThis, http_request: Request):
+    check_route(analyze_request.database, analyze_request.schemaName)
+    ticket = await admit(http_request, analyze_request)
+
     async def event_generator() -> AsyncIterator[str]:
-        # Send initial state event
-        yield format_sse_event({
+        try:
+            async for event in analysis_events(analyze_request, "/analyze/sse"):
+                yield format_sse_event(event)
+        finally:
+            release_admission(ticket)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'  # Disable buffering in Nginx
+        },
+        # Also releases the slot if the stream never started
+        background=BackgroundTask(release_admission, ticket)
+    )
+
+# Same events as /analyze/sse, one JSON object per line, with query results
+# always streamed in queryResultChunk batches
+@app.post("/analyze/stream")
+async def analyze_stream(request: AnalyzeThis, http_request: Request):
+    check_route(request.database, request.schemaName)
+    request.streamResults = True
+    ticket = await admit(http_request, request)
+
+    async def ndjson_generator() -> AsyncIterator[str]:
+        try:
+            async for event in analysis_events(request, "/analyze/stream"):
+                yield format_ndjson_event(event)
+        finally:
+            release_admission(ticket)
+
+    return StreamingResponse(
+        ndjson_generator(),
+        media_type="application/x-ndjson",
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        },
+        background=BackgroundTask(release_admission, ticket)
+    )
+
+# The analysis pipeline as a sequence of events, shared by the SSE and NDJSON
+# endpoints and jobs, run against the requested database
+async def analysis_events(analyze_request: AnalyzeThis, endpoint: str = "/analyze/sse") -> AsyncIterator[Dict[str, Any]]:
+    with database_route(analyze_request.database, analyze_request.schemaName):
+        events = _analysis_events(analyze_request, endpoint)
+        try:
+            async for event in events:
+                yield event
+        finally:
+            # Close the pipeline as soon as the consumer stops, so its cleanup
+            # (cancelling queries) runs while the database is still leased
+            await events.aclose()
+
+async def _analysis_events(analyze_request: AnalyzeThis, endpoint: str) -> AsyncIterator[Dict[str, Any]]:
+    timings = start_timings(endpoint)
+    # Send initial state event
+    yield {
+        "type": "state",
+        "data": {
+            "state": "running",
+            "message": f"Starting analysis for goal: {analyze_request.analysisGoal}"
+        }
+    }
+    
+    try:
+        # Send schema loading event
+        yield {
             "type": "state",
             "data": {
                 "state": "running",
-                "message": f"Starting analysis for goal: {analyze_request.analysisGoal}"
+                "message": "Loading database schema..."
             }
-        })
+        }
         
-        try:
-            async with get_db_pool() as pool:
-                # Send schema loading event
-                yield format_sse_event({
-                    "type": "state",
-                    "data": {
-                        "state": "running",
-                        "message": "Loading database schema..."
-                    }
-                })
-                
-                schema = await get_db_schema(pool)
-                tables_to_analyze = analyze_request.tables if analyze_request.tables else list(schema.keys())
-                context = {"schema": {}, "samples": {}}
-                
-                # Send tables loading event
-                yield format_sse_event({
-                    "type": "state",
-                    "data": {
-                        "state": "running",
-                        "message": f"Loading sample data from tables: {', '.join(tables_to_analyze)}"
-                    }
-                })
-                
-                for table in tables_to_analyze:
-                    if table in schema:
-                        context["schema"][table] = schema[table]
-                        context["samples"][table] = await sample_table_data(pool, table)
-                
-                # Send AI analysis event
-                yield format_sse_event({
-                    "type": "state",
-                    "data": {
-                        "state": "running",
-                        "message": "Analyzing data with AI..."
-                    }
-                })
-                
-                messages = generate_prompt(analyze_request.analysisGoal, context)
-                print("Generated messages for AI:", context.get("samples"))
-                ai_response = await call_openai(messages)
-                sql_queries = extract_sql_queries(ai_response)
-                
-                # Send the AI analysis result
-                yield format_sse_event({
-                    "type": "analysis",
-                    "data": {
-                        "goal": analyze_request.analysisGoal,
-                        "aiSuggestions": ai_response,
-                        "suggestedQueries": sql_queries
-                    }
-                })
-                
-                # Execute queries if requested
-                query_results = {}
-                if analyze_request.executeQueries and sql_queries:
-                    yield format_sse_event({
-                        "type": "state",
+        with timings.span("schema"):
+            schema = await get_db_schema()
+        tables_to_analyze = select_tables(analyze_request.analysisGoal, analyze_request.tables, schema)
+        
+        # Send tables loading event
+        yield {
+            "type": "state",
+            "data": {
+                "state": "running",
+                "message": f"Loading {'table profiles' if PROMPT_TABLE_DATA == 'profiles' else 'sample data'} for tables: {', '.join(tables_to_analyze)}"
+            }
+        }
+        
+        with timings.span("sampling"):
+            table_data = await load_table_data(tables_to_analyze)
+        
+        # Send AI analysis event
+        yield {
+            "type": "state",
+            "data": {
+                "state": "running",
+                "message": "Analyzing data with AI..."
+            }
+        }
+        
+        with timings.span("prompt"):
+            context = build_context(schema, tables_to_analyze, table_data)
+            messages = generate_prompt(analyze_request.analysisGoal, context)
+            prompt_tokens = count_prompt_tokens(messages)
+
+        # Query tasks report through a bounded queue, so a slow client applies
+        # backpressure to result fetching instead of buffering rows in memory
+        query_events: asyncio.Queue = asyncio.Queue(maxsize=QUERY_EVENT_BUFFER)
+        # Suggested queries run concurrently on separate pooled connections and
+        # report in completion order, tagged with their queryIndex
+        query_semaphore = asyncio.Semaphore(QUERY_CONCURRENCY)
+
+        async def run_suggested_query(index, query):
+            async with query_semaphore:
+                columnar = analyze_request.resultFormat == "columns"
+                if not analyze_request.streamResults:
+                    try:
+                        summary = await cached_execute_query(
+                            query, columnar=columnar, use_cache=analyze_request.useCache,
+                            page_size=analyze_request.resultPageSize
+                        )
+                    except Exception as e:
+                        summary = query_error_summary(e)
+                    query_results[f"query_{index}"] = {"sql": query, **summary}
+                    await query_events.put({
+                        "type": "queryError" if "error" in summary else "queryResult",
+                        "data": {"queryIndex": index, "sql": query, **summary}
+                    })
+                    return
+
+                # Streamed: every fetched batch goes out as its own chunk event,
+                # tagged with the resultId a client can resume from after a disconnect
+                summary = {"rowCount": 0, "truncated": False}
+                chunk_index = 0
+                result_id = None
+
+                async def send_chunk(batch):
+                    nonlocal chunk_index
+                    await query_events.put({
+                        "type": "queryResultChunk",
                         "data": {
-                            "state": "running",
-                            "message": "Executing SQL queries..."
+                            "queryIndex": index,
+                            "chunkIndex": chunk_index,
+                            "columns": batch.columns,
+                            "rows": batch.rows,
+                            "rowCount": batch.row_count,
+                            "truncated": batch.truncated,
+                            "resultId": result_id
                         }
                     })
-                    
-                    for i, query in enumerate(sql_queries):
+                    chunk_index += 1
+
+                try:
+                    guarded, key, cached = await prepare_query(query, columnar, analyze_request.useCache)
+                    if cached is not None:
+                        stored = await ensure_stored(cached, columnar)
+                        result_id = stored.result_id if stored is not None else None
+                        for batch in cached_batches(cached, columnar):
+                            await send_chunk(batch)
+                        summary = {name: value for name, value in cached.items() if name != "results"}
+                        summary["cacheHit"] = True
+                    else:
+                        # Results are collected for the cache only while they fit in one entry
+                        collected = [] if query_cache.enabled else None
+                        stored = create_stored_result()
+                        result_id = stored.result_id if stored is not None else None
+                        summary = {"rowCount": 0, "truncated": False, "cacheHit": False, **guarded.report()}
                         try:
-                            cursor = pool.cursor()
-                            cursor.execute(query)
-                            columns = [column[0] for column in cursor.description] if cursor.description else []
-                            result = cursor.fetchall()
-                            cursor.close()
-                            
-                            # Process results to handle datetime objects
-                            processed_results = []
-                            for row in result:
-                                row_dict = {}
-                                for j, val in enumerate(row):
-                                    # Convert datetime objects to ISO format strings
-                                    if isinstance(val, (datetime, date)):
-                                        row_dict[columns[j]] = val.isoformat()
-                                    else:
-                                        row_dict[columns[j]] = val
-                                processed_results.append(row_dict)
-                            
-                            query_results[f"query_{i+1}"] = {
-                                "sql": query,
-                                "results": processed_results
-                            }
-                            
-                            # Send each query result as it completes
-                            yield format_sse_event({
-                                "type": "queryResult",
-                                "data": {
-                                    "queryIndex": i + 1,
-                                    "sql": query,
-                                    "results": processed_results
-                                }
+                            async with get_db_pool() as pool:
+                                async for batch in stream_query(pool, guarded.sql, max_rows=guarded.max_rows, columnar=columnar):
+                                    summary.update(rowCount=batch.row_count, truncated=batch.truncated)
+                                    stored = await store_batch(stored, batch)
+                                    if collected is not None:
+                                        collected.append(batch.rows)
+                                        if batch.byte_count > QUERY_CACHE_MAX_ENTRY_BYTES:
+                                            collected = None
+                                    await send_chunk(batch)
+                        except BaseException:
+                            if stored is not None:
+                                result_store.finish(stored, summary["truncated"], aborted=True)
+                            raise
+                        if stored is not None:
+                            result_store.finish(stored, summary["truncated"])
+                            summary["resultId"] = stored.result_id
+                        if collected is not None:
+                            query_cache.set(key, {
+                                "results": merge_batches(collected, columnar),
+                                **{name: value for name, value in summary.items() if name != "cacheHit"}
                             })
-                            
-                        except Exception as e:
-                            query_results[f"query_{i+1}"] = {
-                                "sql": query,
-                                "error": str(e)
-                            }
-                            
-                            # Send error for this query
-                            yield format_sse_event({
-                                "type": "queryError",
+                except Exception as e:
+                    summary = query_error_summary(e)
+                query_results[f"query_{index}"] = {"sql": query, **summary}
+                await query_events.put({
+                    "type": "queryError" if "error" in summary else "queryResult",
+                    "data": {"queryIndex": index, "sql": query, **summary}
+                })
+
+        # Stream the completion token by token; each suggested query is
+        # started as soon as its closing fence arrives
+        scanner = SqlBlockScanner()
+        chunks = []
+        sql_queries = []
+        query_tasks = []
+        query_results = {}
+        llm_started = time.monotonic()
+        first_token_ms = None
+        queries_started = None
+        try:
+            async for delta in stream_openai(messages, analysis_cache_key(analyze_request, messages), prompt_tokens):
+                if first_token_ms is None:
+                    first_token_ms = round((time.monotonic() - llm_started) * 1000, 1)
+                chunks.append(delta)
+                yield {
+                    "type": "analysisDelta",
+                    "data": {"delta": delta}
+                }
+                for query in qualify_queries(scanner.feed(delta), schema):
+                    sql_queries.append(query)
+                    if analyze_request.executeQueries:
+                        if not query_tasks:
+                            queries_started = time.monotonic()
+                            yield {
+                                "type": "state",
                                 "data": {
-                                    "queryIndex": i + 1,
-                                    "sql": query,
-                                    "error": str(e)
+                                    "state": "running",
+                                    "message": "Executing SQL queries..."
                                 }
-                            })
-                
-                # Send final completion event
-                yield format_sse_event({
-                    "type": "state",
-                    "data": {
-                        "state": "complete",
-                        "message": "Analysis completed successfully"
-                    }
-                })
-                
-                # Send the full results at the end
-                yield format_sse_event({
-                    "type": "result",
-                    "data": {
-                        "status": "success",
-                        "analysis": {
-                            "goal": analyze_request.analysisGoal,
-                            "aiSuggestions": ai_response,
-                            "suggestedQueries": sql_queries,
-                            "results": query_results
-                        },
-                        "context": {
-                            "contextId": analyze_request.contextId,
-                            "timestamp": datetime.utcnow().isoformat()
-                        }
-                    }
-                })
-                
-        except Exception as e:
-            # Send error event if anything fails
-            yield format_sse_event({
-                "type": "error",
+                            }
+                        query_tasks.append(asyncio.create_task(run_suggested_query(len(sql_queries), query)))
+                # Report query progress made while the completion is still streaming
+                while not query_events.empty():
+                    yield query_events.get_nowait()
+
+            ai_response = "".join(chunks)
+            timings.add("llm", time.monotonic() - llm_started)
+            if first_token_ms is not None:
+                timings.add("llmFirstToken", first_token_ms / 1000)
+
+            # Send the AI analysis result
+            yield {
+                "type": "analysis",
                 "data": {
-                    "message": f"Error during analysis: {str(e)}"
+                    "goal": analyze_request.analysisGoal,
+                    "aiSuggestions": ai_response,
+                    "suggestedQueries": sql_queries,
+                    "promptTokens": prompt_tokens,
+                    "timeToFirstTokenMs": first_token_ms
                 }
-            })
-    
+            }
+
+            # Drain the remaining query events until every query has finished
+            async def close_query_events(tasks):
+                await asyncio.gather(*tasks)
+                await query_events.put(None)
+
+            closer = asyncio.create_task(close_query_events(list(query_tasks)))
+            query_tasks.append(closer)
+            while True:
+                event = await query_events.get()
+                if event is None:
+                    break
+                yield event
+            if queries_started is not None:
+                timings.add("queries", time.monotonic() - queries_started)
+        finally:
+            # Also reached when the client disconnects: cancelling the tasks
+            # cancels their statements on the server
+            for task in query_tasks:
+                task.cancel()
+        
+        # Send final completion event
+        yield {
+            "type": "state",
+            "data": {
+                "state": "complete",
+                "message": "Analysis completed successfully"
+            }
+        }
+
+        # Where the time went, in milliseconds per stage
+        timings.finish()
+        if timings.enabled:
+            yield {
+                "type": "timing",
+                "data": timings.as_dict()
+            }
+        
+        # Send the full results at the end. Slim: the analysis text is in the
+        # "analysis" event and rows are in the queryResult/queryResultChunk
+        # events; each result keeps its summary and the queryIndex to match
+        if analyze_request.slimResult:
+            analysis = {
+                "goal": analyze_request.analysisGoal,
+                "suggestedQueries": sql_queries,
+                "results": {
+                    name: {
+                        "queryIndex": int(name.split("_")[1]),
+                        **{k: v for k, v in result.items() if k not in ("sql", "results")}
+                    }
+                    for name, result in query_results.items()
+                },
+                "slim": True
+            }
+        else:
+            analysis = {
+                "goal": analyze_request.analysisGoal,
+                "aiSuggestions": ai_response,
+                "suggestedQueries": sql_queries,
+                "results": query_results
+            }
+        yield {
+            "type": "result",
+            "data": {
+                "status": "success",
+                "analysis": analysis,
+                "context": {
+                    "contextId": analyze_request.contextId,
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+            }
+        }
+        
+    except Exception as e:
+        # Send error event if anything fails
+        yield {
+            "type": "error",
+            "data": {
+                "message": f"Error during analysis: {str(e)}"
+            }
+        }
+
+# Keep the original endpoint for backward compatibility
+@app.post("/analyze")
+async def analyze(request: AnalyzeThis, http_request: Request, response: Response):
+    check_route(request.database, request.schemaName)
+    ticket = await admit(http_request, request)
+    try:
+        return await _analyze(request, http_request, response)
+    finally:
+        release_admission(ticket)
+
+async def _analyze(request: AnalyzeThis, http_request: Request, response: Response):
+    with database_route(request.database, request.schemaName):
+        timings = start_timings("/analyze")
+        with timings.span("schema"):
+            schema = await get_db_schema()  # Fetch schema details
+        # Use the provided tables or the ones most relevant to the goal
+        tables_to_analyze = select_tables(request.analysisGoal, request.tables, schema)
+        # Tables are sampled or profiled concurrently on separate pooled connections
+        with timings.span("sampling"):
+            table_data = await load_table_data(tables_to_analyze)
+        with timings.span("prompt"):
+            context = build_context(schema, tables_to_analyze, table_data)
+            messages = generate_prompt(request.analysisGoal, context)
+            prompt_tokens = count_prompt_tokens(messages)
+        with timings.span("llm"):
+            ai_response = await call_openai(messages, analysis_cache_key(request, messages), prompt_tokens)
+        sql_queries = qualify_queries(extract_sql_queries(ai_response), schema)
+
+        query_results = {}
+        if request.executeQueries and sql_queries:
+            with timings.span("queries"):
+                query_results = await cancel_on_disconnect(
+                    http_request,
+                    execute_queries(
+                        sql_queries, columnar=request.resultFormat == "columns", use_cache=request.useCache,
+                        page_size=request.resultPageSize
+                    )
+                )
+
+        timings.finish()
+        if timings.enabled:
+            response.headers["Server-Timing"] = timings.server_timing()
+
+        # Include schema details in the response, or with schemaFormat
+        # "fingerprint" only the hash to compare with GET /schema's ETag
+        body = {
+            "status": "success",
+            "analysis": {
+                "goal": request.analysisGoal,
+                "aiSuggestions": ai_response,
+                "suggestedQueries": sql_queries,
+                "promptTokens": prompt_tokens,
+                "results": query_results
+            },
+            "schemaFingerprint": schema_fingerprint(schema),
+            "context": {
+                "contextId": request.contextId,
+                "timestamp": datetime.utcnow().isoformat()
+            }
+        }
+        if request.schemaFormat == "full":
+            body["schema"] = schema  # Add schema details here
+        return body
+
+# Many goals in one request, e.g. for scheduled reports. Schema and table data are
+# loaded once, the prompt context is built once per distinct table set, and the
+# LLM calls share the rate limiter. One NDJSON line per goal as each finishes.
+@app.post("/analyze/batch")
+async def analyze_batch(request: AnalyzeBatch, http_request: Request):
+    if not request.goals or len(request.goals) > BATCH_MAX_GOALS:
+        return CustomJSONResponse(
+            status_code=400,
+            content={"status": "error", "message": f"A batch needs between 1 and {BATCH_MAX_GOALS} goals"}
+        )
+    check_route(request.database, request.schemaName)
+    client = client_id(http_request)
+
+    async def ndjson_generator() -> AsyncIterator[str]:
+        async for event in batch_events(request, client):
+            yield format_ndjson_event(event)
+
     return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
+        ndjson_generator(),
+        media_type="application/x-ndjson",
         headers={
             'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'X-Accel-Buffering': 'no'  # Disable buffering in Nginx
+            'X-Accel-Buffering': 'no'
         }
     )
 
-# Keep the original endpoint for backward compatibility
-@app.post("/analyze")
-async def analyze(request: AnalyzeThis):
-    print("Test message: Starting analysis process...1")
-    print("Database Configuration:", DB_CONFIG)
-    async with get_db_pool() as pool:
-        schema = await get_db_schema(pool)  # Fetch schema details
-        print("Test message: Starting analysis process...2", schema)
-        # Use the provided tables or all tables in the schema
-        tables_to_analyze = [f"{table}" for table in (request.tables if request.tables else list(schema.keys()))]
-        print("Tables to analyze:", tables_to_analyze)
-        context = {"schema": {}, "samples": {}}
-        for table in tables_to_analyze:
-            if table in schema:
-                context["schema"][table] = schema[table]
-                print(f"Fetching sample data for table: {table}")
-                context["samples"][table] = await sample_table_data(pool, table)
-                await asyncio.sleep(0.1)  # Wait for the sample_table_data call to complete
-        print("Test message: Starting analysis process...3")
-        messages = generate_prompt(request.analysisGoal, context)
-        ai_response = await call_openai(messages)
-        # Prepend "SalesLT." schema to table names in the extracted SQL queries
-        sql_queries = [
-            query.replace("FROM ", "FROM SalesLT.") if "FROM SalesLT." not in query else query
-            for query in extract_sql_queries(ai_response)
-        ]
-        print("Test message: Starting analysis process...4")
+async def batch_events(batch: AnalyzeBatch, client: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+    with database_route(batch.database, batch.schemaName):
+        events = _batch_events(batch, client)
+        try:
+            async for event in events:
+                yield event
+        finally:
+            await events.aclose()
 
-        query_results = {}
-        if request.executeQueries:
-            for i, query in enumerate(sql_queries):
-                try:
-                    cursor = pool.cursor()
-                    cursor.execute(query)
-                    columns = [column[0] for column in cursor.description] if cursor.description else []
-                    result = cursor.fetchall()
-                    cursor.close()
-                    
-                    # Process results to handle datetime objects
-                    processed_results = []
-                    for row in result:
-                        row_dict = {}
-                        for j, val in enumerate(row):
-                            # Convert datetime objects to ISO format strings
-                            if isinstance(val, (datetime, date)):
-                                row_dict[columns[j]] = val.isoformat()
-                            else:
-                                row_dict[columns[j]] = val
-                        processed_results.append(row_dict)
-                    
-                    query_results[f"query_{i+1}"] = {
-                        "sql": query,
-                        "results": processed_results
-                    }
-                except Exception as e:
-                    query_results[f"query_{i+1}"] = {
-                        "sql": query,
-                        "error": str(e)
-                    }
+async def _batch_events(batch: AnalyzeBatch, client: Optional[str]) -> AsyncIterator[Dict[str, Any]]:
+    timings = start_timings("/analyze/batch")
+    goals = batch.goals
+    yield {
+        "type": "batchStart",
+        "data": {"goals": len(goals), "contextId": batch.contextId}
+    }
 
-    # Include schema details in the response
-    return {
-        "status": "success",
-        "analysis": {
-            "goal": request.analysisGoal,
-            "aiSuggestions": ai_response,
-            "suggestedQueries": sql_queries,
-            "results": query_results
-        },
-        "schema": schema,  # Add schema details here
-        "context": {
-            "contextId": request.contextId,
+    try:
+        with timings.span("schema"):
+            schema = await get_db_schema()
+        table_sets = [tuple(select_tables(goal.analysisGoal, goal.tables, schema)) for goal in goals]
+        distinct_sets = list(dict.fromkeys(table_sets))
+        with timings.span("sampling"):
+            # Each table is loaded once even when it appears in several table sets
+            table_data = await load_table_data(list(dict.fromkeys(t for tables in distinct_sets for t in tables)))
+        with timings.span("prompt"):
+            contexts = {
+                tables: build_context(schema, list(tables), table_data)
+                for tables in distinct_sets
+            }
+    except Exception as e:
+        yield {
+            "type": "error",
+            "data": {"message": f"Error preparing batch: {str(e)}"}
+        }
+        return
+
+    yield {
+        "type": "state",
+        "data": {
+            "state": "running",
+            "message": f"Analyzing {len(goals)} goals with {len(contexts)} shared contexts..."
+        }
+    }
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    # Each goal takes an admission slot like a single analysis. The batch was
+    # accepted as a whole, so its goals wait for slots instead of being shed.
+    async def analyze_goal(index: int, goal: AnalyzeThis, tables) -> Dict[str, Any]:
+        async with semaphore:
+            ticket = await acquire_admission(client, goal.contextId or batch.contextId, "/analyze/batch", wait=True)
+            try:
+                messages = generate_prompt(goal.analysisGoal, contexts[tables])
+                prompt_tokens = count_prompt_tokens(messages)
+                ai_response = await complete_chat(messages, analysis_cache_key(goal, messages), prompt_tokens)
+                sql_queries = qualify_queries(extract_sql_queries(ai_response), schema)
+                query_results = {}
+                if goal.executeQueries and sql_queries:
+                    query_results = await execute_queries(
+                        sql_queries, columnar=goal.resultFormat == "columns", use_cache=goal.useCache,
+                        page_size=goal.resultPageSize
+                    )
+            except Exception as e:
+                return {
+                    "type": "goalError",
+                    "data": {"goalIndex": index, "goal": goal.analysisGoal, "message": f"Error during analysis: {str(e)}"}
+                }
+            finally:
+                release_admission(ticket)
+            return {
+                "type": "goalResult",
+                "data": {
+                    "goalIndex": index,
+                    "goal": goal.analysisGoal,
+                    "tables": list(tables),
+                    "aiSuggestions": ai_response,
+                    "suggestedQueries": sql_queries,
+                    "promptTokens": prompt_tokens,
+                    "results": query_results,
+                    "contextId": goal.contextId
+                }
+            }
+
+    started = time.monotonic()
+    tasks = [
+        asyncio.create_task(analyze_goal(index, goal, tables))
+        for index, (goal, tables) in enumerate(zip(goals, table_sets))
+    ]
+    failed = 0
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            event = await next_result
+            if event["type"] == "goalError":
+                failed += 1
+            yield event
+    finally:
+        # Also reached when the client disconnects
+        for task in tasks:
+            task.cancel()
+    timings.add("goals", time.monotonic() - started)
+
+    timings.finish()
+    if timings.enabled:
+        yield {
+            "type": "timing",
+            "data": timings.as_dict()
+        }
+    yield {
+        "type": "batchComplete",
+        "data": {
+            "goals": len(goals),
+            "succeeded": len(goals) - failed,
+            "failed": failed,
+            "contexts": len(contexts),
+            "rateLimiter": llm_limiter.stats(),
             "timestamp": datetime.utcnow().isoformat()
         }
     }
 
-POST_ENDPOINT = "/send"  # Placeholder, customize as needed
-transports: Dict[str, Callable] = {}
+# Identical analyses submitted while one is queued, running or kept are merged
+# into it; with useCache false every submission runs
+def analysis_job_key(request: AnalyzeThis) -> Optional[str]:
+    if not request.useCache:
+        return None
+    config = databases.config_for(request.database)
+    material = json.dumps({
+        "server": config["server"],
+        "database": config["database"],
+        "schema": request.schemaName or config["schema"],
+        "goal": normalize_goal(request.analysisGoal),
+        "tables": request.tables,
+        "executeQueries": bool(request.executeQueries),
+        "resultFormat": request.resultFormat,
+        "resultPageSize": request.resultPageSize,
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+# Runs the /analyze/sse pipeline for a job, once admitted for the client that
+# submitted it (an accepted job waits for a slot, it is not shed). Progress events are recorded for followers
+# without completion deltas or result rows, which only the final result carries.
+async def run_analysis_job(job) -> Dict[str, Any]:
+    request, client = job.payload
+    request.streamResults = False
+    request.slimResult = False  # the result event is the job's result
+    result = None
+    ticket = await acquire_admission(client, request.contextId, "/analyze/jobs", wait=True)
+    try:
+        async for event in analysis_events(request, "/analyze/jobs"):
+            kind = event["type"]
+            if kind == "analysisDelta":
+                continue
+            if kind == "result":
+                result = event["data"]
+                continue
+            if kind == "error":
+                raise RuntimeError(event["data"]["message"])
+            if kind == "queryResult":
+                event = {"type": kind, "data": {k: v for k, v in event["data"].items() if k != "results"}}
+            job.publish(event)
+    finally:
+        release_admission(ticket)
+    return result
 
-class SSEServerTransport:
-    def __init__(self, endpoint: str, response: Response):
-        self.endpoint = endpoint
-        self.response = response
-        self.session_id = str(uuid.uuid4())
-        self.queue = asyncio.Queue()
+analysis_jobs = JobManager(
+    run_analysis_job,
+    workers=JOB_WORKERS,
+    max_queued=JOB_MAX_QUEUED,
+    ttl=JOB_RESULT_TTL,
+    max_finished=JOB_MAX_KEPT,
+    max_bytes=JOB_STORE_MAX_BYTES,
+    sizeof=lambda job: _json_size(job.result),
+)
 
-    @property
-    def sessionId(self):
-        return self.session_id
+@app.on_event("shutdown")
+async def close_analysis_jobs():
+    await analysis_jobs.close()
 
-    async def send(self, message: dict):
-        await self.queue.put(f"data: {json.dumps(message)}\n\n")
+metrics_registry.callback(
+    "aidb_jobs", "gauge", "Analysis jobs by state", ("state",),
+    lambda: [((state,), analysis_jobs.stats()[state]) for state in ("queued", "running", "kept")]
+)
+metrics_registry.callback(
+    "aidb_jobs_merged_total", "counter", "Job submissions merged into an identical job", (),
+    lambda: [((), analysis_jobs.merged)]
+)
 
-    async def event_stream(self):
-        try:
-            while True:
-                data = await self.queue.get()
-                yield data
-        except asyncio.CancelledError:
-            print(f"Transport {self.session_id} cancelled")
+def _job_links(job) -> Dict[str, str]:
+    return {"self": f"/analyze/jobs/{job.job_id}", "events": f"/analyze/jobs/{job.job_id}/events"}
 
-@app.get("/connect")
-async def connect(request: Request):
-    print("connection request received")
-    transport = SSEServerTransport(POST_ENDPOINT, Response)
-    print("new transport created with session id:", transport.sessionId)
-    transports[transport.sessionId] = transport
+def _job_not_found():
+    return CustomJSONResponse(status_code=404, content={"status": "error", "message": "Unknown or expired job"})
 
-    async def stream_generator():
-        await send_messages(transport)
-        async for data in transport.event_stream():
-            yield data
+# Queue an analysis and return at once; poll GET /analyze/jobs/{id} or follow
+# /analyze/jobs/{id}/events for the result
+@app.post("/analyze/jobs")
+async def submit_analysis_job(request: AnalyzeJob, http_request: Request):
+    check_route(request.database, request.schemaName)
+    try:
+        job, merged = analysis_jobs.submit(
+            (request, client_id(http_request)), analysis_job_key(request), request.priority
+        )
+    except JobQueueFullError as e:
+        return CustomJSONResponse(
+            status_code=503,
+            content={"status": "error", "message": str(e)},
+            headers={"Retry-After": "5"},
+        )
+    return CustomJSONResponse(
+        status_code=200 if job.finished else 202,
+        content={"status": "success", **job.describe(), "mergedIntoExisting": merged, "links": _job_links(job)},
+        headers={"Location": f"/analyze/jobs/{job.job_id}"},
+    )
+
+@app.get("/analyze/jobs/{job_id}")
+async def get_analysis_job(job_id: str):
+    job = analysis_jobs.get(job_id)
+    if job is None:
+        return _job_not_found()
+    return {"status": "success", **job.describe(), "links": _job_links(job)}
 
-    async def cleanup():
-        print("SSE connection closed")
-        transports.pop(transport.sessionId, None)
+# Progress events of a job as SSE; ends with a "result" or "error" event
+@app.get("/analyze/jobs/{job_id}/events")
+async def follow_analysis_job(job_id: str):
+    job = analysis_jobs.get(job_id)
+    if job is None:
+        return _job_not_found()
 
-    # Clean up when client disconnects
-    def on_disconnect():
-        asyncio.create_task(cleanup())
+    async def event_generator() -> AsyncIterator[str]:
+        async for event in job.follow():
+            yield format_sse_event(event)
 
-    request.state._on_disconnect = on_disconnect
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.delete("/analyze/jobs/{job_id}")
+async def cancel_analysis_job(job_id: str):
+    job = analysis_jobs.cancel(job_id)
+    if job is None:
+        return _job_not_found()
+    return {"status": "success", **job.describe(include_result=False)}
+
+@app.get("/jobs/stats")
+async def job_stats():
+    return analysis_jobs.stats()
+
+POST_ENDPOINT = "/send"  # clients POST JSON-RPC messages here with ?sessionId=
+
+# Live /connect sessions. A session is removed when its stream ends (client
+# disconnect, overflow with SSE_OVERFLOW=close, idle timeout or shutdown), so
+# memory tracks open connections rather than connections ever made.
+sse_sessions = SessionManager(
+    POST_ENDPOINT,
+    max_sessions=SSE_MAX_SESSIONS,
+    queue_size=SSE_QUEUE_SIZE,
+    overflow=SSE_OVERFLOW,
+    heartbeat_interval=SSE_HEARTBEAT_INTERVAL,
+    idle_timeout=SSE_IDLE_TIMEOUT or None,
+    replay_size=SSE_REPLAY_SIZE,
+    resume_timeout=SSE_RESUME_TIMEOUT or None,
+)
 
-    return StreamingResponse(stream_generator(), media_type="text/event-stream")
+@app.on_event("shutdown")
+async def close_sse_sessions():
+    await sse_sessions.close()
 
-async def send_messages(transport: SSEServerTransport):
+metrics_registry.callback(
+    "aidb_sse_sessions", "gauge", "Open /connect sessions", (), lambda: [((), len(sse_sessions))]
+)
+metrics_registry.callback(
+    "aidb_sse_queued_messages", "gauge", "Messages waiting to be written to /connect clients", (),
+    lambda: [((), sse_sessions.stats()["queued"])]
+)
+metrics_registry.callback(
+    "aidb_sse_dropped_messages_total", "counter", "Messages dropped by the SSE overflow policy", (),
+    lambda: [((), sse_sessions.stats()["dropped"])]
+)
+
+@app.get("/sessions/stats")
+async def session_stats():
+    return sse_sessions.stats()
+
+@app.get("/connect")
+async def connect(request: Request):
+    # A reconnecting EventSource sends the id of the last event it received
+    last_event_id = request.headers.get("Last-Event-ID")
+    session = sse_sessions.resume(last_event_id) if last_event_id else None
+    if session is not None:
+        return StreamingResponse(
+            sse_sessions.stream(session),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
     try:
-        await transport.send({
-            "jsonrpc": "2.0",
-            "method": "sse/connection",
-            "params": {"message": "Stream started"}
-        })
-        print("Stream started")
+        session = sse_sessions.create()
+    except SessionLimitError as e:
+        return CustomJSONResponse(
+            status_code=503,
+            content={"status": "error", "message": str(e)},
+            headers={"Retry-After": "5"},
+        )
 
-        message_count = 0
+    async def stream_generator():
+        # The demo messages run alongside the stream so the connection event is
+        # written immediately; the task ends with the session
+        sender = asyncio.create_task(send_messages(session))
+        try:
+            async for data in sse_sessions.stream(session):
+                yield data
+        finally:
+            sender.cancel()
 
-        while message_count < 2:
-            await asyncio.sleep(1)
-            message_count += 1
-            message = f"Message {message_count} at {datetime.utcnow().isoformat()}"
+    return StreamingResponse(
+        stream_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-            try:
-                await transport.send({
-                    "jsonrpc": "2.0",
-                    "method": "sse/message",
-                    "params": {"data": message}
-                })
-                print(f"Sent: {message}")
-            except Exception as e:
-                print("Error sending message:", e)
-                break
+def _is_jsonrpc_message(message: Any) -> bool:
+    if not isinstance(message, dict) or message.get("jsonrpc") != "2.0":
+        return False
+    if "method" in message:
+        return isinstance(message["method"], str)
+    return "id" in message and ("result" in message or "error" in message)
+
+# Route a JSON-RPC message (or batch) to a /connect session
+@app.post(POST_ENDPOINT)
+async def send_to_session(request: Request, sessionId: str = Query(...)):
+    session = sse_sessions.get(sessionId)
+    if session is None:
+        return CustomJSONResponse(status_code=404, content={"status": "error", "message": "Unknown or closed session"})
+    try:
+        body = await request.json()
+    except ValueError:
+        return CustomJSONResponse(status_code=400, content={"status": "error", "message": "Body is not valid JSON"})
+    messages = body if isinstance(body, list) else [body]
+    if not messages or not all(_is_jsonrpc_message(message) for message in messages):
+        return CustomJSONResponse(
+            status_code=400, content={"status": "error", "message": "Expected a JSON-RPC 2.0 message or batch"}
+        )
+    if not sse_sessions.send(session, body):
+        # Client is not keeping up (SSE_OVERFLOW=drop_newest) or the session was closed
+        return CustomJSONResponse(
+            status_code=503,
+            content={"status": "error", "message": "Session queue is full"},
+            headers={"Retry-After": "1"},
+        )
+    return CustomJSONResponse(status_code=202, content={"status": "accepted"})
+
+async def send_messages(session):
+    sse_sessions.send(session, {
+        "jsonrpc": "2.0",
+        "method": "sse/connection",
+        "params": {
+            "message": "Stream started",
+            "sessionId": session.session_id,
+            "endpoint": f"{session.endpoint}?sessionId={session.session_id}",
+        }
+    })
 
-        await transport.send({
+    for message_count in range(1, 3):
+        await asyncio.sleep(1)
+        message = f"Message {message_count} at {datetime.utcnow().isoformat()}"
+        if not sse_sessions.send(session, {
             "jsonrpc": "2.0",
-            "method": "sse/complete",
-            "params": {"message": "Stream completed"}
-        })
-        print("Stream completed")
+            "method": "sse/message",
+            "params": {"data": message}
+        }):
+            return
 
-    except Exception as e:
-        print("Error in send_messages:", e)
+    sse_sessions.send(session, {
+        "jsonrpc": "2.0",
+        "method": "sse/complete",
+        "params": {"message": "Stream completed"}
+    })
+
+# Shutdown handlers run in the order they are registered. This one is last, so
+# jobs, /connect sessions and the result store have stopped using the
+# databases, the executor and the LLM client before they close.
+@app.on_event("shutdown")
+async def close_db_pool():
+    await databases.close()
+    db_executor.shutdown(wait=False)
+    if _llm_client is not None:
+        await _llm_client.close()
+    llm_cache.close()
+    if shared_cache is not None:
+        shared_cache.close()
+
+startup.import_seconds = time.monotonic() - _import_started
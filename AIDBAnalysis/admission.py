@@ -0,0 +1,250 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Hashable, Optional
+
+QUEUE_FULL = "queueFull"
+QUEUE_TIMEOUT = "queueTimeout"
+CLIENT_LIMIT = "clientLimit"
+SHED_REASONS = (QUEUE_FULL, QUEUE_TIMEOUT, CLIENT_LIMIT)
+
+
+class AdmissionRejectedError(Exception):
+    # `status_code` is 429 when the client is over its own share, 503 when the
+    # server is; `retry_after` is the suggested wait in whole seconds
+    def __init__(self, message: str, reason: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Ticket:
+    # An admitted analysis; release() gives the slot back and may be called
+    # more than once (a streamed response releases from two places)
+    __slots__ = ("_controller", "client", "waited", "admitted_at", "released")
+
+    def __init__(self, controller: "AdmissionController", client: Hashable, waited: float):
+        self._controller = controller
+        self.client = client
+        self.waited = waited
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._controller._release(self)
+
+
+class AdmissionController:
+    # Bounds the analyses running at once, in front of the DB pool and the LLM.
+    #  - at most `limit` analyses are admitted; later ones wait in a queue of at
+    #    most `max_queue` for at most `queue_timeout` seconds, then are shed (503)
+    #  - the queue is served round-robin across clients, and within a client
+    #    across its contexts (contextIds), so one busy client or conversation
+    #    cannot take every freed slot
+    #  - a client holds at most `max_per_client` admitted and queued analyses
+    #    (0: no cap); beyond that it is shed with 429
+    #  - adaptive: observe() feeds LLM/DB latencies into a moving average per
+    #    source. While one is above its target the limit shrinks by `decrease`
+    #    (at most once per `cooldown`); while none is and analyses are queued it
+    #    grows by one per second, back up to `max_in_flight`
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_queue: int = 100,
+        queue_timeout: float = 30.0,
+        max_per_client: int = 0,
+        adaptive: bool = False,
+        targets: Optional[Dict[str, float]] = None,
+        min_limit: int = 1,
+        decrease: float = 0.75,
+        cooldown: float = 5.0,
+        smoothing: float = 0.2,
+    ):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.max_in_flight = max_in_flight
+        self.limit = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_per_client = max_per_client
+        self.adaptive = adaptive
+        self.targets = dict(targets or {})
+        self.min_limit = max(1, min(min_limit, max_in_flight))
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+
+        self.in_flight = 0
+        # client -> context -> waiters, each level rotated as it is served
+        self._waiting: "OrderedDict[Hashable, OrderedDict[Hashable, Deque[asyncio.Future]]]" = OrderedDict()
+        self._queued = 0
+        self._per_client: Dict[Hashable, int] = {}
+        self._latency: Dict[str, float] = {}
+        self._hold_time: Optional[float] = None  # moving average of admitted durations
+        self._last_decrease = 0.0
+        self._last_increase = 0.0
+
+        self.admitted = 0
+        self.waited = 0
+        self.wait_time_total = 0.0
+        self.shed: Dict[str, int] = {reason: 0 for reason in SHED_REASONS}
+        self.limit_decreases = 0
+        self.limit_increases = 0
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def retry_after(self) -> int:
+        # Time for the queue ahead to drain at the current limit, 1-60 seconds
+        hold = self._hold_time if self._hold_time is not None else 1.0
+        return max(1, min(60, math.ceil(hold * (self._queued + 1) / self.limit)))
+
+    def _reject(self, reason: str, message: str, status_code: int = 503):
+        self.shed[reason] += 1
+        raise AdmissionRejectedError(message, reason, status_code, self.retry_after())
+
+    async def acquire(self, client: Hashable = None, context: Hashable = None, wait: bool = False) -> Ticket:
+        # Raises AdmissionRejectedError when the analysis is shed. With `wait`
+        # (work already accepted, e.g. batch goals and queued jobs, bounded by
+        # its caller's own concurrency) it is never shed: the per-client cap,
+        # queue bound and queue timeout do not apply, it waits its turn.
+        held = self._per_client.get(client, 0)
+        if not wait and self.max_per_client and held >= self.max_per_client:
+            self._reject(
+                CLIENT_LIMIT, f"Too many analyses from this client (limit {self.max_per_client})", status_code=429
+            )
+        if self.in_flight < self.limit and not self._queued:
+            return self._admit(client, 0.0)
+        if not wait and self._queued >= self.max_queue:
+            self._reject(QUEUE_FULL, f"Too many analyses waiting (limit {self.max_queue})")
+
+        waiter = asyncio.get_running_loop().create_future()
+        contexts = self._waiting.setdefault(client, OrderedDict())
+        contexts.setdefault(context, deque()).append(waiter)
+        self._queued += 1
+        self._per_client[client] = held + 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait({waiter}, timeout=None if wait else self.queue_timeout)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the caller went away: pass the slot on
+                self.in_flight -= 1
+                self._dispatch()
+            else:
+                self._withdraw(client, context, waiter)
+            self._release_client(client)
+            raise
+        waited = time.monotonic() - started
+        self._release_client(client)
+        if not waiter.done():
+            self._withdraw(client, context, waiter)
+            self._reject(QUEUE_TIMEOUT, f"No capacity for the analysis within {self.queue_timeout:g}s")
+        self.in_flight -= 1  # counted by _dispatch, counted again by _admit
+        self.waited += 1
+        self.wait_time_total += waited
+        return self._admit(client, waited)
+
+    def _admit(self, client: Hashable, waited: float) -> Ticket:
+        self.in_flight += 1
+        self.admitted += 1
+        self._per_client[client] = self._per_client.get(client, 0) + 1
+        return Ticket(self, client, waited)
+
+    def _withdraw(self, client: Hashable, context: Hashable, waiter: asyncio.Future):
+        contexts = self._waiting.get(client)
+        waiters = contexts.get(context) if contexts is not None else None
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            self._queued -= 1
+            if not waiters:
+                del contexts[context]
+                if not contexts:
+                    del self._waiting[client]
+        waiter.cancel()
+
+    def _release_client(self, client: Hashable):
+        held = self._per_client.get(client, 0) - 1
+        if held > 0:
+            self._per_client[client] = held
+        else:
+            self._per_client.pop(client, None)
+
+    def _release(self, ticket: Ticket):
+        held = time.monotonic() - ticket.admitted_at
+        self._hold_time = held if self._hold_time is None else self._average(self._hold_time, held)
+        self.in_flight -= 1
+        self._release_client(ticket.client)
+        self._dispatch()
+
+    def _dispatch(self):
+        # Hand free slots to waiters: clients in turn, each client's contexts in turn
+        while self.in_flight < self.limit and self._waiting:
+            client, contexts = next(iter(self._waiting.items()))
+            context, waiters = next(iter(contexts.items()))
+            waiter = waiters.popleft()
+            self._queued -= 1
+            if waiters:
+                contexts.move_to_end(context)
+            else:
+                del contexts[context]
+            if contexts:
+                self._waiting.move_to_end(client)
+            else:
+                del self._waiting[client]
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def _average(self, current: float, sample: float) -> float:
+        return current + self.smoothing * (sample - current)
+
+    def observe(self, source: str, seconds: float):
+        # Latency of one LLM or DB call, for the adaptive limit
+        if not self.adaptive or source not in self.targets:
+            return
+        current = self._latency.get(source)
+        self._latency[source] = seconds if current is None else self._average(current, seconds)
+        self._adjust()
+
+    def _adjust(self):
+        now = time.monotonic()
+        overloaded = any(self._latency.get(source, 0.0) > target for source, target in self.targets.items())
+        if overloaded:
+            if self.limit > self.min_limit and now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.min_limit, int(self.limit * self.decrease))
+                self._last_decrease = now
+                self.limit_decreases += 1
+        elif self._queued and self.limit < self.max_in_flight and now - self._last_increase >= 1.0:
+            self.limit += 1
+            self._last_increase = now
+            self.limit_increases += 1
+            self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "maxInFlight": self.max_in_flight,
+            "inFlight": self.in_flight,
+            "queued": self._queued,
+            "maxQueue": self.max_queue,
+            "queueTimeoutMs": round(self.queue_timeout * 1000),
+            "waitingClients": len(self._waiting),
+            "maxPerClient": self.max_per_client,
+            "admitted": self.admitted,
+            "waited": self.waited,
+            "waitTimeTotalMs": round(self.wait_time_total * 1000, 1),
+            "shed": dict(self.shed),
+            "retryAfter": self.retry_after(),
+            "adaptive": self.adaptive,
+            "latencyMs": {source: round(value * 1000, 1) for source, value in self._latency.items()},
+            "targetsMs": {source: round(value * 1000, 1) for source, value in self.targets.items()},
+            "limitDecreases": self.limit_decreases,
+            "limitIncreases": self.limit_increases,
+        }
@@ -0,0 +1,235 @@
+import asyncio
+import itertools
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from ttl_cache import TTLCache
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+class Job:
+    # One submitted analysis. Progress events are kept so followers that attach
+    # late still see everything; the last event is always "result" or "error".
+    __slots__ = ("job_id", "key", "priority", "payload", "status", "created_at", "started_at", "finished_at",
+                 "result", "error", "events", "merged", "task", "_changed")
+
+    def __init__(self, key: Optional[str], payload: Any, priority: int):
+        self.job_id = str(uuid.uuid4())
+        self.key = key
+        self.priority = priority
+        self.payload = payload
+        self.status = QUEUED
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.events: List[Dict[str, Any]] = []
+        self.merged = 0  # later submissions answered by this job
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def publish(self, event: Dict[str, Any]):
+        self.events.append(event)
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def follow(self) -> AsyncIterator[Dict[str, Any]]:
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.finished:
+                return
+            await changed.wait()
+
+    def describe(self, include_result: bool = True) -> Dict[str, Any]:
+        description = {
+            "jobId": self.job_id,
+            "state": self.status,
+            "priority": self.priority,
+            "createdAt": self.created_at.isoformat(),
+            "startedAt": self.started_at.isoformat() if self.started_at else None,
+            "finishedAt": self.finished_at.isoformat() if self.finished_at else None,
+            "merged": self.merged,
+        }
+        if self.error is not None:
+            description["error"] = self.error
+        if include_result and self.status == SUCCEEDED:
+            description["result"] = self.result
+        return description
+
+
+class JobManager:
+    # Background analysis jobs.
+    #  - `workers` coroutines take jobs from a priority queue (higher priority
+    #    first, FIFO within a priority) and run them with `runner(job)`
+    #  - submissions with the same key as a queued, running or kept successful
+    #    job are merged into it instead of being run again (key None: never merged)
+    #  - finished jobs stay retrievable in a TTLCache bounded by `ttl`,
+    #    `max_finished` and `max_bytes` (size measured by `sizeof(job)`)
+    def __init__(
+        self,
+        runner: Callable[[Job], Awaitable[Any]],
+        workers: int = 2,
+        max_queued: int = 1000,
+        ttl: Optional[float] = 3600.0,
+        max_finished: Optional[int] = 1000,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Job], int]] = None,
+    ):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self._runner = runner
+        self.workers = workers
+        self.max_queued = max_queued
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._sequence = itertools.count()
+        self._closing = False
+        self._active: Dict[str, Job] = {}
+        self._active_keys: Dict[str, Job] = {}
+        self._finished = TTLCache(ttl=ttl, max_entries=max_finished, max_bytes=max_bytes, sizeof=sizeof)
+        self._finished_keys = TTLCache(ttl=ttl, max_entries=max_finished)
+
+        self.submitted = 0
+        self.merged = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        self._workers = [task for task in self._workers if not task.done()]
+        loop = asyncio.get_running_loop()
+        while len(self._workers) < self.workers:
+            self._workers.append(loop.create_task(self._work()))
+
+    def _queued_count(self) -> int:
+        return sum(1 for job in self._active.values() if job.status == QUEUED)
+
+    def submit(self, payload: Any, key: Optional[str] = None, priority: int = 0):
+        # Returns (job, merged)
+        if key is not None:
+            job = self._active_keys.get(key)
+            if job is None:
+                job_id = self._finished_keys.get(key)
+                job = self._finished.get(job_id) if job_id is not None else None
+            if job is not None and job.status in (QUEUED, RUNNING, SUCCEEDED):
+                job.merged += 1
+                self.merged += 1
+                return job, True
+        if self._queued_count() >= self.max_queued:
+            self.rejected += 1
+            raise JobQueueFullError(f"Too many queued jobs (limit {self.max_queued})")
+        self._ensure_started()
+        job = Job(key, payload, priority)
+        self._active[job.job_id] = job
+        if key is not None:
+            self._active_keys[key] = job
+        self.submitted += 1
+        self._queue.put_nowait((-priority, next(self._sequence), job))
+        job.publish({"type": "state", "data": {"state": QUEUED, "jobId": job.job_id}})
+        return job, False
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._active.get(job_id) or self._finished.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self._active.get(job_id)
+        if job is None:
+            return self._finished.get(job_id)
+        if job.task is not None:
+            job.task.cancel()  # _run records the cancellation
+        else:
+            self._finish(job, CANCELLED, error="Cancelled")
+        return job
+
+    async def _work(self):
+        while True:
+            _, _, job = await self._queue.get()
+            if job.status != QUEUED:
+                continue  # cancelled while waiting
+            await self._run(job)
+
+    async def _run(self, job: Job):
+        job.status = RUNNING
+        job.started_at = datetime.utcnow()
+        job.publish({"type": "state", "data": {"state": RUNNING, "jobId": job.job_id}})
+        job.task = asyncio.create_task(self._runner(job))
+        try:
+            result = await job.task
+        except asyncio.CancelledError:
+            self._finish(job, CANCELLED, error="Cancelled")
+            if self._closing:
+                raise
+        except Exception as e:
+            self._finish(job, FAILED, error=str(e))
+        else:
+            job.result = result
+            self._finish(job, SUCCEEDED)
+        finally:
+            job.task = None
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        job.finished_at = datetime.utcnow()
+        job.payload = None
+        if status == SUCCEEDED:
+            self.succeeded += 1
+            job.publish({"type": "result", "data": job.result})
+        else:
+            if status == FAILED:
+                self.failed += 1
+            else:
+                self.cancelled += 1
+            job.publish({"type": "error", "data": {"state": status, "message": error}})
+        self._active.pop(job.job_id, None)
+        if job.key is not None and self._active_keys.get(job.key) is job:
+            del self._active_keys[job.key]
+        self._finished.set(job.job_id, job)
+        if job.key is not None and status == SUCCEEDED:
+            self._finished_keys.set(job.key, job.job_id)
+
+    async def close(self):
+        self._closing = True
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def stats(self) -> Dict[str, Any]:
+        running = sum(1 for job in self._active.values() if job.status == RUNNING)
+        return {
+            "workers": self.workers,
+            "queued": len(self._active) - running,
+            "running": running,
+            "maxQueued": self.max_queued,
+            "kept": len(self._finished),
+            "submitted": self.submitted,
+            "merged": self.merged,
+            "rejected": self.rejected,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
@@ -0,0 +1,351 @@
+# SQLite-backed stand-in for the parts of pyodbc that AnalyzeThis.py uses, so the
+# service can be load-tested without SQL Server or an ODBC driver.
+#
+# serve_app.py installs it as `pyodbc` before importing the app. The data lives
+# in a SQLite file attached as the `SalesLT` schema, so both `Customer` and
+# `SalesLT.Customer` resolve. The catalog queries the app issues
+# (INFORMATION_SCHEMA, sys.objects, ...) are answered from SQLite's own catalog,
+# and T-SQL's TOP is rewritten to LIMIT (TABLESAMPLE is dropped, so a "sample"
+# is the first rows; sys.partitions row counts are live COUNT(*)s). With SET SHOWPLAN_XML ON, statements
+# return a plan whose cost is derived from SQLite's EXPLAIN QUERY PLAN.
+#
+#   FAKE_ODBC_DB               path of the database file (see create_database); a
+#                              "{database}" in it is replaced with the DATABASE= of
+#                              the connection string, for multi-database tests
+#   FAKE_ODBC_LATENCY          seconds added to every execute (network round trip)
+#   FAKE_ODBC_CONNECT_LATENCY  seconds added to every connect (TCP + TLS + login)
+import os
+import random
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+SCHEMA = "SalesLT"
+LATENCY = float(os.getenv("FAKE_ODBC_LATENCY", "0"))
+CONNECT_LATENCY = float(os.getenv("FAKE_ODBC_CONNECT_LATENCY", "0"))
+
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("money", lambda value: Decimal(value.decode()))
+sqlite3.register_converter("datetime", lambda value: datetime.fromisoformat(value.decode()))
+
+
+class Error(Exception):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+class ProgrammingError(DatabaseError):
+    pass
+
+
+TABLES = {
+    "Customer": """
+        CustomerID int PRIMARY KEY, FirstName nvarchar NOT NULL, LastName nvarchar NOT NULL,
+        CompanyName nvarchar, EmailAddress nvarchar, ModifiedDate datetime NOT NULL""",
+    "Address": """
+        AddressID int PRIMARY KEY, AddressLine1 nvarchar NOT NULL, City nvarchar NOT NULL,
+        StateProvince nvarchar NOT NULL, CountryRegion nvarchar NOT NULL, PostalCode nvarchar NOT NULL,
+        ModifiedDate datetime NOT NULL""",
+    "CustomerAddress": """
+        CustomerID int NOT NULL REFERENCES Customer(CustomerID),
+        AddressID int NOT NULL REFERENCES Address(AddressID),
+        AddressType nvarchar NOT NULL, ModifiedDate datetime NOT NULL""",
+    "ProductCategory": """
+        ProductCategoryID int PRIMARY KEY,
+        ParentProductCategoryID int REFERENCES ProductCategory(ProductCategoryID),
+        Name nvarchar NOT NULL, ModifiedDate datetime NOT NULL""",
+    "Product": """
+        ProductID int PRIMARY KEY, Name nvarchar NOT NULL, ProductNumber nvarchar NOT NULL, Color nvarchar,
+        StandardCost money NOT NULL, ListPrice money NOT NULL,
+        ProductCategoryID int REFERENCES ProductCategory(ProductCategoryID),
+        ThumbNailPhoto varbinary, ModifiedDate datetime NOT NULL""",
+    "SalesOrderHeader": """
+        SalesOrderID int PRIMARY KEY, CustomerID int NOT NULL REFERENCES Customer(CustomerID),
+        OrderDate datetime NOT NULL, Status int NOT NULL, SubTotal money NOT NULL, TaxAmt money NOT NULL,
+        Freight money NOT NULL, TotalDue money NOT NULL""",
+    "SalesOrderDetail": """
+        SalesOrderID int NOT NULL REFERENCES SalesOrderHeader(SalesOrderID),
+        SalesOrderDetailID int PRIMARY KEY, OrderQty int NOT NULL,
+        ProductID int NOT NULL REFERENCES Product(ProductID),
+        UnitPrice money NOT NULL, LineTotal money NOT NULL""",
+}
+
+
+def create_database(path: str, scale: float = 1.0, seed: int = 42):
+    # AdventureWorksLT-shaped data: scale=1 gives ~850 customers and ~2000 orders
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    base = datetime(2008, 6, 1)
+    customers = max(10, int(850 * scale))
+    orders = max(20, int(2000 * scale))
+    products = 295
+
+    conn = sqlite3.connect(path)
+    with conn:
+        for table, columns in TABLES.items():
+            conn.execute(f"CREATE TABLE {table} ({columns})")
+        conn.executemany("INSERT INTO Customer VALUES (?, ?, ?, ?, ?, ?)", [
+            (i, f"First{i}", f"Last{i % 400}", f"Company {i % 300}", f"user{i}@example.com", base)
+            for i in range(1, customers + 1)
+        ])
+        conn.executemany("INSERT INTO Address VALUES (?, ?, ?, ?, ?, ?, ?)", [
+            (i, f"{i} Main St", f"City{i % 120}", f"State{i % 40}", rng.choice(["US", "CA", "UK", "DE"]),
+             f"{10000 + i}", base)
+            for i in range(1, customers + 1)
+        ])
+        conn.executemany("INSERT INTO CustomerAddress VALUES (?, ?, ?, ?)", [
+            (i, i, "Main Office", base) for i in range(1, customers + 1)
+        ])
+        conn.executemany("INSERT INTO ProductCategory VALUES (?, ?, ?, ?)", [
+            (i, None if i <= 4 else 1 + i % 4, f"Category {i}", base) for i in range(1, 42)
+        ])
+        conn.executemany("INSERT INTO Product VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+            (i, f"Product {i}", f"PN-{i:05d}", rng.choice(["Black", "Red", "Silver", None]),
+             Decimal(rng.randint(100, 100000)) / 100, Decimal(rng.randint(200, 300000)) / 100,
+             5 + i % 37, bytes(rng.getrandbits(8) for _ in range(64)), base)
+            for i in range(1, products + 1)
+        ])
+        detail_id = 1
+        details = []
+        headers = []
+        for order in range(1, orders + 1):
+            subtotal = Decimal(0)
+            for _ in range(rng.randint(1, 8)):
+                quantity = rng.randint(1, 10)
+                price = Decimal(rng.randint(500, 250000)) / 100
+                line = price * quantity
+                subtotal += line
+                details.append((order, detail_id, quantity, rng.randint(1, products), price, line))
+                detail_id += 1
+            tax = (subtotal * Decimal("0.08")).quantize(Decimal("0.0001"))
+            freight = (subtotal * Decimal("0.025")).quantize(Decimal("0.0001"))
+            headers.append((order, rng.randint(1, customers), base + timedelta(days=rng.randint(0, 365)),
+                            5, subtotal, tax, freight, subtotal + tax + freight))
+        conn.executemany("INSERT INTO SalesOrderHeader VALUES (?, ?, ?, ?, ?, ?, ?, ?)", headers)
+        conn.executemany("INSERT INTO SalesOrderDetail VALUES (?, ?, ?, ?, ?, ?)", details)
+    conn.close()
+
+
+_TOP = re.compile(r"\bSELECT\s+TOP\s*\(?\s*(\d+)\s*\)?", re.IGNORECASE)
+_REWRITES = [
+    (re.compile(r"\bISNULL\s*\(", re.IGNORECASE), "IFNULL("),
+    (re.compile(r"\bLEN\s*\(", re.IGNORECASE), "LENGTH("),
+    (re.compile(r"\bGETDATE\s*\(\s*\)", re.IGNORECASE), "CURRENT_TIMESTAMP"),
+    (re.compile(r"\bDATALENGTH\s*\(", re.IGNORECASE), "LENGTH("),
+    (re.compile(r"\s*\bTABLESAMPLE\s*(?:SYSTEM\s*)?\([^)]*\)(?:\s*REPEATABLE\s*\(\s*\d+\s*\))?", re.IGNORECASE), ""),
+]
+
+
+def translate_sql(sql: str) -> str:
+    # Just enough T-SQL -> SQLite for sample queries and typical suggested queries
+    sql = sql.strip().rstrip(";")
+    limit = None
+    match = _TOP.search(sql)
+    if match:
+        limit = match.group(1)
+        sql = sql[:match.start()] + "SELECT " + sql[match.end():]
+    for pattern, replacement in _REWRITES:
+        sql = pattern.sub(replacement, sql)
+    if limit is not None and not re.search(r"\bLIMIT\s+\d+\s*$", sql, re.IGNORECASE):
+        sql = f"{sql} LIMIT {limit}"
+    return sql
+
+
+_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(?:\w+\.)?(\w+)(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b|GROUP\b|ORDER\b|LIMIT\b|INNER\b|LEFT\b|RIGHT\b|CROSS\b)(\w+))?"
+                    r"|,\s*(?:\w+\.)?(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+SHOWPLAN = (
+    '<ShowPlanXML xmlns="http://schemas.microsoft.com/sqlserver/2004/07/showplan" Version="1.564">'
+    '<BatchSequence><Batch><Statements><StmtSimple StatementSubTreeCost="{cost}" StatementEstRows="{rows}"'
+    ' StatementType="SELECT"/></Statements></Batch></BatchSequence></ShowPlanXML>'
+)
+
+
+def _type_code(values):
+    for value in values:
+        if value is not None:
+            return type(value)
+    return str
+
+
+class Cursor:
+    def __init__(self, connection: "Connection"):
+        self.connection = connection
+        self.timeout = connection.timeout
+        self.description = None
+        self.rowcount = -1
+        self._rows = []
+        self._position = 0
+
+    def execute(self, sql: str, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = tuple(params[0])
+        if LATENCY:
+            time.sleep(LATENCY)
+        lowered = sql.lower()
+        try:
+            if lowered.startswith("set showplan_xml"):
+                self.connection.showplan = lowered.split()[-1] == "on"
+                columns, rows = [], []
+            elif self.connection.showplan:
+                columns, rows = ["Microsoft SQL Server 2005 XML Showplan"], [(self._showplan(sql),)]
+            elif "sys.objects" in lowered:
+                columns, rows = self._versions()
+            elif "information_schema.columns" in lowered:
+                columns, rows = self._columns(params[1:])
+            elif "constraint_type = 'foreign key'" in lowered:
+                columns, rows = self._foreign_keys(params[1:])
+            elif "sys.partitions" in lowered:
+                columns = ["table_name", "row_count"]
+                rows = [(table, self.connection._sqlite.execute(f"SELECT COUNT(*) FROM {SCHEMA}.{table}").fetchone()[0])
+                        for table in self._catalog()]
+            elif "sys.dm_db_index_usage_stats" in lowered:
+                columns, rows = ["table_name", "last_update"], []
+            else:
+                cursor = self.connection._sqlite.execute(translate_sql(sql), params)
+                columns = [column[0] for column in cursor.description or []]
+                rows = cursor.fetchall()
+        except sqlite3.OperationalError as e:
+            if "interrupted" in str(e):
+                raise OperationalError("HY008", "Operation canceled") from e
+            raise ProgrammingError("42000", str(e)) from e
+        except sqlite3.Error as e:
+            raise DatabaseError("42000", str(e)) from e
+        self._rows = rows
+        self._position = 0
+        self.rowcount = len(rows)
+        self.description = [
+            (name, _type_code(row[i] for row in rows[:20]), None, None, None, None, True)
+            for i, name in enumerate(columns)
+        ] if columns else None
+        return self
+
+    def _showplan(self, sql):
+        # Rows flowing through SQLite's nested loops, with a TOP/LIMIT row goal
+        # when nothing has to be sorted first, at SQL Server-like cost units
+        translated = translate_sql(sql)
+        aliases = {}
+        for match in _ALIAS.finditer(translated):
+            table = match.group(1) or match.group(3)
+            aliases[(match.group(2) or match.group(4) or table).lower()] = table
+        plan = [row[3] for row in self.connection._sqlite.execute(f"EXPLAIN QUERY PLAN {translated}", ())]
+        limit = re.search(r"\bLIMIT\s+(\d+)\s*$", translated, re.IGNORECASE)
+        row_goal = int(limit.group(1)) if limit and not any("TEMP B-TREE" in step for step in plan) else None
+        rows = 1
+        cost = 0.0
+        for step in plan:
+            words = step.split()
+            if words[0] == "SCAN" and len(words) > 1:
+                rows *= self._row_count(aliases.get(words[1].split(".")[-1].lower(), words[1].split(".")[-1]))
+            elif words[0] == "SEARCH":
+                rows *= 2
+            else:
+                continue
+            cost += min(rows, row_goal) if row_goal is not None else rows
+        estimated = min(rows, row_goal) if row_goal is not None else rows
+        return SHOWPLAN.format(cost=round(cost / 50000, 6), rows=estimated)
+
+    def _row_count(self, table):
+        if table not in self.connection._row_counts:
+            try:
+                count = self.connection._sqlite.execute(f"SELECT COUNT(*) FROM {SCHEMA}.{table}").fetchone()[0]
+            except sqlite3.Error:
+                count = 1000  # subquery or CTE
+            self.connection._row_counts[table] = count
+        return self.connection._row_counts[table]
+
+    def _catalog(self):
+        return [row[0] for row in self.connection._sqlite.execute(
+            f"SELECT name FROM {SCHEMA}.sqlite_master WHERE type = 'table' ORDER BY name"
+        )]
+
+    def _versions(self):
+        modified = datetime(2008, 6, 1)
+        return ["table_name", "modify_date", "child_modify_date"], [(t, modified, None) for t in self._catalog()]
+
+    def _columns(self, tables):
+        rows = []
+        for table in self._catalog():
+            if tables and table not in tables:
+                continue
+            for _, name, declared, notnull, default, primary_key in self.connection._sqlite.execute(
+                f"PRAGMA {SCHEMA}.table_info({table})"
+            ):
+                nullable = not notnull and not primary_key
+                rows.append((table, name, declared.split("(")[0].lower(), "YES" if nullable else "NO", default))
+        return ["table_name", "column_name", "data_type", "is_nullable", "column_default"], rows
+
+    def _foreign_keys(self, tables):
+        rows = []
+        for table in self._catalog():
+            if tables and table not in tables:
+                continue
+            for fk in self.connection._sqlite.execute(f"PRAGMA {SCHEMA}.foreign_key_list({table})"):
+                rows.append((table, fk[3], fk[2], fk[4]))
+        return ["table_name", "column_name", "foreign_table_name", "foreign_column_name"], rows
+
+    def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        row = self._rows[self._position]
+        self._position += 1
+        return row
+
+    def fetchmany(self, size: int = 1):
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    def cancel(self):
+        self.connection._sqlite.interrupt()
+
+    def close(self):
+        self._rows = []
+
+
+class Connection:
+    def __init__(self, path: str):
+        self.timeout = 0
+        self.showplan = False
+        self._row_counts = {}
+        self._sqlite = sqlite3.connect(":memory:", check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self._sqlite.execute(f"ATTACH DATABASE ? AS {SCHEMA}", (path,))
+
+    def cursor(self) -> Cursor:
+        return Cursor(self)
+
+    def commit(self):
+        self._sqlite.commit()
+
+    def rollback(self):
+        self._sqlite.rollback()
+
+    def close(self):
+        self._sqlite.close()
+
+
+def connect(connection_string: str = "", **kwargs) -> Connection:
+    path = os.getenv("FAKE_ODBC_DB")
+    if path and "{database}" in path:
+        database = re.search(r"DATABASE=([^;]*)", connection_string, re.IGNORECASE)
+        path = path.replace("{database}", database.group(1) if database else "")
+    if not path or not os.path.exists(path):
+        raise OperationalError("08001", f"FAKE_ODBC_DB does not point to a database: {path!r}")
+    if CONNECT_LATENCY:
+        time.sleep(CONNECT_LATENCY)
+    return Connection(path)
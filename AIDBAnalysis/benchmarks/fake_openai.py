@@ -0,0 +1,167 @@
+# Local stand-in for the Azure OpenAI chat completions endpoint with a canned
+# answer, a configurable time to first token and token rate.
+#
+#   python benchmarks/fake_openai.py --port 8911 --latency 0.4 --tokens-per-sec 80
+#
+# --rpm enforces a requests-per-minute quota the way Azure does: requests over
+# it get 429 with retry-after-ms / retry-after headers.
+#
+# Point the app at it with AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8911 (no trailing
+# slash, or the client requests //openai/...)
+import argparse
+import asyncio
+import json
+import math
+import re
+import time
+import uuid
+from collections import deque
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_RESPONSE = """1. Summary
+Customer orders are in SalesOrderHeader (TotalDue per order) and link to Customer via CustomerID; \
+order lines are in SalesOrderDetail and reference Product.
+
+2. Queries
+
+```sql
+SELECT TOP 5 c.CustomerID, c.CompanyName, SUM(h.TotalDue) AS TotalOrderValue
+FROM SalesLT.Customer c
+JOIN SalesLT.SalesOrderHeader h ON h.CustomerID = c.CustomerID
+GROUP BY c.CustomerID, c.CompanyName
+ORDER BY TotalOrderValue DESC
+```
+
+```sql
+SELECT TOP 100 p.ProductID, p.Name, SUM(d.OrderQty) AS UnitsSold, SUM(d.LineTotal) AS Revenue
+FROM SalesLT.Product p
+JOIN SalesLT.SalesOrderDetail d ON d.ProductID = p.ProductID
+GROUP BY p.ProductID, p.Name
+ORDER BY Revenue DESC
+```
+
+3. Explanation
+The first query totals TotalDue per customer; the second ranks products by revenue.
+
+4. Observations
+CompanyName is nullable and some products have no color."""
+
+# Roughly what a BPE tokenizer produces: words with their leading space, and punctuation
+_TOKEN = re.compile(r"\s*\w+|\s*[^\w\s]|\s+")
+
+
+def split_tokens(text: str):
+    return _TOKEN.findall(text)
+
+
+def build_app(response_text: str, latency: float, tokens_per_sec: float, rpm: int = 0) -> FastAPI:
+    app = FastAPI()
+    tokens = split_tokens(response_text)
+    interval = 1.0 / tokens_per_sec if tokens_per_sec > 0 else 0.0
+    stats = {"requests": 0, "streamed": 0, "rateLimited": 0}
+    accepted = deque()  # start times of requests in the last minute
+
+    def over_quota():
+        if rpm <= 0:
+            return None
+        now = time.monotonic()
+        while accepted and accepted[0] <= now - 60:
+            accepted.popleft()
+        if len(accepted) >= rpm:
+            return accepted[0] + 60 - now
+        accepted.append(now)
+        return None
+
+    def usage(messages):
+        prompt = sum(len(m.get("content") or "") for m in messages) // 4
+        return {"prompt_tokens": prompt, "completion_tokens": len(tokens), "total_tokens": prompt + len(tokens)}
+
+    def envelope(deployment: str, kind: str, **fields):
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": kind,
+            "created": int(time.time()),
+            "model": deployment,
+            **fields,
+        }
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        retry_after = over_quota()
+        if retry_after is not None:
+            stats["rateLimited"] += 1
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"code": "429", "message": "Requests to the deployment have exceeded the rate limit."}},
+                headers={"retry-after-ms": str(int(retry_after * 1000)), "retry-after": str(math.ceil(retry_after))},
+            )
+        messages = body.get("messages", [])
+        if not body.get("stream"):
+            # Whole answer after the time it would take to stream it
+            await asyncio.sleep(latency + interval * len(tokens))
+            return JSONResponse(envelope(
+                deployment, "chat.completion",
+                choices=[{"index": 0, "message": {"role": "assistant", "content": response_text},
+                          "finish_reason": "stop"}],
+                usage=usage(messages),
+            ))
+
+        stats["streamed"] += 1
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        async def events():
+            # Azure starts with a chunk that has no choices (prompt filter results)
+            yield f"data: {json.dumps(envelope(deployment, 'chat.completion.chunk', choices=[]))}\n\n"
+            await asyncio.sleep(latency)
+            started = time.perf_counter()
+            for i, token in enumerate(tokens):
+                # Pace against the start time so sleep overhead does not accumulate
+                delay = started + i * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                chunk = envelope(deployment, "chat.completion.chunk", choices=[
+                    {"index": 0, "delta": {"content": token}, "finish_reason": None}
+                ])
+                yield f"data: {json.dumps(chunk)}\n\n"
+            final = envelope(deployment, "chat.completion.chunk", choices=[
+                {"index": 0, "delta": {}, "finish_reason": "stop"}
+            ])
+            yield f"data: {json.dumps(final)}\n\n"
+            if include_usage:
+                yield f"data: {json.dumps(envelope(deployment, 'chat.completion.chunk', choices=[], usage=usage(messages)))}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Azure OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8911)
+    parser.add_argument("--latency", type=float, default=0.4, help="seconds before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0, help="0 sends all tokens at once")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before answering 429 (0: no limit)")
+    parser.add_argument("--response-file", help="canned completion text (default: two SalesLT queries)")
+    args = parser.parse_args()
+
+    response_text = DEFAULT_RESPONSE
+    if args.response_file:
+        with open(args.response_file, encoding="utf-8") as f:
+            response_text = f.read()
+    app = build_app(response_text, args.latency, args.tokens_per_sec, args.rpm)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+# Offline load test: starts the app against the SQLite fake ODBC layer and a fake
+# Azure OpenAI server, drives the endpoints at the given concurrency levels and
+# saves latency percentiles, time to first event, throughput and peak RSS as JSON.
+#
+#   python benchmarks/load_test.py --concurrency 1,8,32 --requests 100
+#   python benchmarks/load_test.py --scenarios sse --compare benchmarks/results/baseline.json
+#
+# Scenarios: analyze (POST /analyze), sse (POST /analyze/sse), stream
+# (POST /analyze/stream) and connect (GET /connect until "sse/complete").
+# LLM responses are not cached unless --use-cache is given, so every request
+# pays the simulated completion time.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import fake_odbc  # noqa: E402
+
+SCENARIOS = ("analyze", "sse", "stream", "connect")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    # Linear interpolation between closest ranks
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(seconds: List[float]) -> Optional[Dict[str, float]]:
+    if not seconds:
+        return None
+    values = sorted(seconds)
+    return {
+        "p50": round(percentile(values, 0.50) * 1000, 2),
+        "p95": round(percentile(values, 0.95) * 1000, 2),
+        "p99": round(percentile(values, 0.99) * 1000, 2),
+        "mean": round(sum(values) / len(values) * 1000, 2),
+        "max": round(values[-1] * 1000, 2),
+    }
+
+
+def read_rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+
+class RssSampler:
+    # Peak resident set size of the app process while a scenario runs
+    def __init__(self, pid: Optional[int], interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            rss = read_rss_bytes(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak = None
+        if self.pid is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> Optional[float]:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        return round(self.peak / (1024 * 1024), 1) if self.peak else None
+
+
+async def run_request(client: httpx.AsyncClient, scenario: str, body: Dict[str, Any]):
+    # Returns (latency, time to first event or None, error message or None)
+    started = time.perf_counter()
+    first_event = None
+    if scenario == "analyze":
+        response = await client.post("/analyze", json=body)
+        latency = time.perf_counter() - started
+        if response.status_code != 200:
+            return latency, None, f"HTTP {response.status_code}"
+        result = response.json()
+        if result.get("status") != "success":
+            return latency, None, "status != success"
+        if str(result["analysis"].get("aiSuggestions", "")).startswith("AI API Error"):
+            return latency, None, result["analysis"]["aiSuggestions"][:200]
+        return latency, None, None
+
+    if scenario == "connect":
+        request = client.build_request("GET", "/connect")
+    else:
+        request = client.build_request("POST", f"/analyze/{scenario}", json=body)
+    response = await client.send(request, stream=True)
+    error = "stream ended before the final event"
+    try:
+        if response.status_code != 200:
+            return time.perf_counter() - started, None, f"HTTP {response.status_code}"
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+            if first_event is None:
+                first_event = time.perf_counter() - started
+            payload = line[len("data:"):].strip() if line.startswith("data:") else line
+            if scenario == "connect":
+                if "sse/complete" in payload:
+                    error = None
+                    break
+                continue
+            event = json.loads(payload)
+            if event.get("type") == "error":
+                error = event["data"].get("message", "error event")
+                break
+            if event.get("type") == "analysis" and event["data"]["aiSuggestions"].startswith("AI API Error"):
+                error = event["data"]["aiSuggestions"][:200]
+                break
+            if event.get("type") == "result" and error == "stream ended before the final event":
+                error = None
+    finally:
+        # For /connect this disconnects, which is how clients leave the session
+        await response.aclose()
+    return time.perf_counter() - started, first_event, error
+
+
+async def run_scenario(base_url: str, scenario: str, concurrency: int, requests: int,
+                       body: Dict[str, Any], sampler: RssSampler, timeout: float) -> Dict[str, Any]:
+    latencies: List[float] = []
+    first_events: List[float] = []
+    errors: List[str] = []
+    next_index = 0
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def worker():
+            nonlocal next_index
+            while next_index < requests:
+                next_index += 1
+                try:
+                    latency, first_event, error = await run_request(client, scenario, body)
+                except Exception as e:
+                    errors.append(f"{type(e).__name__}: {e}")
+                    continue
+                if error is not None:
+                    errors.append(error)
+                    continue
+                latencies.append(latency)
+                if first_event is not None:
+                    first_events.append(first_event)
+
+        sampler.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        duration = time.perf_counter() - started
+        peak_rss = await sampler.stop()
+
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(errors),
+        "shed": sum(1 for error in errors if error in ("HTTP 429", "HTTP 503")),  # admission control
+        "errorSamples": sorted(set(errors))[:3],
+        "durationSec": round(duration, 3),
+        "requestsPerSec": round(len(latencies) / duration, 2) if duration else 0.0,
+        "latencyMs": summarize(latencies),
+        "timeToFirstEventMs": summarize(first_events),
+        "peakRssMb": peak_rss,
+    }
+
+
+def start_process(args: List[str], env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "ab")
+    return subprocess.Popen([sys.executable] + args, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_ready(url: str, process: Optional[subprocess.Popen], timeout: float = 30.0, status: Optional[int] = None):
+    # Any answer counts unless `status` is given (the app's /ready is 503 while warming up)
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}; see the log file")
+            try:
+                response = await client.get(url)
+                if status is None or response.status_code == status:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not become ready within {timeout:g}s")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARKS_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]):
+    def index(run):
+        return {(r["scenario"], r["concurrency"]): r for r in run["results"]}
+
+    def change(old, new):
+        if not old or new is None:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    before = index(baseline)
+    print(f"\nCompared with {baseline.get('revision') or 'baseline'} ({baseline.get('startedAt')}):")
+    print(f"  {'scenario':<10}{'conc':>5}  {'p50 ms':>18}  {'p95 ms':>18}  {'req/s':>16}")
+    for key, new in index(current).items():
+        old = before.get(key)
+        if old is None or not old["latencyMs"] or not new["latencyMs"]:
+            continue
+        print(
+            f"  {key[0]:<10}{key[1]:>5}  "
+            f"{new['latencyMs']['p50']:>9.1f} {change(old['latencyMs']['p50'], new['latencyMs']['p50']):>8}  "
+            f"{new['latencyMs']['p95']:>9.1f} {change(old['latencyMs']['p95'], new['latencyMs']['p95']):>8}  "
+            f"{new['requestsPerSec']:>7.1f} {change(old['requestsPerSec'], new['requestsPerSec']):>8}"
+        )
+
+
+async def run(args) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="aidb-bench-")
+    processes: List[subprocess.Popen] = []
+    app_pid = None
+    app_ready_ms = None
+    base_url = args.app_url
+    try:
+        if base_url is None:
+            db_path = os.path.join(workdir, "saleslt.db")
+            fake_odbc.create_database(db_path, args.scale)
+            openai_port, app_port = free_port(), free_port()
+
+            openai_args = [os.path.join(BENCHMARKS_DIR, "fake_openai.py"), "--port", str(openai_port),
+                           "--latency", str(args.llm_latency), "--tokens-per-sec", str(args.llm_tokens_per_sec),
+                           "--rpm", str(args.llm_rpm)]
+            if args.response_file:
+                openai_args += ["--response-file", args.response_file]
+            processes.append(start_process(openai_args, dict(os.environ), os.path.join(workdir, "fake_openai.log")))
+
+            env = dict(os.environ)
+            env.update({
+                "FAKE_ODBC_DB": db_path,
+                "FAKE_ODBC_LATENCY": str(args.db_latency),
+                "FAKE_ODBC_CONNECT_LATENCY": str(args.db_connect_latency),
+                # No trailing slash: the client would request //openai/...
+                "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{openai_port}",
+                "AZURE_OPENAI_KEY": "benchmark",
+            })
+            await wait_ready(f"http://127.0.0.1:{openai_port}/stats", processes[0])
+            spawned = time.monotonic()
+            app = start_process([os.path.join(BENCHMARKS_DIR, "serve_app.py"), "--port", str(app_port)],
+                                env, os.path.join(workdir, "app.log"))
+            processes.append(app)
+            app_pid = app.pid
+            base_url = f"http://127.0.0.1:{app_port}"
+            await wait_ready(f"{base_url}/ready", app, timeout=60.0, status=200)
+            app_ready_ms = round((time.monotonic() - spawned) * 1000, 1)
+            print(f"App log: {os.path.join(workdir, 'app.log')}")
+            print(f"App ready {app_ready_ms:.0f} ms after launch")
+
+        body = {
+            "analysisGoal": args.goal,
+            "executeQueries": True,
+            "useCache": args.use_cache,
+        }
+        if args.tables:
+            body["tables"] = args.tables.split(",")
+
+        sampler = RssSampler(app_pid)
+        results = []
+        for scenario in args.scenarios.split(","):
+            if args.warmup:
+                await run_scenario(base_url, scenario, 1, args.warmup, body, RssSampler(None), args.timeout)
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                result = await run_scenario(base_url, scenario, concurrency, args.requests, body, sampler, args.timeout)
+                results.append(result)
+                latency = result["latencyMs"] or {}
+                ttfe = result["timeToFirstEventMs"] or {}
+                print(
+                    f"{scenario:<8} c={concurrency:<4} {result['requestsPerSec']:>8.1f} req/s  "
+                    f"p50 {latency.get('p50', 0):>8.1f}  p95 {latency.get('p95', 0):>8.1f}  "
+                    f"p99 {latency.get('p99', 0):>8.1f} ms  first event p50 {ttfe.get('p50', 0):>7.1f} ms  "
+                    f"rss {result['peakRssMb']} MB  errors {result['errors']}"
+                )
+        # Import/warm-up timings and the first request's latency, as seen by the app
+        try:
+            async with httpx.AsyncClient(timeout=5.0) as client:
+                startup = (await client.get(f"{base_url}/ready")).json()
+        except (httpx.HTTPError, ValueError):
+            startup = None
+        if startup and startup.get("firstRequest"):
+            first = startup["firstRequest"]
+            print(f"First request {first['path']} took {first['latencyMs']:.1f} ms")
+        if app_pid is not None:
+            # Lifetime high-water mark, including start-up and warm-up
+            try:
+                with open(f"/proc/{app_pid}/status") as f:
+                    hwm = next((int(line.split()[1]) for line in f if line.startswith("VmHWM:")), None)
+            except OSError:
+                hwm = None
+        else:
+            hwm = None
+
+        return {
+            "startedAt": datetime.utcnow().isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                "appUrl": args.app_url,
+                "requests": args.requests,
+                "warmup": args.warmup,
+                "llmLatency": args.llm_latency,
+                "llmTokensPerSec": args.llm_tokens_per_sec,
+                "llmRpm": args.llm_rpm,
+                "dbLatency": args.db_latency,
+                "dbConnectLatency": args.db_connect_latency,
+                "scale": args.scale,
+                "body": body,
+                "env": {k: v for k, v in os.environ.items() if k.startswith(("DB_", "LLM_", "QUERY_", "SAMPLE_", "SCHEMA_", "PROMPT_", "SSE_", "BATCH_", "WARMUP_", "ADMISSION_", "RESULT_", "SHARED_CACHE_"))},
+            },
+            "appPeakRssMb": round(hwm / 1024, 1) if hwm else None,
+            "appReadyMs": app_ready_ms,
+            "startup": startup,
+            "results": results,
+        }
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the analysis endpoints")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of {SCENARIOS}")
+    parser.add_argument("--concurrency", default="1,8", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=40, help="requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=2, help="sequential warm-up requests per scenario")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    parser.add_argument("--goal", default="Find the top 5 customers by order value")
+    parser.add_argument("--tables", help="comma-separated tables to send (default: let the app choose)")
+    parser.add_argument("--use-cache", action="store_true", help="allow LLM and query result cache hits")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="fake LLM seconds to first token")
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=80.0)
+    parser.add_argument("--llm-rpm", type=int, default=0, help="fake LLM requests per minute before 429s (0: no limit)")
+    parser.add_argument("--response-file", help="canned completion for the fake LLM")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="fake DB seconds per execute")
+    parser.add_argument("--db-connect-latency", type=float, default=0.05, help="fake DB seconds per connect")
+    parser.add_argument("--scale", type=float, default=1.0, help="fake database size")
+    parser.add_argument("--app-url", help="benchmark an already running app instead of starting one")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/run-<time>.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="print changes against an earlier results file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    output = args.output or os.path.join(
+        BENCHMARKS_DIR, "results", f"run-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# Runs AnalyzeThis.app with fake_odbc installed as `pyodbc`, for load tests.
+#
+#   FAKE_ODBC_DB=/tmp/bench.db AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8911 \
+#       python benchmarks/serve_app.py --port 8910
+#
+# load_test.py starts it (and fake_openai.py) itself; run it by hand to profile
+# the app or to point other tools at it.
+import argparse
+import os
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import fake_odbc  # noqa: E402
+
+sys.modules["pyodbc"] = fake_odbc
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve AnalyzeThis.py against the SQLite fake ODBC layer")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8910)
+    parser.add_argument("--create-db", metavar="PATH", help="build the SQLite database at PATH and use it")
+    parser.add_argument("--scale", type=float, default=1.0, help="data volume for --create-db")
+    args = parser.parse_args()
+
+    if args.create_db:
+        fake_odbc.create_database(args.create_db, args.scale)
+        os.environ["FAKE_ODBC_DB"] = args.create_db
+
+    import uvicorn
+    import AnalyzeThis
+
+    uvicorn.run(AnalyzeThis.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import asyncio
+import gzip
+from typing import Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional dependency; gzip only
+    brotli = None
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    # "br" or "gzip", whichever the client rates higher (br on a tie), or None
+    ratings = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        ratings[name.strip().lower()] = quality
+    wildcard = ratings.get("*", 0.0)
+    gzip_quality = ratings.get("gzip", wildcard)
+    br_quality = ratings.get("br", wildcard) if brotli is not None else 0.0
+    if br_quality > 0 and br_quality >= gzip_quality:
+        return "br"
+    if gzip_quality > 0:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    # ASGI middleware compressing JSON responses that are sent in one piece
+    # (CustomJSONResponse) and are at least `minimum_size` bytes, with brotli
+    # (when installed) or gzip as negotiated through Accept-Encoding. Streamed
+    # responses (SSE, NDJSON) pass through untouched, since compressing them
+    # would hold events back until a compression block fills up. Bodies above
+    # `offload_size` are compressed on a worker thread, off the event loop.
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        offload_size: int = 256 * 1024,
+        content_types: Tuple[str, ...] = ("application/json",),
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.offload_size = offload_size
+        self.content_types = content_types
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        held = None  # the response start, held back until the body shows whether to compress
+
+        async def send_compressed(message):
+            nonlocal held
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if headers.get("content-encoding") or not headers.get("content-type", "").startswith(self.content_types):
+                    await send(message)
+                else:
+                    held = message
+                return
+            if message["type"] != "http.response.body" or held is None:
+                await send(message)
+                return
+            start, held = held, None
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                await send(start)
+                await send(message)
+                return
+            if len(body) > self.offload_size:
+                body = await asyncio.get_running_loop().run_in_executor(None, self._compress, body, encoding)
+            else:
+                body = self._compress(body, encoding)
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
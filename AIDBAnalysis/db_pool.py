@@ -0,0 +1,291 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Deque, Dict, Optional
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class PoolClosedError(Exception):
+    pass
+
+
+class BrokenConnectionError(Exception):
+    # Raised inside `connection()` when the session state can no longer be
+    # trusted (e.g. a SET option could not be reset); the connection is discarded
+    pass
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    # Bounded pool of blocking DB-API connections (pyodbc) for use from asyncio code.
+    # Every blocking call (connect, health check, close) runs in `executor` so the
+    # event loop never waits on the network. Capacity is enforced with a semaphore:
+    # a slot is held for as long as a connection is checked out (or being opened),
+    # so callers beyond `max_size` queue up in FIFO order until `acquire_timeout`.
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        min_size: int = 1,
+        max_size: int = 10,
+        idle_timeout: float = 300.0,
+        max_lifetime: float = 1800.0,
+        acquire_timeout: float = 30.0,
+        health_check_after: Optional[float] = 30.0,
+        health_check_query: str = "SELECT 1",
+        reap_interval: float = 30.0,
+        executor=None,
+    ):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        if min_size < 0 or min_size > max_size:
+            raise ValueError("min_size must be between 0 and max_size")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+        self.health_check_query = health_check_query
+        self.reap_interval = reap_interval
+        self.executor = executor
+
+        self._idle: Deque[_PooledConnection] = deque()
+        self._size = 0  # idle + in use + currently opening
+        self._in_use = 0
+        self._waiting = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._reaper: Optional[asyncio.Task] = None
+        self._closed = False
+
+        # Counters for monitoring
+        self._acquired_total = 0
+        self._timeouts_total = 0
+        self._created_total = 0
+        self._discarded_total = 0
+        self._health_check_failures = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    async def run(self, fn, *args):
+        # Run a blocking call on the pool's executor
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    def _ensure_started(self):
+        # asyncio primitives are created lazily so the pool can be built at import time
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_size)
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.get_running_loop().create_task(self._reap_loop())
+
+    async def start(self):
+        # Open `min_size` connections up front instead of on the first requests
+        if self._closed:
+            raise PoolClosedError("Connection pool is closed")
+        self._ensure_started()
+        await self._fill()
+
+    def _expired(self, pooled: _PooledConnection, now: float) -> bool:
+        return self.max_lifetime is not None and now - pooled.created_at >= self.max_lifetime
+
+    def _is_healthy(self, conn) -> bool:
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.health_check_query)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _rollback(conn) -> bool:
+        try:
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, pooled: _PooledConnection):
+        # Bookkeeping happens synchronously; the close itself is fire-and-forget so
+        # that releasing a connection never blocks (or gets interrupted by cancellation)
+        self._size -= 1
+        self._discarded_total += 1
+        loop = asyncio.get_running_loop()
+        loop.run_in_executor(self.executor, self._close_quietly, pooled.conn)
+
+    async def _open(self) -> _PooledConnection:
+        self._size += 1
+        try:
+            conn = await self.run(self._connect)
+        except BaseException:
+            self._size -= 1
+            raise
+        self._created_total += 1
+        return _PooledConnection(conn)
+
+    async def _checkout(self) -> _PooledConnection:
+        while self._idle:
+            # LIFO reuse keeps the warmest connections busy and lets surplus ones idle out
+            pooled = self._idle.pop()
+            now = time.monotonic()
+            if self._expired(pooled, now):
+                self._discard(pooled)
+                continue
+            if self.health_check_after is not None and now - pooled.last_used >= self.health_check_after:
+                if not await self.run(self._is_healthy, pooled.conn):
+                    self._health_check_failures += 1
+                    self._discard(pooled)
+                    continue
+            return pooled
+        return await self._open()
+
+    async def acquire(self) -> _PooledConnection:
+        if self._closed:
+            raise PoolClosedError("Connection pool is closed")
+        self._ensure_started()
+        start = time.monotonic()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self._timeouts_total += 1
+            raise PoolTimeoutError(
+                f"Timed out after {self.acquire_timeout}s waiting for a database connection"
+            ) from None
+        finally:
+            self._waiting -= 1
+
+        waited = time.monotonic() - start
+        self._acquired_total += 1
+        self._wait_time_total += waited
+        self._wait_time_max = max(self._wait_time_max, waited)
+
+        try:
+            pooled = await self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+        self._in_use += 1
+        return pooled
+
+    def release(self, pooled: _PooledConnection, discard: bool = False):
+        self._in_use -= 1
+        try:
+            now = time.monotonic()
+            if discard or self._closed or self._expired(pooled, now):
+                self._discard(pooled)
+            else:
+                pooled.last_used = now
+                self._idle.append(pooled)
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def connection(self):
+        pooled = await self.acquire()
+        discard = False
+        try:
+            yield pooled.conn
+        except BrokenConnectionError:
+            discard = True
+            raise
+        except Exception:
+            raise  # rolled back below like a normal return
+        except BaseException:
+            # Cancelled or closed mid-use: a statement may still be running in a
+            # worker thread, so never hand this connection out again
+            discard = True
+            raise
+        finally:
+            # Rolled back after every use, not only after errors: a transaction
+            # left open (and its locks) must not reach the next caller. A
+            # connection that cannot be rolled back is discarded.
+            reset = False
+            try:
+                if not discard:
+                    reset = await self.run(self._rollback, pooled.conn)
+            finally:
+                self.release(pooled, discard=not reset)
+
+    async def _fill(self):
+        while not self._closed and self._size < self.min_size and not self._slots.locked():
+            await self._slots.acquire()
+            try:
+                pooled = await self._open()
+                self._idle.appendleft(pooled)
+            finally:
+                self._slots.release()
+
+    def _reap(self):
+        now = time.monotonic()
+        keep: Deque[_PooledConnection] = deque()
+        # Oldest-used connections sit at the left of the idle deque
+        while self._idle:
+            pooled = self._idle.popleft()
+            idle_for = now - pooled.last_used
+            surplus = self._size > self.min_size
+            if self._expired(pooled, now) or (surplus and self.idle_timeout is not None and idle_for >= self.idle_timeout):
+                self._discard(pooled)
+            else:
+                keep.append(pooled)
+        self._idle.extend(keep)
+
+    async def _reap_loop(self):
+        while not self._closed:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                self._reap()
+                await self._fill()
+            except Exception as e:
+                print(f"Connection pool maintenance error: {e}")
+
+    async def close(self):
+        self._closed = True
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        while self._idle:
+            pooled = self._idle.pop()
+            self._size -= 1
+            await self.run(self._close_quietly, pooled.conn)
+
+    def stats(self) -> Dict[str, Any]:
+        acquired = self._acquired_total
+        return {
+            "size": self._size,
+            "inUse": self._in_use,
+            "idle": len(self._idle),
+            "waiting": self._waiting,
+            "minSize": self.min_size,
+            "maxSize": self.max_size,
+            "acquired": acquired,
+            "timeouts": self._timeouts_total,
+            "created": self._created_total,
+            "discarded": self._discarded_total,
+            "healthCheckFailures": self._health_check_failures,
+            "waitTimeTotalMs": round(self._wait_time_total * 1000, 3),
+            "waitTimeAvgMs": round(self._wait_time_total * 1000 / acquired, 3) if acquired else 0.0,
+            "waitTimeMaxMs": round(self._wait_time_max * 1000, 3),
+        }
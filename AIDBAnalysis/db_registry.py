@@ -0,0 +1,209 @@
+import asyncio
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set
+
+from db_pool import ConnectionPool
+
+# Names that are safe to put into a connection string or an SQL identifier
+_NAME = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_\-]*$")
+_SCHEMA_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class UnknownDatabaseError(Exception):
+    pass
+
+
+class InvalidSchemaError(Exception):
+    pass
+
+
+def load_database_configs(value: str) -> Dict[str, Dict[str, Any]]:
+    # DB_DATABASES: a JSON object {name: {server, port, database, user, password,
+    # driver, schema}} inline, or the path of a file holding one. Missing keys
+    # are taken from the default database.
+    value = value.strip()
+    if not value:
+        return {}
+    if not value.startswith("{"):
+        with open(os.path.expanduser(value), encoding="utf-8") as f:
+            value = f.read()
+    configs = json.loads(value)
+    if not isinstance(configs, dict) or not all(isinstance(c, dict) for c in configs.values()):
+        raise ValueError("DB_DATABASES must map database names to objects")
+    return configs
+
+
+def validate_schema_name(schema: str) -> str:
+    if not _SCHEMA_NAME.match(schema):
+        raise InvalidSchemaError(f"Invalid schema name {schema!r}")
+    return schema
+
+
+class Database:
+    # One routable database: its connection settings, default schema and pool.
+    # `leases` counts requests currently working with it; a leased or busy
+    # database is never evicted.
+    __slots__ = ("name", "config", "schema", "pool", "pinned", "leases", "last_used")
+
+    def __init__(self, name: str, config: Dict[str, Any], pool: ConnectionPool, pinned: bool = False):
+        self.name = name
+        self.config = config
+        self.schema = config["schema"]
+        self.pool = pool
+        self.pinned = pinned
+        self.leases = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def key(self):
+        # Identifies the database in cache keys
+        return (self.config["server"], self.config["database"])
+
+    @property
+    def idle(self) -> bool:
+        stats = self.pool.stats()
+        return not self.pinned and self.leases == 0 and stats["inUse"] == 0 and stats["waiting"] == 0
+
+
+class DatabaseRegistry:
+    # Routes a database identifier to its Database, opening pools on first use.
+    #  - the default database (identifier None or its name) is pinned: never evicted
+    #  - named databases come from `configs`; with `allow_any`, any other valid
+    #    name is a database on the default server with the default credentials
+    #  - at most `max_pools` pools are open: beyond that the least recently used
+    #    idle pool is closed, and the reaper closes pools idle for `evict_after`
+    #    seconds, so many tenant databases can share a worker
+    #  - `on_evict(database)` lets the caller drop what it cached for it
+    def __init__(
+        self,
+        default: Dict[str, Any],
+        pool_factory: Callable[[Dict[str, Any], bool], ConnectionPool],
+        configs: Optional[Dict[str, Dict[str, Any]]] = None,
+        allow_any: bool = False,
+        max_pools: int = 50,
+        evict_after: Optional[float] = 600.0,
+        reap_interval: float = 30.0,
+        on_evict: Optional[Callable[[Database], None]] = None,
+    ):
+        if max_pools < 1:
+            raise ValueError("max_pools must be at least 1")
+        self._pool_factory = pool_factory
+        self._configs = {name: dict(default, **config) for name, config in (configs or {}).items()}
+        self.allow_any = allow_any
+        self.max_pools = max_pools
+        self.evict_after = evict_after
+        self.reap_interval = reap_interval
+        self._on_evict = on_evict
+        self.default = Database(default["database"], dict(default), pool_factory(default, True), pinned=True)
+        self._open: "OrderedDict[str, Database]" = OrderedDict([(self.default.name, self.default)])
+        self._closing: Set[asyncio.Task] = set()
+        self._reaper: Optional[asyncio.Task] = None
+
+        self.opened = 0
+        self.evicted = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._open)
+
+    def databases(self):
+        return list(self._open.values())
+
+    def _ensure_started(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.get_running_loop().create_task(self._reap_loop())
+
+    def config_for(self, name: Optional[str]) -> Dict[str, Any]:
+        # Raises UnknownDatabaseError for names that cannot be routed
+        if name is None or name == self.default.name:
+            return self.default.config
+        config = self._configs.get(name)
+        if config is not None:
+            return config
+        if self.allow_any and _NAME.match(name):
+            return dict(self.default.config, database=name)
+        self.rejected += 1
+        raise UnknownDatabaseError(f"Unknown database {name!r}")
+
+    def acquire(self, name: Optional[str]) -> Database:
+        # Lease a database for the duration of a request; pair with release()
+        name = self.default.name if name is None else name
+        database = self._open.get(name)
+        if database is None:
+            config = self.config_for(name)
+            database = Database(name, config, self._pool_factory(config, False))
+            self._open[name] = database
+            self.opened += 1
+        self._open.move_to_end(name)
+        database.leases += 1
+        database.last_used = time.monotonic()
+        self._ensure_started()
+        self._evict_over_limit()
+        return database
+
+    def release(self, database: Database):
+        database.leases -= 1
+        database.last_used = time.monotonic()
+
+    def _evict_over_limit(self):
+        # Oldest first; busy databases are skipped, so the limit can be exceeded
+        # briefly while every open pool is in use
+        for database in list(self._open.values()):
+            if len(self._open) <= self.max_pools:
+                return
+            if database.idle:
+                self._evict(database)
+
+    def _evict(self, database: Database):
+        del self._open[database.name]
+        self.evicted += 1
+        task = asyncio.get_running_loop().create_task(database.pool.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+        if self._on_evict is not None:
+            self._on_evict(database)
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            if self.evict_after is None:
+                continue
+            cutoff = time.monotonic() - self.evict_after
+            for database in list(self._open.values()):
+                if database.last_used < cutoff and database.idle:
+                    self._evict(database)
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        await asyncio.gather(*(database.pool.close() for database in self._open.values()), *self._closing,
+                             return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "open": len(self._open),
+            "maxPools": self.max_pools,
+            "configured": sorted(self._configs),
+            "allowAny": self.allow_any,
+            "opened": self.opened,
+            "evicted": self.evicted,
+            "rejected": self.rejected,
+            "databases": {
+                database.name: {
+                    "server": database.config["server"],
+                    "database": database.config["database"],
+                    "schema": database.schema,
+                    "pinned": database.pinned,
+                    "leases": database.leases,
+                    "idleSeconds": round(now - database.last_used, 1),
+                    "pool": database.pool.stats(),
+                }
+                for database in self._open.values()
+            },
+        }
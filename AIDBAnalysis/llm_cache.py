@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from ttl_cache import TTLCache
+
+
+def normalize_goal(goal: str) -> str:
+    return " ".join(goal.lower().split())
+
+
+def llm_cache_key(goal: str, messages: List[Dict[str, str]], deployment: str, temperature: float) -> str:
+    # The system prompt carries the schema subset and samples chosen by
+    # generate_prompt; the goal is normalised so trivial rewordings in case or
+    # whitespace share an entry
+    system_prompt = "".join(m["content"] for m in messages if m.get("role") == "system")
+    material = json.dumps({
+        "goal": normalize_goal(goal),
+        "context": hashlib.sha256(system_prompt.encode("utf-8")).hexdigest(),
+        "deployment": deployment,
+        "temperature": temperature,
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class _DiskStore:
+    # SQLite-backed persistence for LLM responses, pruned least-recently-used
+    # first. All methods block; LLMResponseCache calls them from a thread.
+    def __init__(self, path: str, max_entries: int):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+
+    def get(self, key: str) -> Optional[tuple]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return row
+
+    def set(self, key: str, response: str, ttl: float):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now + ttl, now),
+            )
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LLMResponseCache:
+    # In-memory LRU + TTL cache of completion texts, optionally backed by a local
+    # SQLite file so entries survive restarts. Memory misses fall through to the
+    # cache shared by the host's workers (a shared_cache.SharedCache), then disk.
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int = 512,
+        path: Optional[str] = None,
+        disk_max_entries: int = 10000,
+        shared=None,
+    ):
+        self.ttl = ttl
+        self._memory = TTLCache(ttl=ttl, max_entries=max_entries)
+        self._disk = _DiskStore(path, disk_max_entries) if path else None
+        self._shared = shared
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.disk_hits = 0
+        self.bypassed = 0
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def get(self, key: str) -> Optional[str]:
+        response = self._memory.get(key)
+        if response is not None:
+            self.hits += 1
+            return response
+        if self._shared is not None:
+            entry = await self._shared.get("llm", key)
+            if entry is not None:
+                self._memory.set(key, entry.value, ttl=entry.ttl)
+                self.hits += 1
+                self.shared_hits += 1
+                return entry.value
+        if self._disk is not None:
+            try:
+                row = await self._run(self._disk.get, key)
+            except Exception as e:
+                print(f"LLM cache read failed: {e}")
+                row = None
+            if row is not None:
+                response, expires_at = row
+                self._memory.set(key, response, ttl=max(expires_at - time.time(), 0))
+                self.hits += 1
+                self.disk_hits += 1
+                return response
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, response: str, shared: bool = True):
+        self._memory.set(key, response)
+        if shared and self._shared is not None:
+            await self._shared.set("llm", key, response, self.ttl)
+        if self._disk is not None:
+            try:
+                await self._run(self._disk.set, key, response, self.ttl)
+            except Exception as e:
+                print(f"LLM cache write failed: {e}")
+
+    async def load(self, key: str, loader: Callable[[], Awaitable[str]]) -> str:
+        # The response for a key get() just missed, from `loader`. With a shared
+        # cache only one worker on the host calls it; the others wait for its
+        # response. Empty responses are returned but not cached.
+        if self._shared is None:
+            response = await loader()
+            if response:
+                await self.set(key, response)
+            return response
+
+        async def load_response():
+            return (await loader()) or None
+
+        entry = await self._shared.load("llm", key, load_response, self.ttl, check_first=False)
+        if entry.value is None:
+            return ""
+        if entry.loaded:
+            await self.set(key, entry.value, shared=False)
+        else:
+            self._memory.set(key, entry.value, ttl=entry.ttl)
+            self.shared_hits += 1
+        return entry.value
+
+    @asynccontextmanager
+    async def lock(self, key: Optional[str]) -> AsyncIterator[Optional[str]]:
+        # For responses that are streamed rather than returned by a loader: with
+        # a shared cache, yields the response another worker stored while this
+        # one waited for the key, or None once this worker may produce it (and
+        # set() it before leaving the block). Without a shared cache or a key
+        # (an uncached call), yields None at once.
+        if self._shared is None or key is None:
+            yield None
+            return
+        async with self._shared.locked("llm", key, check_first=False) as entry:
+            if entry is None:
+                yield None
+                return
+            self._memory.set(key, entry.value, ttl=entry.ttl)
+            self.shared_hits += 1
+            yield entry.value
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._memory),
+            "diskEnabled": self._disk is not None,
+            "sharedEnabled": self._shared is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "sharedHits": self.shared_hits,
+            "diskHits": self.disk_hits,
+            "bypassed": self.bypassed,
+            "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self._memory.evictions,
+        }
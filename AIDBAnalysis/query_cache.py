@@ -0,0 +1,200 @@
+import asyncio
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from sql_guard import table_references
+from ttl_cache import TTLCache
+
+_SQL_TOKEN = re.compile(r"""
+    (?P<string>N?'(?:[^']|'')*')
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<space>\s+)
+  | (?P<other>[^'\s/-]+|.)
+""", re.DOTALL | re.VERBOSE)
+
+# Last write per table since the instance started (needs VIEW SERVER STATE).
+# Entries disappear on restart, which simply invalidates everything once.
+TABLE_CHANGES_QUERY = """
+SELECT OBJECT_NAME(s.object_id) AS table_name, MAX(s.last_user_update) AS last_update
+FROM sys.dm_db_index_usage_stats AS s
+WHERE s.database_id = DB_ID() AND s.last_user_update IS NOT NULL
+GROUP BY s.object_id;
+"""
+
+
+def normalize_sql(sql: str) -> str:
+    # Comments dropped, whitespace collapsed and case folded outside string
+    # literals, trailing semicolons removed:
+    #   "SELECT TOP 5 *\n  FROM Customer -- top" -> "select top 5 * from customer"
+    parts = []
+    for match in _SQL_TOKEN.finditer(sql):
+        kind = match.lastgroup
+        if kind == "string":
+            parts.append(match.group())
+        elif kind in ("comment", "space"):
+            parts.append(" ")
+        else:
+            parts.append(match.group().lower())
+    return " ".join("".join(parts).split()).rstrip("; ")
+
+
+def referenced_tables(normalized_sql: str) -> Set[str]:
+    # Unqualified, lower-cased names of the tables in FROM lists and JOINs,
+    # comma joins included (the FROM list walk of sql_guard.qualify_tables)
+    return table_references(normalized_sql)
+
+
+def query_result_key(server: str, database: str, sql: str, result_format: str) -> Hashable:
+    return (server, database, normalize_sql(sql), result_format)
+
+
+def load_table_versions(conn) -> Dict[str, Any]:
+    # Blocking: run on the DB executor
+    cursor = conn.cursor()
+    try:
+        cursor.execute(TABLE_CHANGES_QUERY)
+        return {row[0].lower(): row[1] for row in cursor.fetchall() if row[0]}
+    finally:
+        cursor.close()
+
+
+class QueryResultCache:
+    # Results of executed queries keyed by database and normalized SQL, bounded
+    # by TTL, entry count and total size (least recently used evicted first).
+    # With a `change_loader` the per-table write times it returns for a database
+    # ((server, database) from the key) are polled at most every
+    # `change_poll_interval` seconds, and that database's entries reading a
+    # table that changed are dropped before its next lookup.
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int = 1000,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+        max_entry_bytes: Optional[int] = None,
+        change_loader: Optional[Callable[[Hashable], Awaitable[Dict[str, Any]]]] = None,
+        change_poll_interval: float = 15.0,
+    ):
+        self.enabled = ttl > 0
+        self._sizeof = sizeof or (lambda value: 0)
+        self.max_entry_bytes = max_entry_bytes
+        self._cache = TTLCache(ttl=ttl, max_entries=max_entries, max_bytes=max_bytes, sizeof=self._sizeof)
+        # (server, database, table) -> keys of the entries reading it
+        self._keys_by_table: Dict[Tuple[str, str, str], Set[Hashable]] = {}
+        self._change_loader = change_loader
+        self.change_poll_interval = change_poll_interval
+        self._versions: Dict[Hashable, Dict[str, Any]] = {}
+        self._versions_checked_at: Dict[Hashable, float] = {}
+        self._sync_tasks: Dict[Hashable, asyncio.Task] = {}
+
+        self.bypassed = 0
+        self.invalidations = 0
+        self.change_checks = 0
+        self.change_check_errors = 0
+
+    async def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        await self.sync_changes(key[:2])
+        return self._cache.get(key)
+
+    def set(self, key: Hashable, value: Dict[str, Any]):
+        # `key` comes from query_result_key; its SQL names the tables to index
+        if not self.enabled:
+            return
+        if self.max_entry_bytes is not None and self._sizeof(value) > self.max_entry_bytes:
+            return
+        self._cache.set(key, value)
+        server, database = key[:2]
+        for table in referenced_tables(key[2]):
+            self._keys_by_table.setdefault((server, database, table), set()).add(key)
+        if sum(len(keys) for keys in self._keys_by_table.values()) > 2 * (self._cache.max_entries or 1024):
+            self._prune_index()
+
+    def _prune_index(self):
+        # Forget keys the underlying cache already evicted or expired
+        for table in list(self._keys_by_table):
+            keys = {key for key in self._keys_by_table[table] if key in self._cache}
+            if keys:
+                self._keys_by_table[table] = keys
+            else:
+                del self._keys_by_table[table]
+
+    def invalidate_tables(self, tables: Iterable[str], database: Optional[Hashable] = None) -> int:
+        # Entries reading any of `tables`, in `database` or in every database
+        tables = {table.lower() for table in tables}
+        removed = 0
+        for index_key in [k for k in self._keys_by_table if k[2] in tables and (database is None or k[:2] == database)]:
+            for key in self._keys_by_table.pop(index_key):
+                if self._cache.pop(key) is not None:
+                    removed += 1
+        self.invalidations += removed
+        return removed
+
+    def clear(self, database: Optional[Hashable] = None) -> int:
+        if database is not None:
+            for index_key in [k for k in self._keys_by_table if k[:2] == database]:
+                del self._keys_by_table[index_key]
+            return self._cache.pop_where(lambda key: key[:2] == database)
+        removed = len(self._cache)
+        self._cache.clear()
+        self._keys_by_table.clear()
+        return removed
+
+    def forget(self, database: Hashable):
+        # Stop tracking a database (e.g. its pool was closed); the next lookup
+        # starts over with a first poll
+        self._versions.pop(database, None)
+        self._versions_checked_at.pop(database, None)
+
+    async def sync_changes(self, database: Hashable):
+        if self._change_loader is None:
+            return
+        task = self._sync_tasks.get(database)
+        if task is None:
+            if time.monotonic() - self._versions_checked_at.get(database, float("-inf")) < self.change_poll_interval:
+                return
+            task = asyncio.get_running_loop().create_task(self._load_changes(database))
+            self._sync_tasks[database] = task
+        # Lookups during a poll wait for it (single-flight) rather than serving
+        # entries that may be about to be invalidated
+        await asyncio.shield(task)
+
+    async def _load_changes(self, database: Hashable):
+        try:
+            versions = await self._change_loader(database)
+        except Exception as e:
+            # Keep serving; entries still expire after the TTL
+            self.change_check_errors += 1
+            print(f"Table change check failed: {e}")
+            return
+        finally:
+            self._versions_checked_at[database] = time.monotonic()
+            self._sync_tasks.pop(database, None)
+        self.change_checks += 1
+        self.apply_versions(database, versions)
+
+    def apply_versions(self, database: Hashable, versions: Dict[str, Any]) -> int:
+        previous = self._versions.get(database)
+        self._versions[database] = versions
+        if previous is None:
+            # First poll: nothing to compare against, so drop anything cached before it
+            removed = self.clear(database)
+            self.invalidations += removed
+            return removed
+        changed = [table for server, db, table in self._keys_by_table
+                   if (server, db) == database and previous.get(table) != versions.get(table)]
+        return self.invalidate_tables(changed, database)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._cache.stats()
+        stats.update({
+            "enabled": self.enabled,
+            "bypassed": self.bypassed,
+            "invalidations": self.invalidations,
+            "trackingChanges": self._change_loader is not None,
+            "changeChecks": self.change_checks,
+            "changeCheckErrors": self.change_check_errors,
+        })
+        return stats
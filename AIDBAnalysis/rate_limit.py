@@ -0,0 +1,155 @@
+import asyncio
+import random
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class TokenBucket:
+    # Classic token bucket: holds up to `capacity` tokens and refills at `rate`
+    # tokens per second. acquire() waits until `amount` tokens are available;
+    # waiters are served in FIFO order so a large request is not starved by a
+    # stream of small ones. An amount above capacity is clamped to capacity.
+    # `clock` is replaceable for tests.
+    def __init__(self, capacity: float, rate: float, clock: Callable[[], float] = time.monotonic):
+        if capacity <= 0 or rate <= 0:
+            raise ValueError("capacity and rate must be positive")
+        self.capacity = capacity
+        self.rate = rate
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+    async def acquire(self, amount: float = 1) -> float:
+        # Returns the time spent waiting, in seconds
+        amount = min(amount, self.capacity)
+        started = self._clock()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return self._clock() - started
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def refund(self, amount: float):
+        # Give back tokens taken by acquire() but not used, up to capacity
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + max(amount, 0))
+
+    def drain(self):
+        # Empty the bucket, e.g. after the server reported the quota exhausted
+        self._refill()
+        self._tokens = 0.0
+
+
+class LLMRateLimiter:
+    # Client-side view of a deployment's quotas: a tokens-per-minute and a
+    # requests-per-minute bucket (either may be disabled with 0). Azure charges a
+    # request its prompt tokens plus max_tokens up front, so callers acquire that
+    # estimate, and refund() what the completion did not use once its usage is
+    # known. When the server still answers 429, pause() holds back every caller
+    # until the Retry-After has passed, instead of each one retrying alone.
+    def __init__(
+        self,
+        tokens_per_minute: int = 0,
+        requests_per_minute: int = 0,
+        max_retries: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._clock = clock
+        self.tokens = (
+            TokenBucket(tokens_per_minute, tokens_per_minute / 60, clock) if tokens_per_minute > 0 else None
+        )
+        self.requests = (
+            TokenBucket(requests_per_minute, requests_per_minute / 60, clock) if requests_per_minute > 0 else None
+        )
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._paused_until = 0.0
+
+        self.acquired = 0
+        self.throttled = 0
+        self.wait_time_total = 0.0
+        self.rate_limited = 0
+        self.retries = 0
+        self.failures = 0
+        self.refunded = 0
+
+    async def acquire(self, estimated_tokens: int):
+        started = self._clock()
+        while True:
+            delay = self._paused_until - self._clock()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None:
+            await self.tokens.acquire(estimated_tokens)
+        waited = self._clock() - started
+        self.acquired += 1
+        if waited > 0.001:
+            self.throttled += 1
+            self.wait_time_total += waited
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        # Retry-After when the server sent one, otherwise exponential with full jitter
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def refund(self, tokens: int):
+        # Tokens acquired for a request but not used (max_tokens beyond its completion)
+        if self.tokens is not None and tokens > 0:
+            self.tokens.refund(tokens)
+            self.refunded += tokens
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+        if self.tokens is not None:
+            self.tokens.drain()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tokensPerMinute": self.tokens.capacity if self.tokens is not None else None,
+            "requestsPerMinute": self.requests.capacity if self.requests is not None else None,
+            "tokensAvailable": round(self.tokens.available) if self.tokens is not None else None,
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "waitTimeTotalMs": round(self.wait_time_total * 1000, 1),
+            "rateLimited": self.rate_limited,
+            "retries": self.retries,
+            "failures": self.failures,
+            "tokensRefunded": self.refunded,
+        }
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    # Azure OpenAI sends retry-after-ms and/or retry-after (seconds) on 429s
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except ValueError:
+            continue
+    return None
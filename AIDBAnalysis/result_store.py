@@ -0,0 +1,347 @@
+import asyncio
+import base64
+import binascii
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(result_id: str, offset: int) -> str:
+    # Opaque to clients; the key is the row position, which never changes
+    # since a stored result is append-only
+    raw = f"{result_id}:{offset}".encode("ascii")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, result_id: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode("ascii")
+        token_id, _, offset = raw.rpartition(":")
+        offset = int(offset)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursorError("Invalid cursor") from None
+    if token_id != result_id or offset < 0:
+        raise InvalidCursorError("Cursor belongs to another result")
+    return offset
+
+
+def _rows_as_lists(columns: Sequence[str], rows: Any) -> Iterable[Sequence[Any]]:
+    # QueryBatch rows are row dicts or {column: [values]}; both are stored as
+    # one JSON array per row, in column order
+    if isinstance(rows, dict):
+        return zip(*(rows[name] for name in columns))
+    return ([row.get(name) for name in columns] for row in rows)
+
+
+def _parse_lines(data: bytes) -> List[List[Any]]:
+    # Encoded rows never contain a raw newline, so the lines join into one array
+    if not data:
+        return []
+    return json.loads(b"[" + data.rstrip(b"\n").replace(b"\n", b",") + b"]")
+
+
+class StoredResult:
+    # The rows of one executed query, appended batch by batch. Rows are kept as
+    # encoded JSON lines, in memory until the result is spilled to its file;
+    # `offsets` then holds each row's start in the file (plus the end).
+    __slots__ = ("result_id", "columns", "row_count", "truncated", "complete", "aborted", "created_at",
+                 "expires_at", "lines", "memory_bytes", "path", "offsets", "_file", "_lock")
+
+    def __init__(self, result_id: str, expires_at: float):
+        self.result_id = result_id
+        self.columns: Optional[List[str]] = None
+        self.row_count = 0
+        self.truncated = False
+        self.complete = False
+        self.aborted = False
+        self.created_at = time.time()
+        self.expires_at = expires_at
+        self.lines: Optional[List[bytes]] = []
+        self.memory_bytes = 0
+        self.path: Optional[str] = None
+        self.offsets: Optional[array] = None
+        self._file = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def spilled(self) -> bool:
+        return self.path is not None
+
+    @property
+    def disk_bytes(self) -> int:
+        return self.offsets[-1] if self.offsets is not None else 0
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "resultId": self.result_id,
+            "columns": self.columns or [],
+            "totalRows": self.row_count,
+            "complete": self.complete,
+            "truncated": self.truncated,
+            "aborted": self.aborted,
+            "spilled": self.spilled,
+        }
+
+
+class ResultStore:
+    # Executed query results kept for paging, keyed by a random result id.
+    #  - rows are encoded once as compact JSON lines (values through `encode`)
+    #    and held in memory; a result is spilled to an NDJSON file in
+    #    `directory` once it is larger than `spill_bytes`, or when the store's
+    #    in-memory rows would exceed `memory_bytes`. A spilled result keeps
+    #    only the offset of each row, so any page is one seek and one read.
+    #  - file writes and reads run on the default thread pool, off the loop
+    #  - entries expire `ttl` seconds after they were last written or read; the
+    #    least recently used are evicted beyond `max_entries` or `max_disk_bytes`
+    #  - pages can be read while a result is still being written
+    def __init__(
+        self,
+        encode: Callable[[Any], str],
+        directory: Optional[str] = None,
+        ttl: float = 3600.0,
+        memory_bytes: int = 32 * 1024 * 1024,
+        spill_bytes: int = 1024 * 1024,
+        max_entries: int = 1000,
+        max_disk_bytes: int = 1024 * 1024 * 1024,
+        reap_interval: float = 60.0,
+    ):
+        self._encode = encode
+        self.directory = directory
+        self._own_directory = False
+        self.ttl = ttl
+        self.memory_bytes = memory_bytes
+        self.spill_bytes = spill_bytes
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.reap_interval = min(reap_interval, ttl)
+        self._entries: "OrderedDict[str, StoredResult]" = OrderedDict()
+        self._memory_total = 0
+        self._disk_total = 0
+        self._reaper: Optional[asyncio.Task] = None
+
+        self.created = 0
+        self.spilled = 0
+        self.aborted = 0
+        self.expired = 0
+        self.evicted = 0
+        self.pages = 0
+        self.rows_served = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _ensure_started(self):
+        if self._reaper is None and self.ttl > 0:
+            self._reaper = asyncio.get_running_loop().create_task(self._reap())
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            now = time.monotonic()
+            for result in [r for r in self._entries.values() if r.expires_at <= now and not r._lock.locked()]:
+                self._remove(result)
+                self.expired += 1
+
+    def create(self) -> StoredResult:
+        self._ensure_started()
+        result = StoredResult(uuid.uuid4().hex, time.monotonic() + self.ttl)
+        self._entries[result.result_id] = result
+        self.created += 1
+        self._evict()
+        return result
+
+    def get(self, result_id: str) -> Optional[StoredResult]:
+        result = self._entries.get(result_id)
+        if result is None:
+            return None
+        if result.expires_at <= time.monotonic():
+            self._remove(result)
+            self.expired += 1
+            return None
+        result.expires_at = time.monotonic() + self.ttl
+        self._entries.move_to_end(result_id)
+        return result
+
+    async def append(self, result: StoredResult, columns: Sequence[str], rows: Any):
+        if result.result_id not in self._entries:
+            return  # evicted while its query was still running
+        if result.columns is None:
+            result.columns = list(columns)
+        lines = [(self._encode(values) + "\n").encode("utf-8") for values in _rows_as_lists(result.columns, rows)]
+        if not lines:
+            return
+        size = sum(len(line) for line in lines)
+        async with result._lock:
+            if result.lines is None and not result.spilled:
+                return  # deleted meanwhile
+            if not result.spilled and (
+                result.memory_bytes + size > self.spill_bytes or self._memory_total + size > self.memory_bytes
+            ):
+                await self._spill(result)
+            if result.spilled:
+                await self._write(result, lines)
+            else:
+                result.lines.extend(lines)
+                result.memory_bytes += size
+                self._memory_total += size
+            result.row_count += len(lines)
+        result.expires_at = time.monotonic() + self.ttl
+        self._evict()
+
+    def _directory(self) -> str:
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="aidb-results-")
+            self._own_directory = True
+        elif not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        return self.directory
+
+    async def _spill(self, result: StoredResult):
+        loop = asyncio.get_running_loop()
+        path = os.path.join(await loop.run_in_executor(None, self._directory), f"{result.result_id}.ndjson")
+        result._file = await loop.run_in_executor(None, open, path, "wb")
+        result.path = path
+        result.offsets = array("Q", [0])
+        lines, result.lines = result.lines, None
+        self._memory_total -= result.memory_bytes
+        result.memory_bytes = 0
+        self.spilled += 1
+        await self._write(result, lines)
+
+    async def _write(self, result: StoredResult, lines: List[bytes]):
+        # Offsets advance only once the rows are flushed, so reads never see a partial row
+        await asyncio.get_running_loop().run_in_executor(None, self._write_file, result._file, b"".join(lines))
+        start = end = result.offsets[-1]
+        for line in lines:
+            end += len(line)
+            result.offsets.append(end)
+        self._disk_total += end - start
+
+    @staticmethod
+    def _write_file(file, data: bytes):
+        file.write(data)
+        file.flush()
+
+    def finish(self, result: StoredResult, truncated: bool, aborted: bool = False):
+        # The query is done, or failed / was cancelled (aborted): the rows so
+        # far stay readable. Synchronous so it can run while unwinding a cancel.
+        if result._file is not None:
+            result._file.close()
+            result._file = None
+        result.truncated = truncated or aborted
+        result.aborted = aborted
+        result.complete = True
+        if aborted:
+            self.aborted += 1
+
+    async def store_rows(self, columns: Sequence[str], batches: Iterable[Any], truncated: bool) -> StoredResult:
+        # Store rows already at hand, e.g. those of a cached query result
+        result = self.create()
+        for rows in batches:
+            await self.append(result, columns, rows)
+        self.finish(result, truncated)
+        return result
+
+    async def read(self, result: StoredResult, offset: int, limit: int) -> Optional[List[List[Any]]]:
+        # Rows [offset, offset + limit) as lists in column order; None when the
+        # result expired or was evicted meanwhile
+        offset = min(offset, result.row_count)
+        stop = min(offset + limit, result.row_count)
+        if offset >= stop:
+            return []
+        if not result.spilled:
+            rows = _parse_lines(b"".join(result.lines[offset:stop]))
+        else:
+            start, end = result.offsets[offset], result.offsets[stop]
+            try:
+                data = await asyncio.get_running_loop().run_in_executor(None, self._read_file, result.path, start, end)
+            except FileNotFoundError:
+                return None
+            rows = _parse_lines(data)
+        self.pages += 1
+        self.rows_served += len(rows)
+        return rows
+
+    @staticmethod
+    def _read_file(path: str, start: int, end: int) -> bytes:
+        with open(path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def _evict(self):
+        # Least recently used first, sparing results that are being written
+        for result in list(self._entries.values()):
+            if len(self._entries) <= self.max_entries and self._disk_total <= self.max_disk_bytes:
+                return
+            if result.complete and not result._lock.locked():
+                self._remove(result)
+                self.evicted += 1
+
+    def _remove(self, result: StoredResult):
+        self._entries.pop(result.result_id, None)
+        self._memory_total -= result.memory_bytes
+        self._disk_total -= result.disk_bytes
+        result.lines = None
+        result.memory_bytes = 0
+        if result.path is not None:
+            self._delete_file(result)
+
+    @staticmethod
+    def _delete_file(result: StoredResult):
+        try:
+            if result._file is not None:
+                result._file.close()
+            os.remove(result.path)
+        except OSError:
+            pass  # a read still has it open (Windows); the directory goes on close()
+
+    def delete(self, result_id: str) -> bool:
+        result = self._entries.get(result_id)
+        if result is None:
+            return False
+        self._remove(result)
+        return True
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+            self._reaper = None
+        for result in list(self._entries.values()):
+            self._remove(result)
+        if self._own_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+            self._own_directory = False
+
+    def stats(self) -> Dict[str, Any]:
+        spilled = sum(1 for result in self._entries.values() if result.spilled)
+        return {
+            "entries": len(self._entries),
+            "memoryEntries": len(self._entries) - spilled,
+            "diskEntries": spilled,
+            "memoryBytes": self._memory_total,
+            "diskBytes": self._disk_total,
+            "maxMemoryBytes": self.memory_bytes,
+            "maxDiskBytes": self.max_disk_bytes,
+            "spillBytes": self.spill_bytes,
+            "ttlSeconds": self.ttl,
+            "directory": self.directory,
+            "created": self.created,
+            "spilled": self.spilled,
+            "aborted": self.aborted,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "pagesServed": self.pages,
+            "rowsServed": self.rows_served,
+        }
@@ -0,0 +1,123 @@
+import base64
+import uuid
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+# Turns DB-API result rows into JSON-ready Python values.
+#
+# Converters are chosen once per result set from `cursor.description` instead of
+# running isinstance checks on every cell: integer, string, float and bool
+# columns pass through untouched, and only datetime/Decimal/bytes/UUID columns
+# get a specialised function. The output never needs CustomJSONEncoder.default,
+# so serialisation with plain json.dumps takes the C fast path.
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+def _decimal_to_float(value):
+    return float(value)
+
+
+def _bytes_to_base64(value):
+    return base64.b64encode(value).decode('utf-8')
+
+
+def _to_str(value):
+    return str(value)
+
+
+def convert_value(value):
+    # Fallback for columns whose type is unknown up front (e.g. drivers that
+    # report no type_code); mirrors CustomJSONEncoder
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode('utf-8')
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+_IDENTITY_TYPES = (int, str, float, bool)
+
+_TYPE_CONVERTERS: Dict[type, Callable[[Any], Any]] = {
+    datetime: _isoformat,
+    date: _isoformat,
+    time: _isoformat,
+    Decimal: _decimal_to_float,
+    bytes: _bytes_to_base64,
+    bytearray: _bytes_to_base64,
+    uuid.UUID: _to_str,
+}
+
+
+def column_converter(type_code) -> Optional[Callable[[Any], Any]]:
+    # None means the column's values are already JSON-native
+    if isinstance(type_code, type):
+        if type_code in _TYPE_CONVERTERS:
+            return _TYPE_CONVERTERS[type_code]
+        if issubclass(type_code, _IDENTITY_TYPES):
+            return None
+    return convert_value
+
+
+class RowConverter:
+    def __init__(self, description: Optional[Sequence[Sequence[Any]]]):
+        description = description or []
+        self.columns: List[str] = [column[0] for column in description]
+        self.converters = [column_converter(column[1] if len(column) > 1 else None) for column in description]
+        self._special = [(i, fn) for i, fn in enumerate(self.converters) if fn is not None]
+        self._row_to_dict = self._compile_row_to_dict()
+
+    @classmethod
+    def from_cursor(cls, cursor) -> "RowConverter":
+        return cls(cursor.description)
+
+    def _compile_row_to_dict(self) -> Callable[[Sequence[Any]], Dict[str, Any]]:
+        # Generate one function with the column lookups and converter calls
+        # unrolled, e.g. {_n[0]: row[0], _n[1]: None if (v1 := row[1]) is None else _c1(v1)}
+        namespace: Dict[str, Any] = {"_n": tuple(self.columns)}
+        items = []
+        for i, fn in enumerate(self.converters):
+            if fn is None:
+                items.append(f"_n[{i}]: row[{i}]")
+            else:
+                namespace[f"_c{i}"] = fn
+                items.append(f"_n[{i}]: None if (v{i} := row[{i}]) is None else _c{i}(v{i})")
+        source = "def row_to_dict(row):\n    return {" + ", ".join(items) + "}\n"
+        exec(compile(source, "<row_converter>", "exec"), namespace)
+        return namespace["row_to_dict"]
+
+    def convert_row(self, row: Sequence[Any]) -> Dict[str, Any]:
+        return self._row_to_dict(row)
+
+    def to_dicts(self, rows: Sequence[Sequence[Any]]) -> List[Dict[str, Any]]:
+        if not self._special:
+            columns = self.columns
+            return [dict(zip(columns, row)) for row in rows]
+        row_to_dict = self._row_to_dict
+        return [row_to_dict(row) for row in rows]
+
+    def to_columnar(self, rows: Sequence[Sequence[Any]]) -> Dict[str, List[Any]]:
+        # Column name -> list of values, without building a dict per row
+        if not rows:
+            return {name: [] for name in self.columns}
+        values = [list(column) for column in zip(*rows)]
+        for i, fn in self._special:
+            values[i] = [None if v is None else fn(v) for v in values[i]]
+        return dict(zip(self.columns, values))
+
+
+def columnar_length(data: Dict[str, List[Any]]) -> int:
+    for values in data.values():
+        return len(values)
+    return 0
+
+
+def slice_columnar(data: Dict[str, List[Any]], stop: int, start: int = 0) -> Dict[str, List[Any]]:
+    return {name: values[start:stop] for name, values in data.items()}
@@ -0,0 +1,234 @@
+import asyncio
+import time
+from collections import namedtuple
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+# Define namedtuples for better readability
+Column = namedtuple("Column", ["table_name", "column_name", "data_type", "is_nullable", "column_default"])
+ForeignKey = namedtuple("ForeignKey", ["table_name", "column_name", "foreign_table_name", "foreign_column_name"])
+
+COLUMNS_QUERY = """
+SELECT TABLE_NAME as table_name, COLUMN_NAME as column_name,
+DATA_TYPE as data_type, IS_NULLABLE as is_nullable,
+COLUMN_DEFAULT as column_default
+FROM INFORMATION_SCHEMA.COLUMNS
+WHERE TABLE_SCHEMA = ?{table_filter}
+ORDER BY TABLE_NAME, ORDINAL_POSITION;
+"""
+
+FKS_QUERY = """
+SELECT
+    tc.TABLE_NAME as table_name, kcu.COLUMN_NAME as column_name,
+    ccu.TABLE_NAME AS foreign_table_name,
+    ccu.COLUMN_NAME AS foreign_column_name
+FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS AS tc
+JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE AS kcu ON tc.CONSTRAINT_NAME = kcu.CONSTRAINT_NAME
+JOIN INFORMATION_SCHEMA.CONSTRAINT_COLUMN_USAGE AS ccu ON ccu.CONSTRAINT_NAME = tc.CONSTRAINT_NAME
+WHERE tc.CONSTRAINT_TYPE = 'FOREIGN KEY' AND tc.TABLE_SCHEMA = ?{table_filter};
+"""
+
+# One row per table/view with the latest modify_date of the object itself or of
+# any object parented to it (constraints, triggers), so ALTERs and new FKs show up
+VERSIONS_QUERY = """
+SELECT o.name AS table_name, o.modify_date,
+    (SELECT MAX(c.modify_date) FROM sys.objects AS c WHERE c.parent_object_id = o.object_id) AS child_modify_date
+FROM sys.objects AS o
+JOIN sys.schemas AS s ON s.schema_id = o.schema_id
+WHERE s.name = ? AND o.type IN ('U', 'V');
+"""
+
+# Above this many changed tables a full reload is cheaper than an IN (...) filter
+INCREMENTAL_TABLE_LIMIT = 100
+
+
+class SchemaSnapshot:
+    __slots__ = ("schema", "versions", "loaded_at", "mode")
+
+    def __init__(self, schema: Dict[str, Any], versions: Optional[Dict[str, Any]], mode: str):
+        self.schema = schema
+        self.versions = versions  # table -> modify_date marker, None if unavailable
+        self.loaded_at = time.monotonic()
+        self.mode = mode  # "full", "incremental" or "unchanged"
+
+
+def build_schema(columns, fks) -> Dict[str, Any]:
+    schema = {}
+    for row in columns:
+        table = row.table_name
+        if table not in schema:
+            schema[table] = {"columns": [], "relationships": []}
+        schema[table]["columns"].append({
+            "name": row.column_name,
+            "type": row.data_type,
+            "nullable": row.is_nullable == 'YES',
+            "default": row.column_default
+        })
+
+    for fk in fks:
+        table = fk.table_name
+        if table in schema:
+            schema[table]["relationships"].append({
+                "column": fk.column_name,
+                "references": {
+                    "table": fk.foreign_table_name,
+                    "column": fk.foreign_column_name
+                }
+            })
+    return schema
+
+
+def _table_filter(column: str, tables: Optional[List[str]]) -> str:
+    if not tables:
+        return ""
+    return f" AND {column} IN ({', '.join('?' for _ in tables)})"
+
+
+def _load_tables(cursor, schema_name: str, tables: Optional[List[str]] = None) -> Dict[str, Any]:
+    params = [schema_name] + list(tables or [])
+    cursor.execute(COLUMNS_QUERY.format(table_filter=_table_filter("TABLE_NAME", tables)), params)
+    columns = [Column(*row) for row in cursor.fetchall()]
+    cursor.execute(FKS_QUERY.format(table_filter=_table_filter("tc.TABLE_NAME", tables)), params)
+    fks = [ForeignKey(*row) for row in cursor.fetchall()]
+    return build_schema(columns, fks)
+
+
+def _load_versions(cursor, schema_name: str) -> Optional[Dict[str, Any]]:
+    try:
+        cursor.execute(VERSIONS_QUERY, schema_name)
+        rows = cursor.fetchall()
+    except Exception as e:
+        # Without access to sys.objects every refresh falls back to a full load
+        print(f"Schema version check unavailable, using full reloads: {e}")
+        return None
+    return {row[0]: max(d for d in (row[1], row[2]) if d is not None) for row in rows}
+
+
+def load_schema_snapshot(conn, schema_name: str, previous: Optional[SchemaSnapshot] = None) -> SchemaSnapshot:
+    # Blocking: run on the DB executor. Only tables whose sys.objects modify_date
+    # changed since `previous` are re-read from INFORMATION_SCHEMA.
+    cursor = conn.cursor()
+    try:
+        versions = _load_versions(cursor, schema_name)
+        if previous is None or previous.versions is None or versions is None:
+            return SchemaSnapshot(_load_tables(cursor, schema_name), versions, "full")
+
+        changed = [table for table, version in versions.items() if previous.versions.get(table) != version]
+        removed = [table for table in previous.versions if table not in versions]
+        if not changed and not removed:
+            return SchemaSnapshot(previous.schema, versions, "unchanged")
+        if len(changed) > INCREMENTAL_TABLE_LIMIT:
+            return SchemaSnapshot(_load_tables(cursor, schema_name), versions, "full")
+
+        reloaded = _load_tables(cursor, schema_name, changed) if changed else {}
+        merged = {
+            table: details for table, details in previous.schema.items()
+            if table not in reloaded and table not in removed and table in versions
+        }
+        merged.update(reloaded)
+        # Keep the ORDER BY TABLE_NAME ordering of a full load
+        schema = {table: merged[table] for table in sorted(merged)}
+        return SchemaSnapshot(schema, versions, "incremental")
+    finally:
+        cursor.close()
+
+
+class SchemaCache:
+    # Schema cache keyed per (server, database, schema).
+    #  - single-flight: concurrent misses for a key share one load
+    #  - stale-while-revalidate: within `refresh_ahead` seconds of expiry the
+    #    cached schema is served while a background refresh runs
+    #  - stale-if-error: a failed refresh keeps serving the previous schema
+    def __init__(
+        self,
+        loader: Callable[[Hashable, Optional[SchemaSnapshot]], Awaitable[SchemaSnapshot]],
+        ttl: float = 3600.0,
+        refresh_ahead: float = 300.0,
+    ):
+        self._loader = loader
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self._entries: Dict[Hashable, SchemaSnapshot] = {}
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_served = 0
+        self.background_refreshes = 0
+        self.loads = {"full": 0, "incremental": 0, "unchanged": 0}
+        self.load_errors = 0
+
+    async def get(self, key: Hashable) -> Dict[str, Any]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.loaded_at
+            if age < self.ttl:
+                if age >= self.ttl - self.refresh_ahead:
+                    self._refresh_in_background(key)
+                self.hits += 1
+                return entry.schema
+
+        self.misses += 1
+        try:
+            snapshot = await asyncio.shield(self._load(key))
+        except Exception:
+            if entry is None:
+                raise
+            self.stale_served += 1
+            return entry.schema
+        return snapshot.schema
+
+    def peek(self, key: Hashable) -> Optional[SchemaSnapshot]:
+        return self._entries.get(key)
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        keys = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def _load(self, key: Hashable) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._run_load(key))
+            self._inflight[key] = task
+
+            def done(t, key=key):
+                if self._inflight.get(key) is t:
+                    del self._inflight[key]
+                if not t.cancelled() and t.exception() is not None:
+                    self.load_errors += 1
+                    print(f"Schema load failed for {key}: {t.exception()}")
+
+            task.add_done_callback(done)
+        return task
+
+    async def _run_load(self, key: Hashable) -> SchemaSnapshot:
+        snapshot = await self._loader(key, self._entries.get(key))
+        self._entries[key] = snapshot
+        self.loads[snapshot.mode] = self.loads.get(snapshot.mode, 0) + 1
+        return snapshot
+
+    def _refresh_in_background(self, key: Hashable):
+        if key not in self._inflight:
+            self.background_refreshes += 1
+            self._load(key)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "staleServed": self.stale_served,
+            "backgroundRefreshes": self.background_refreshes,
+            "refreshing": len(self._inflight),
+            "loads": dict(self.loads),
+            "loadErrors": self.load_errors,
+        }
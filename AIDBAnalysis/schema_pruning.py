@@ -0,0 +1,223 @@
+import json
+import math
+import re
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from table_profiles import encode_profiles
+
+_ENCODING = None
+_ENCODING_LOADED = False
+
+# Goal words that say nothing about which tables are relevant
+STOPWORDS = {
+    "a", "all", "an", "and", "are", "by", "each", "find", "for", "from", "get", "give", "how",
+    "in", "is", "list", "me", "most", "of", "on", "per", "show", "the", "their", "to", "top",
+    "what", "which", "who", "with",
+}
+
+TABLE_NAME_WEIGHT = 3.0
+COLUMN_NAME_WEIGHT = 1.0
+FK_NEIGHBOR_FACTOR = 0.5  # neighbours of a relevant table inherit this share of its score
+MAX_SAMPLE_VALUE_CHARS = 60
+
+_IDENTIFIER_WORD = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def load_tokenizer():
+    # tiktoken is imported on first use (or by the start-up warm-up): loading the
+    # encoding can mean reading or downloading its BPE file
+    global _ENCODING, _ENCODING_LOADED
+    if not _ENCODING_LOADED:
+        try:
+            import tiktoken
+            _ENCODING = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # optional dependency; fall back to a character heuristic
+            _ENCODING = None
+        _ENCODING_LOADED = True
+    return _ENCODING
+
+
+def count_tokens(text: str) -> int:
+    encoding = load_tokenizer()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def _stem(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def identifier_tokens(name: str) -> Set[str]:
+    # "SalesOrderHeader" -> {"sale", "order", "header"}, "rowguid" -> {"rowguid"}
+    return {_stem(word.lower()) for word in _IDENTIFIER_WORD.findall(name)}
+
+
+def goal_tokens(goal: str) -> Set[str]:
+    tokens = set()
+    for word in re.findall(r"[A-Za-z0-9]+", goal):
+        tokens.update(t for t in identifier_tokens(word) if t not in STOPWORDS)
+    return tokens
+
+
+class SchemaIndex:
+    # Keyword index over table and column names plus the FK graph of a schema
+    def __init__(self, schema: Dict[str, Any]):
+        self.tables = list(schema)
+        self._position = {table: i for i, table in enumerate(self.tables)}
+        self.weights: Dict[str, Dict[str, float]] = {}  # token -> {table: weight}
+        self.neighbors: Dict[str, Set[str]] = {table: set() for table in schema}
+        for table, details in schema.items():
+            self._add(table, identifier_tokens(table), TABLE_NAME_WEIGHT)
+            for column in details.get("columns", []):
+                self._add(table, identifier_tokens(column["name"]), COLUMN_NAME_WEIGHT)
+            for relationship in details.get("relationships", []):
+                other = relationship["references"]["table"]
+                if other in self.neighbors and other != table:
+                    self.neighbors[table].add(other)
+                    self.neighbors[other].add(table)
+
+    def _add(self, table: str, tokens: Iterable[str], weight: float):
+        for token in tokens:
+            by_table = self.weights.setdefault(token, {})
+            by_table[table] = max(by_table.get(table, 0.0), weight)
+
+    def rank(self, goal: str, limit: int) -> List[str]:
+        scores: Dict[str, float] = {}
+        for token in goal_tokens(goal):
+            for table, weight in self.weights.get(token, {}).items():
+                scores[table] = scores.get(table, 0.0) + weight
+        if not scores:
+            # Nothing matched: keep schema order and let the token budget decide
+            return self.tables[:limit]
+
+        direct = set(scores)
+        # Junction tables linking two or more relevant tables are needed for joins
+        for table, linked in self.neighbors.items():
+            shared = linked & direct
+            if table not in direct and len(shared) >= 2:
+                scores[table] = FK_NEIGHBOR_FACTOR * sum(scores[t] for t in shared)
+        for table in direct:
+            for neighbor in self.neighbors[table]:
+                if neighbor not in scores:
+                    scores[neighbor] = FK_NEIGHBOR_FACTOR * scores[table] / 2
+
+        ranked = sorted(scores, key=lambda t: (-scores[t], self._position[t]))
+        return ranked[:limit]
+
+
+_index_cache: "OrderedDict[int, Tuple[Dict[str, Any], SchemaIndex]]" = OrderedDict()
+
+
+def schema_index(schema: Dict[str, Any]) -> SchemaIndex:
+    # Cached schemas are replaced (not mutated) on refresh, so identity is a safe key
+    entry = _index_cache.get(id(schema))
+    if entry is not None and entry[0] is schema:
+        _index_cache.move_to_end(id(schema))
+        return entry[1]
+    index = SchemaIndex(schema)
+    _index_cache[id(schema)] = (schema, index)
+    while len(_index_cache) > 16:
+        _index_cache.popitem(last=False)
+    return index
+
+
+def rank_tables(goal: str, schema: Dict[str, Any], limit: int) -> List[str]:
+    return schema_index(schema).rank(goal, limit)
+
+
+def encode_table_schema(table: str, details: Dict[str, Any]) -> str:
+    # Customer(CustomerID int, MiddleName nvarchar?, ...) FK SalesPersonID->Person.ID
+    columns = ", ".join(
+        f"{c['name']} {c['type']}{'?' if c.get('nullable') else ''}" for c in details.get("columns", [])
+    )
+    line = f"{table}({columns})"
+    fks = "; ".join(
+        f"{r['column']}->{r['references']['table']}.{r['references']['column']}"
+        for r in details.get("relationships", [])
+    )
+    return f"{line} FK {fks}" if fks else line
+
+
+def encode_schema(schema: Dict[str, Any]) -> str:
+    return "\n".join(encode_table_schema(table, details) for table, details in schema.items())
+
+
+def _compact_value(value):
+    if isinstance(value, str) and len(value) > MAX_SAMPLE_VALUE_CHARS:
+        return value[:MAX_SAMPLE_VALUE_CHARS] + "…"
+    return value
+
+
+def encode_table_samples(table: str, rows: List[Dict[str, Any]]) -> str:
+    # Header once, then one compact JSON array per row
+    if not rows:
+        return ""
+    columns = list(rows[0].keys())
+    lines = [f"{table}: {json.dumps(columns, ensure_ascii=False)}"]
+    for row in rows:
+        values = [_compact_value(row.get(column)) for column in columns]
+        lines.append(json.dumps(values, ensure_ascii=False, default=str, separators=(",", ":")))
+    return "\n".join(lines)
+
+
+def encode_samples(samples: Dict[str, List[Dict[str, Any]]]) -> str:
+    return "\n".join(text for text in (encode_table_samples(t, rows) for t, rows in samples.items()) if text)
+
+
+def _fit_tables(schema: Dict[str, Any], tables: List[str], budget: int) -> Tuple[Dict[str, Any], int]:
+    # Table definitions in rank order while they fit; returns them and the tokens used
+    context_schema: Dict[str, Any] = {}
+    used = 0
+    for table in tables:
+        if table not in schema:
+            continue
+        cost = count_tokens(encode_table_schema(table, schema[table])) + 1
+        if context_schema and used + cost > budget:
+            break
+        context_schema[table] = schema[table]
+        used += cost
+    return context_schema, used
+
+
+def fit_context(
+    schema: Dict[str, Any],
+    tables: List[str],
+    samples: Dict[str, List[Dict[str, Any]]],
+    budget: int,
+    sample_row_steps: Tuple[int, ...] = (5, 3, 2, 1, 0),
+) -> Dict[str, Any]:
+    # Pick the schema subset and sample rows (in table rank order) that fit the
+    # token budget: table definitions first, then as many sample rows per table
+    # as the remaining budget allows
+    context_schema, used = _fit_tables(schema, tables, budget)
+
+    context_samples: Dict[str, List[Dict[str, Any]]] = {}
+    for rows_per_table in sample_row_steps:
+        candidate = {t: samples.get(t, [])[:rows_per_table] for t in context_schema}
+        if rows_per_table == 0 or used + count_tokens(encode_samples(candidate)) <= budget:
+            context_samples = candidate
+            break
+
+    return {"schema": context_schema, "samples": context_samples}
+
+
+def fit_profile_context(
+    schema: Dict[str, Any],
+    tables: List[str],
+    profiles: Dict[str, Optional[Dict[str, Any]]],
+    budget: int,
+) -> Dict[str, Any]:
+    # fit_context with table profiles instead of sample rows: the profiles of the
+    # chosen tables with their frequent values, without them, or none at all
+    context_schema, used = _fit_tables(schema, tables, budget)
+    candidate = {table: profiles[table] for table in context_schema if profiles.get(table)}
+    for top_values in (True, False):
+        if used + count_tokens(encode_profiles(candidate, top_values)) <= budget:
+            return {"schema": context_schema, "profiles": candidate, "topValues": top_values}
+    return {"schema": context_schema, "profiles": {}, "topValues": False}
@@ -0,0 +1,366 @@
+import asyncio
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+# Values are stored as JSON. Types JSON lacks are written as {"$type": ..., "value": ...}
+# and turned back into the same type on read, so e.g. schema versions stay datetimes.
+_TYPE_TAG = "$type"
+
+
+class _ValueEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            return {_TYPE_TAG: "datetime", "value": obj.isoformat()}
+        if isinstance(obj, date):
+            return {_TYPE_TAG: "date", "value": obj.isoformat()}
+        if isinstance(obj, dt_time):
+            return {_TYPE_TAG: "time", "value": obj.isoformat()}
+        if isinstance(obj, Decimal):
+            return {_TYPE_TAG: "decimal", "value": str(obj)}
+        if isinstance(obj, (bytes, bytearray)):
+            return {_TYPE_TAG: "bytes", "value": base64.b64encode(obj).decode("ascii")}
+        return super().default(obj)
+
+
+_DECODERS: Dict[str, Callable[[str], Any]] = {
+    "datetime": datetime.fromisoformat,
+    "date": date.fromisoformat,
+    "time": dt_time.fromisoformat,
+    "decimal": Decimal,
+    "bytes": base64.b64decode,
+}
+
+
+def _decode_tagged(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 2 and obj.get(_TYPE_TAG) in _DECODERS and "value" in obj:
+        return _DECODERS[obj[_TYPE_TAG]](obj["value"])
+    return obj
+
+
+def encode_value(value: Any) -> bytes:
+    # Raises TypeError for types that are neither JSON nor tagged (tuples come back as lists)
+    return json.dumps(value, cls=_ValueEncoder, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode_value(data: bytes) -> Any:
+    return json.loads(data, object_hook=_decode_tagged)
+
+
+class CacheBackend(ABC):
+    # Storage shared by the workers of a host (or, for a networked backend, of
+    # several hosts). Values are opaque bytes; `expires_at` is wall-clock time.
+    # Every method blocks: SharedCache runs them on a worker thread.
+    name = "none"
+
+    @abstractmethod
+    def get(self, namespace: str, key: str) -> Optional[Tuple[bytes, float]]:
+        # (value, expires_at), or None when missing or expired
+        ...
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: bytes, ttl: float):
+        ...
+
+    @abstractmethod
+    def acquire(self, namespace: str, key: str, owner: str, lease: float) -> bool:
+        # Take the lock on a key for `lease` seconds unless another owner holds it
+        ...
+
+    @abstractmethod
+    def renew(self, namespace: str, key: str, owner: str, lease: float) -> bool:
+        # Extend a lock `owner` holds to `lease` seconds from now; False when it is no longer held
+        ...
+
+    @abstractmethod
+    def release(self, namespace: str, key: str, owner: str):
+        ...
+
+    def close(self):
+        pass
+
+
+class SQLiteCacheBackend(CacheBackend):
+    # A SQLite file every worker opens, in WAL mode so readers do not block the
+    # writer. Each write is one transaction, so a value is either there whole or
+    # not at all. Locks are rows with an expiry: a worker that dies holding one
+    # only delays the others until its lease runs out. Least recently used
+    # entries beyond `max_entries` are pruned every `prune_every` writes.
+    name = "sqlite"
+
+    def __init__(self, path: str, max_entries: int = 10000, prune_every: int = 100, busy_timeout: float = 5.0):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        try:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError as e:
+            print(f"Shared cache WAL mode unavailable: {e}")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS shared_cache_accessed ON shared_cache (accessed_at)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_cache_locks ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, owner TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[bytes, float]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at, accessed_at FROM shared_cache "
+                "WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, now),
+            ).fetchone()
+            # Recency is recorded at most once a minute, to keep hits read-only
+            if row is not None and now - row[2] > 60:
+                with self._conn:
+                    self._conn.execute(
+                        "UPDATE shared_cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                        (now, namespace, key),
+                    )
+        return (row[0], row[1]) if row is not None else None
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: float):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO shared_cache (namespace, key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, sqlite3.Binary(value), now + ttl, now),
+            )
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self._conn.execute("DELETE FROM shared_cache WHERE expires_at <= ?", (now,))
+                self._conn.execute(
+                    "DELETE FROM shared_cache WHERE rowid IN ("
+                    "SELECT rowid FROM shared_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._conn.execute("DELETE FROM shared_cache_locks WHERE expires_at <= ?", (now,))
+
+    def acquire(self, namespace: str, key: str, owner: str, lease: float) -> bool:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM shared_cache_locks WHERE namespace = ? AND key = ? AND expires_at <= ?",
+                (namespace, key, now),
+            )
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO shared_cache_locks (namespace, key, owner, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, owner, now + lease),
+            )
+            return cursor.rowcount == 1
+
+    def renew(self, namespace: str, key: str, owner: str, lease: float) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE shared_cache_locks SET expires_at = ? WHERE namespace = ? AND key = ? AND owner = ?",
+                (time.time() + lease, namespace, key, owner),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, namespace: str, key: str, owner: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM shared_cache_locks WHERE namespace = ? AND key = ? AND owner = ?",
+                (namespace, key, owner),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Backends by SHARED_CACHE_BACKEND name; a networked backend registers here
+BACKENDS: Dict[str, Callable[..., CacheBackend]] = {"sqlite": SQLiteCacheBackend}
+
+
+def create_backend(name: str, path: str, **options) -> CacheBackend:
+    factory = BACKENDS.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown shared cache backend {name!r} (available: {', '.join(sorted(BACKENDS))})")
+    return factory(path, **options)
+
+
+class SharedEntry:
+    __slots__ = ("value", "ttl", "loaded")
+
+    def __init__(self, value: Any, ttl: float, loaded: bool):
+        self.value = value
+        self.ttl = ttl  # seconds left
+        self.loaded = loaded  # loaded by this worker rather than taken from the cache
+
+
+class SharedCache:
+    # Async front of a CacheBackend, kept behind each worker's in-memory caches.
+    #  - values are stored as JSON (encode_value), with dates, times, Decimals
+    #    and bytes tagged so they keep their types
+    #  - load() and locked() are a single-flight across processes: the worker
+    #    that takes a key's lock loads and stores the value; the others poll
+    #    until it appears. The holder renews its lock every third of
+    #    `lock_lease`, so a slow load is not taken over; a worker that dies
+    #    holding it delays the others until the lease runs out.
+    #  - backend errors are logged and treated as misses, so a broken shared
+    #    tier costs the sharing and nothing else
+    def __init__(self, backend: CacheBackend, lock_lease: float = 30.0, poll_interval: float = 0.05):
+        self.backend = backend
+        self.lock_lease = lock_lease
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+        self.errors = 0
+
+    def _count(self, namespace: str, counter: str):
+        counters = self._counters.setdefault(namespace, {"hits": 0, "misses": 0, "loads": 0, "lockWaits": 0})
+        counters[counter] += 1
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return key if isinstance(key, str) else json.dumps(key, separators=(",", ":"), default=str)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def _read(self, namespace: str, key: str) -> Optional[SharedEntry]:
+        try:
+            row = await self._run(self.backend.get, namespace, key)
+            if row is None:
+                return None
+            value, expires_at = row
+            return SharedEntry(decode_value(value), max(expires_at - time.time(), 0.0), False)
+        except Exception as e:
+            self.errors += 1
+            print(f"Shared cache read failed: {e}")
+            return None
+
+    async def get(self, namespace: str, key: Hashable) -> Optional[SharedEntry]:
+        entry = await self._read(namespace, self._key(key))
+        self._count(namespace, "hits" if entry is not None else "misses")
+        return entry
+
+    async def set(self, namespace: str, key: Hashable, value: Any, ttl: float):
+        try:
+            await self._run(self.backend.set, namespace, self._key(key), encode_value(value), ttl)
+        except Exception as e:
+            self.errors += 1
+            print(f"Shared cache write failed: {e}")
+
+    async def _acquire(self, namespace: str, key: str) -> bool:
+        try:
+            return await self._run(self.backend.acquire, namespace, key, self.owner, self.lock_lease)
+        except Exception as e:
+            self.errors += 1
+            print(f"Shared cache lock failed: {e}")
+            return True  # load without the lock rather than wait for nothing
+
+    async def _renew(self, namespace: str, key: str):
+        # Heartbeat of a held lock, cancelled on release
+        while True:
+            await asyncio.sleep(self.lock_lease / 3)
+            try:
+                held = await self._run(self.backend.renew, namespace, key, self.owner, self.lock_lease)
+            except Exception as e:
+                self.errors += 1
+                print(f"Shared cache lock renewal failed: {e}")
+                continue
+            if not held:
+                print(f"Shared cache lock on {namespace}/{key} was lost")
+                return
+
+    async def _release(self, namespace: str, key: str):
+        try:
+            await self._run(self.backend.release, namespace, key, self.owner)
+        except Exception as e:
+            self.errors += 1
+            print(f"Shared cache unlock failed: {e}")
+
+    @asynccontextmanager
+    async def locked(self, namespace: str, key: Hashable, check_first: bool = True) -> AsyncIterator[Optional[SharedEntry]]:
+        # Yields the cached entry, or None once this worker holds the key's
+        # lock: the block then loads the value and set()s it, and the lock is
+        # released when it exits. check_first=False skips the first lookup, for
+        # callers that have just missed with get().
+        shared_key = self._key(key)
+        delay = self.poll_interval
+        waited = False
+        entry = None
+        while True:
+            if check_first or waited:
+                entry = await self._read(namespace, shared_key)
+                if entry is not None:
+                    break
+            if await self._acquire(namespace, shared_key):
+                break
+            if not waited:
+                waited = True
+                self._count(namespace, "lockWaits")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+        if entry is not None:
+            self._count(namespace, "hits")
+            yield entry
+            return
+        heartbeat = asyncio.ensure_future(self._renew(namespace, shared_key))
+        try:
+            # Stored by the previous holder between our lookup and the lock
+            entry = await self._read(namespace, shared_key)
+            if entry is not None:
+                self._count(namespace, "hits")
+            else:
+                self._count(namespace, "misses")
+                self._count(namespace, "loads")
+            yield entry
+        finally:
+            heartbeat.cancel()
+            await self._release(namespace, shared_key)
+
+    async def load(
+        self, namespace: str, key: Hashable, loader: Callable[[], Awaitable[Any]], ttl: float, check_first: bool = True
+    ) -> SharedEntry:
+        # The cached value, or the one `loader` returns (None is returned but not stored)
+        async with self.locked(namespace, key, check_first) as entry:
+            if entry is not None:
+                return entry
+            value = await loader()
+            if value is not None:
+                await self.set(namespace, key, value, ttl)
+            return SharedEntry(value, ttl, True)
+
+    def close(self):
+        self.backend.close()
+
+    def stats(self) -> Dict[str, Any]:
+        totals = {"hits": 0, "misses": 0, "loads": 0, "lockWaits": 0}
+        for counters in self._counters.values():
+            for name, value in counters.items():
+                totals[name] += value
+        lookups = totals["hits"] + totals["misses"]
+        return {
+            "backend": self.backend.name,
+            **totals,
+            "hitRatio": round(totals["hits"] / lookups, 4) if lookups else 0.0,
+            "errors": self.errors,
+            "namespaces": {namespace: dict(counters) for namespace, counters in self._counters.items()},
+        }
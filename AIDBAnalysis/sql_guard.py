@@ -0,0 +1,313 @@
+import re
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from db_pool import BrokenConnectionError
+
+_TOKEN = re.compile(r"""
+    (?P<string>N?'(?:[^']|'')*')
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<space>\s+)
+  | (?P<ident>\[(?:[^\]]|\]\])*\]|"(?:[^"]|"")*")
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<word>[@#$\w]+)
+  | (?P<punct>.)
+""", re.DOTALL | re.VERBOSE)
+
+# Statements and options that write, change settings or reach outside the database
+FORBIDDEN_KEYWORDS = {
+    "INSERT", "UPDATE", "DELETE", "MERGE", "TRUNCATE", "DROP", "ALTER", "CREATE", "GRANT", "REVOKE", "DENY",
+    "EXEC", "EXECUTE", "INTO", "SET", "USE", "DBCC", "BACKUP", "RESTORE", "SHUTDOWN", "KILL", "RECONFIGURE",
+    "WAITFOR", "BULK", "OPENROWSET", "OPENQUERY", "OPENDATASOURCE", "OPENXML", "BEGIN", "COMMIT", "ROLLBACK",
+    "DECLARE", "GOTO",
+}
+_CLAUSES = {"SELECT", "FROM", "WHERE", "GROUP", "HAVING", "ORDER", "ON", "UNION", "EXCEPT", "INTERSECT", "OPTION"}
+
+SHOWPLAN_NS = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+
+PlanEstimate = namedtuple("PlanEstimate", ["cost", "rows", "warnings"])
+
+
+class SqlRejectedError(Exception):
+    pass
+
+
+class _Token:
+    __slots__ = ("kind", "text", "depth")
+
+    def __init__(self, kind: str, text: str, depth: int = 0):
+        self.kind = kind
+        self.text = text
+        self.depth = depth
+
+    @property
+    def upper(self) -> str:
+        return self.text.upper() if self.kind == "word" else ""
+
+
+def _tokenize(sql: str) -> List[_Token]:
+    # Comments become whitespace; `depth` is the parenthesis nesting level
+    tokens = []
+    depth = 0
+    for match in _TOKEN.finditer(sql):
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "comment":
+            kind, text = "space", " "
+        if text == ")":
+            depth -= 1
+        tokens.append(_Token(kind, text, depth))
+        if text == "(":
+            depth += 1
+    return tokens
+
+
+def _code(tokens: List[_Token]) -> List[int]:
+    return [i for i, token in enumerate(tokens) if token.kind != "space"]
+
+
+def _render(tokens: List[_Token]) -> str:
+    return "".join(token.text for token in tokens).strip()
+
+
+def _unquote(name: str) -> str:
+    if name[:1] in ("[", '"'):
+        return name[1:-1]
+    return name
+
+
+class GuardedQuery:
+    # A generated query after guard_query: `sql` is what will run, `changes`
+    # describes every rewrite in words, for the queryResult/queryError events.
+    # `max_rows` is the row limit it was guarded with; fetching stops there too.
+    __slots__ = ("original", "sql", "changes", "max_rows", "estimated_cost", "downgraded")
+
+    def __init__(self, original: str, sql: str, changes: List[str], max_rows: Optional[int] = None):
+        self.original = original
+        self.sql = sql
+        self.changes = changes
+        self.max_rows = max_rows
+        self.estimated_cost: Optional[float] = None
+        self.downgraded = False
+
+    def report(self) -> Dict[str, Any]:
+        report: Dict[str, Any] = {}
+        if self.sql != self.original:
+            report["executedSql"] = self.sql
+        if self.changes:
+            report["guard"] = list(self.changes)
+        if self.estimated_cost is not None:
+            report["estimatedCost"] = round(self.estimated_cost, 4)
+        if self.downgraded:
+            # "truncated" then refers to this lower limit
+            report["downgraded"] = True
+            report["rowLimit"] = self.max_rows
+        return report
+
+
+def _cte_names(tokens: List[_Token], code: List[int]) -> Set[str]:
+    first_select = next((p for p, i in enumerate(code) if tokens[i].upper == "SELECT" and tokens[i].depth == 0), 0)
+    return {
+        _unquote(tokens[code[p]].text).lower()
+        for p in range(1, first_select)
+        if tokens[code[p]].depth == 0 and (tokens[code[p - 1]].upper == "WITH" or tokens[code[p - 1]].text == ",")
+    }
+
+
+def _from_items(tokens: List[_Token], code: List[int]) -> Iterator[int]:
+    # Positions in `code` of the names that start a FROM list item: right after
+    # FROM/JOIN, or after a comma in a FROM list (also one following a JOIN's ON
+    # condition). Subqueries start with "(" and are not yielded.
+    clause_by_depth: Dict[int, str] = {}
+    for position, i in enumerate(code):
+        token = tokens[i]
+        if token.text == "(":
+            # A new parenthesis starts without a clause (a function call's commas are not a FROM list)
+            clause_by_depth.pop(token.depth + 1, None)
+            continue
+        if token.upper in _CLAUSES or token.upper == "JOIN":
+            clause_by_depth[token.depth] = token.upper
+            continue
+        if token.kind not in ("word", "ident") or not position:
+            continue
+        previous = tokens[code[position - 1]]
+        if previous.upper in ("FROM", "JOIN") or (
+            previous.text == "," and clause_by_depth.get(token.depth) in ("FROM", "JOIN", "ON")
+        ):
+            yield position
+
+
+def qualify_tables(sql: str, schema: str, tables: Iterable[str]) -> str:
+    # Prefix known tables named right after FROM/JOIN (or after a comma in a
+    # FROM list) with `schema`; already qualified names, aliases, subqueries and
+    # CTE names are left alone
+    known = {table.lower() for table in tables}
+    tokens = _tokenize(sql)
+    code = _code(tokens)
+    cte_names = _cte_names(tokens, code)
+    for position in list(_from_items(tokens, code)):
+        token = tokens[code[position]]
+        following = tokens[code[position + 1]] if position + 1 < len(code) else None
+        name = _unquote(token.text).lower()
+        if name in known and name not in cte_names and (following is None or following.text != "."):
+            token.text = f"{schema}.{token.text}"
+    return _render(tokens)
+
+
+def table_references(sql: str) -> Set[str]:
+    # Lower-cased names of the tables and views a query reads, without schema
+    # or quoting; CTE names are left out
+    tokens = _tokenize(sql)
+    code = _code(tokens)
+    names = set()
+    for position in _from_items(tokens, code):
+        # The last part of a qualified name: server.database.schema.table
+        while (position + 2 < len(code) and tokens[code[position + 1]].text == "."
+               and tokens[code[position + 2]].kind in ("word", "ident")):
+            position += 2
+        names.add(_unquote(tokens[code[position]].text).lower())
+    return names - _cte_names(tokens, code)
+
+
+def guard_query(sql: str, max_rows: int, extra_rows: int = 0) -> GuardedQuery:
+    # Static checks and row limiting, no database access:
+    #  - exactly one statement, SELECT (optionally with CTEs) only
+    #  - no keyword that writes, changes settings or calls out (FORBIDDEN_KEYWORDS)
+    #  - the outer SELECT returns at most `max_rows` rows: TOP is added or
+    #    clamped, FETCH NEXT is added or clamped after OFFSET. The SQL asks for
+    #    `extra_rows` more (e.g. one, to detect truncation) without mentioning
+    #    them in `changes`.
+    # Raises SqlRejectedError with the reason.
+    tokens = _tokenize(sql)
+    while tokens and (tokens[-1].kind == "space" or tokens[-1].text == ";"):
+        tokens.pop()
+    code = _code(tokens)
+    if not code:
+        raise SqlRejectedError("Empty query")
+    if any(tokens[i].text == ";" for i in code):
+        raise SqlRejectedError("Only a single statement is allowed")
+    opened = sum(1 for i in code if tokens[i].text == "(")
+    if any(tokens[i].depth < 0 for i in code) or opened != sum(1 for i in code if tokens[i].text == ")"):
+        raise SqlRejectedError("Unbalanced parentheses")
+    first = tokens[code[0]].upper
+    if first not in ("SELECT", "WITH"):
+        raise SqlRejectedError(f"Only SELECT statements are allowed, not {tokens[code[0]].text}")
+    for i in code:
+        word = tokens[i].upper
+        if word in FORBIDDEN_KEYWORDS:
+            raise SqlRejectedError(f"{word} is not allowed in generated queries")
+        if word.startswith(("XP_", "SP_")):
+            raise SqlRejectedError(f"Calling {tokens[i].text} is not allowed in generated queries")
+
+    outer = [i for i in code if tokens[i].depth == 0]
+    selects = [i for i in outer if tokens[i].upper == "SELECT"]
+    if not selects:
+        raise SqlRejectedError("No SELECT found")
+    changes: List[str] = []
+
+    # Position after SELECT [ALL | DISTINCT] of the outer statement
+    position = outer.index(selects[0]) + 1
+    if position < len(outer) and tokens[outer[position]].upper in ("ALL", "DISTINCT"):
+        position += 1
+    insert_after = outer[position - 1]
+
+    has_top = position < len(outer) and tokens[outer[position]].upper == "TOP"
+    if has_top:
+        _clamp_top(tokens, code, outer[position], max_rows, extra_rows, changes)
+    else:
+        offset = next((i for i in outer if tokens[i].upper == "OFFSET"), None)
+        set_operation = next((tokens[i].upper for i in outer if tokens[i].upper in ("UNION", "EXCEPT", "INTERSECT")), None)
+        if offset is not None:
+            _limit_fetch(tokens, code, outer, offset, max_rows, extra_rows, changes)
+        elif set_operation is not None:
+            # TOP would only apply to the first branch; rows are still capped while fetching
+            changes.append(f"{set_operation} query is not limited in SQL; rows are capped while fetching")
+        else:
+            tokens.insert(insert_after + 1, _Token("word", f" TOP ({max_rows + extra_rows})"))
+            changes.append(f"Added TOP ({max_rows})")
+    return GuardedQuery(sql, _render(tokens), changes, max_rows)
+
+
+def _clamp_top(tokens: List[_Token], code: List[int], top: int, max_rows: int, extra_rows: int, changes: List[str]):
+    after = [i for i in code if i > top]
+    if not after:
+        raise SqlRejectedError("TOP without a row count")
+    # TOP n | TOP (n) | TOP (expression), optionally PERCENT
+    if tokens[after[0]].text == "(":
+        end = next(i for i in after if tokens[i].text == ")" and tokens[i].depth == tokens[after[0]].depth)
+        inner = [i for i in after if i < end and i != after[0]]
+    else:
+        end = after[0]
+        inner = [after[0]]
+    rest = [i for i in after if i > end]
+    percent = bool(rest) and tokens[rest[0]].upper == "PERCENT"
+    if percent:
+        end = rest[0]
+    value = tokens[inner[0]].text if len(inner) == 1 and tokens[inner[0]].kind == "number" else None
+    if percent or value is None or float(value) > max_rows:
+        described = _render(tokens[top:end + 1])
+        for i in range(top + 1, end + 1):
+            tokens[i] = _Token("space", "")
+        tokens[top] = _Token("word", f"TOP ({max_rows + extra_rows})", tokens[top].depth)
+        changes.append(f"Replaced {described} with TOP ({max_rows})")
+
+
+def _limit_fetch(tokens: List[_Token], code: List[int], outer: List[int], offset: int, max_rows: int,
+                 extra_rows: int, changes: List[str]):
+    following = [i for i in outer if i > offset]
+    fetch = next((i for i in following if tokens[i].upper == "FETCH"), None)
+    if fetch is None:
+        # OFFSET n ROWS -> OFFSET n ROWS FETCH NEXT max_rows ROWS ONLY
+        rows = next((i for i in following if tokens[i].upper in ("ROW", "ROWS")), None)
+        if rows is None:
+            raise SqlRejectedError("OFFSET without ROWS")
+        tokens.insert(rows + 1, _Token("word", f" FETCH NEXT {max_rows + extra_rows} ROWS ONLY"))
+        changes.append(f"Added FETCH NEXT {max_rows} ROWS ONLY")
+        return
+    # FETCH {FIRST | NEXT} n {ROW | ROWS} ONLY
+    following = [i for i in code if i > fetch]
+    if len(following) < 2 or tokens[following[1]].text == "(":
+        raise SqlRejectedError("FETCH needs a literal row count")
+    count = following[1]
+    if tokens[count].kind != "number" or float(tokens[count].text) > max_rows:
+        described = tokens[count].text
+        tokens[count] = _Token("number", str(max_rows + extra_rows), tokens[count].depth)
+        changes.append(f"Clamped FETCH {described} ROWS to {max_rows}")
+
+
+def parse_showplan(xml_text: str) -> PlanEstimate:
+    # Total estimated subtree cost and rows of the statements in a SHOWPLAN_XML
+    # document, plus warnings that usually mean a runaway plan
+    root = ET.fromstring(xml_text)
+    cost = 0.0
+    rows = None
+    for statement in root.iter(f"{SHOWPLAN_NS}StmtSimple"):
+        cost += float(statement.get("StatementSubTreeCost", 0) or 0)
+        if rows is None and statement.get("StatementEstRows") is not None:
+            rows = float(statement.get("StatementEstRows"))
+    warnings = []
+    for element in root.iter(f"{SHOWPLAN_NS}Warnings"):
+        if element.get("NoJoinPredicate") == "true":
+            warnings.append("join without a predicate (cartesian product)")
+    return PlanEstimate(cost, rows, sorted(set(warnings)))
+
+
+def estimate_query_cost(conn, sql: str) -> PlanEstimate:
+    # Blocking: run on the DB executor. The statement is compiled, not run.
+    # SHOWPLAN_XML must be switched off again before the connection is reused,
+    # otherwise it is discarded (BrokenConnectionError).
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET SHOWPLAN_XML ON")
+        try:
+            cursor.execute(sql)
+            plan = "".join(str(row[0]) for row in cursor.fetchall())
+        finally:
+            try:
+                cursor.execute("SET SHOWPLAN_XML OFF")
+            except Exception as e:
+                raise BrokenConnectionError(f"Could not switch SHOWPLAN_XML off: {e}") from e
+    finally:
+        cursor.close()
+    return parse_showplan(plan)
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Optional
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "close")
+
+HEARTBEAT = ": heartbeat\n\n"
+
+
+class SessionLimitError(Exception):
+    pass
+
+
+class SSESession:
+    # One /connect client: a bounded deque of encoded SSE frames and at most one
+    # waiting reader. Sessions are small (no Queue, no per-session task) so tens
+    # of thousands can be held per worker. Frames carry the event id
+    # "<session id>:<sequence>"; the last `replay_size` delivered ones are kept
+    # so a reconnecting client (Last-Event-ID) gets what it missed.
+    __slots__ = ("session_id", "endpoint", "capacity", "frames", "waiter", "created_at", "last_activity",
+                 "closed", "dropped", "sent", "sequence", "delivered", "attached", "detached_at")
+
+    def __init__(self, endpoint: str, capacity: int, replay_size: int = 0):
+        now = time.monotonic()
+        self.session_id = str(uuid.uuid4())
+        self.endpoint = endpoint
+        self.capacity = capacity
+        self.frames: deque = deque()  # (sequence, frame)
+        self.waiter: Optional[asyncio.Future] = None
+        self.created_at = now
+        self.last_activity = now
+        self.closed = False
+        self.dropped = 0
+        self.sent = 0
+        self.sequence = 0
+        self.delivered: Optional[deque] = deque(maxlen=replay_size) if replay_size else None
+        self.attached = False
+        self.detached_at: Optional[float] = None
+
+    @property
+    def full(self) -> bool:
+        return len(self.frames) >= self.capacity
+
+    def push(self, frame: str):
+        self.sequence += 1
+        self.frames.append((self.sequence, f"id: {self.session_id}:{self.sequence}\n{frame}"))
+        self._wake()
+
+    def _wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def next_frame(self, timeout: float) -> Optional[str]:
+        # Next frame, HEARTBEAT after `timeout` quiet seconds, None once closed
+        if not self.frames and not self.closed:
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self.waiter, timeout)
+            except asyncio.TimeoutError:
+                return HEARTBEAT
+            finally:
+                self.waiter = None
+        if self.frames:
+            sequence, frame = self.frames.popleft()
+            if self.delivered is not None:
+                self.delivered.append((sequence, frame))
+            return frame
+        return None
+
+    def replay_after(self, sequence: int) -> int:
+        # Queue again, ahead of anything undelivered, the delivered frames after
+        # `sequence`; returns how many were asked for but no longer kept
+        if not self.delivered:
+            return 0
+        missing = max(self.delivered[0][0] - sequence - 1, 0)
+        replay = [(s, frame) for s, frame in self.delivered if s > sequence]
+        self.delivered.clear()
+        self.frames.extendleft(reversed(replay))
+        return missing
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.frames.clear()
+            self._wake()
+
+
+class SessionManager:
+    # Registry of SSE sessions with bounded per-session queues (`queue_size` frames).
+    #  - overflow: what happens when a client reads slower than messages arrive:
+    #    "drop_oldest" (default) discards the oldest queued message,
+    #    "drop_newest" rejects the new one, "close" ends the session
+    #  - heartbeats: a comment frame after `heartbeat_interval` seconds without
+    #    traffic keeps proxies from timing out and surfaces dead connections
+    #  - resume: with `resume_timeout`, a session whose client disconnected is
+    #    kept that many seconds (still queueing messages) for the client to
+    #    reconnect with Last-Event-ID; the last `replay_size` delivered frames
+    #    are sent again after that id
+    #  - cleanup: a session is removed as soon as its stream ends (disconnect or
+    #    close) or its resume window passes, and the reaper closes sessions idle
+    #    for `idle_timeout` seconds
+    def __init__(
+        self,
+        endpoint: str,
+        max_sessions: int = 10000,
+        queue_size: int = 64,
+        overflow: str = "drop_oldest",
+        heartbeat_interval: float = 15.0,
+        idle_timeout: Optional[float] = 900.0,
+        reap_interval: float = 30.0,
+        replay_size: int = 0,
+        resume_timeout: Optional[float] = None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}")
+        self.endpoint = endpoint
+        self.max_sessions = max_sessions
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self.replay_size = replay_size
+        self.resume_timeout = resume_timeout
+        self._sessions: Dict[str, SSESession] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+        self.created = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.idle_closed = 0
+        self.overflow_closed = 0
+        self.resumed = 0
+        self.resume_expired = 0
+        self.replayed = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _ensure_started(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.get_running_loop().create_task(self._reap_loop())
+
+    def create(self) -> SSESession:
+        if len(self._sessions) >= self.max_sessions:
+            self.rejected += 1
+            raise SessionLimitError(f"Too many SSE sessions (limit {self.max_sessions})")
+        self._ensure_started()
+        session = SSESession(self.endpoint, self.queue_size, self.replay_size)
+        self._sessions[session.session_id] = session
+        self.created += 1
+        return session
+
+    def get(self, session_id: str) -> Optional[SSESession]:
+        session = self._sessions.get(session_id)
+        return session if session is not None and not session.closed else None
+
+    def resume(self, last_event_id: str) -> Optional[SSESession]:
+        # The detached session a Last-Event-ID belongs to, with the frames
+        # delivered after it queued again; None when it is unknown, expired or
+        # still attached to another stream
+        session_id, _, sequence = last_event_id.rpartition(":")
+        session = self.get(session_id)
+        if session is None or session.attached or not sequence.isdigit():
+            return None
+        before = len(session.frames)
+        session.dropped += session.replay_after(int(sequence))
+        self.replayed += len(session.frames) - before
+        session.detached_at = None
+        session.attached = True  # until its new stream ends
+        self.resumed += 1
+        return session
+
+    def remove(self, session: SSESession):
+        session.close()
+        if self._sessions.get(session.session_id) is session:
+            del self._sessions[session.session_id]
+            self.dropped += session.dropped
+
+    def send(self, session: SSESession, message: Any) -> bool:
+        # Queue a JSON message; False if it was not queued (session closed or
+        # overflow with "drop_newest"/"close")
+        if session.closed:
+            return False
+        frame = f"data: {json.dumps(message)}\n\n"  # push() adds the id line
+        session.last_activity = time.monotonic()
+        if session.full:
+            if self.overflow == "drop_newest":
+                session.dropped += 1
+                return False
+            if self.overflow == "close":
+                self.overflow_closed += 1
+                self.remove(session)
+                return False
+            session.frames.popleft()
+            session.dropped += 1
+        session.push(frame)
+        return True
+
+    async def stream(self, session: SSESession) -> AsyncIterator[str]:
+        # Encoded frames for the StreamingResponse. Starlette cancels the
+        # generator when the client disconnects; either way the session is
+        # removed in `finally`, or detached to wait for a resume.
+        session.attached = True
+        try:
+            while True:
+                frame = await session.next_frame(self.heartbeat_interval)
+                if frame is None:
+                    return
+                if frame is not HEARTBEAT:
+                    session.sent += 1
+                yield frame
+        finally:
+            session.attached = False
+            if self.resume_timeout and not session.closed:
+                session.detached_at = time.monotonic()
+            else:
+                self.remove(session)
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            self.reap()
+
+    def reap(self):
+        now = time.monotonic()
+        if self.resume_timeout:
+            cutoff = now - self.resume_timeout
+            for session in [s for s in self._sessions.values() if s.detached_at is not None and s.detached_at < cutoff]:
+                self.resume_expired += 1
+                self.remove(session)
+        if self.idle_timeout is not None:
+            cutoff = now - self.idle_timeout
+            for session in [s for s in self._sessions.values() if s.last_activity < cutoff]:
+                # remove() rather than close(): a session whose stream never
+                # started has no reader to remove it
+                self.idle_closed += 1
+                self.remove(session)
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for session in list(self._sessions.values()):
+            session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        queued = sum(len(s.frames) for s in self._sessions.values())
+        return {
+            "sessions": len(self._sessions),
+            "detached": sum(1 for s in self._sessions.values() if s.detached_at is not None),
+            "maxSessions": self.max_sessions,
+            "queued": queued,
+            "queueSize": self.queue_size,
+            "overflow": self.overflow,
+            "created": self.created,
+            "rejected": self.rejected,
+            "dropped": self.dropped + sum(s.dropped for s in self._sessions.values()),
+            "idleClosed": self.idle_closed,
+            "overflowClosed": self.overflow_closed,
+            "resumed": self.resumed,
+            "resumeExpired": self.resume_expired,
+            "replayed": self.replayed,
+        }
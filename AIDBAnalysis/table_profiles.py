@@ -0,0 +1,373 @@
+import asyncio
+import math
+import time
+from collections import Counter, namedtuple
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from query_cache import load_table_versions
+from ttl_cache import TTLCache
+
+# Columns summarized by size only: their values are useless in a prompt
+# (bytes) or cannot be read/compared as plain values
+BINARY_TYPES = {"binary", "varbinary", "image", "timestamp", "rowversion"}
+LONG_TEXT_TYPES = {"text", "ntext", "xml"}
+OPAQUE_TYPES = {"geography", "geometry", "hierarchyid", "sql_variant"}
+TEXT_TYPES = {"char", "varchar", "nchar", "nvarchar"}
+
+LONG_TEXT_CHARS = 100  # text columns averaging more characters are summarized, not inlined
+MAX_VALUE_CHARS = 40  # longer min/max/top values are cut in profiles
+MIN_TOP_SHARE = 0.01  # rarer values are not listed as frequent
+
+# Row count per table from partition metadata: no table is scanned
+TABLE_ROWS_QUERY = """
+SELECT t.name AS table_name, SUM(p.rows) AS row_count
+FROM sys.tables AS t
+JOIN sys.schemas AS s ON s.schema_id = t.schema_id
+JOIN sys.partitions AS p ON p.object_id = t.object_id AND p.index_id IN (0, 1)
+WHERE s.name = ?
+GROUP BY t.name;
+"""
+
+# What a profile was computed from: row count and last write (None when unknown)
+TableVersion = namedtuple("TableVersion", ["rows", "last_update"])
+
+
+def load_table_stats(conn, schema_name: str) -> Dict[str, TableVersion]:
+    # Blocking: run on the DB executor. Last writes come from the index usage
+    # DMV, which needs VIEW SERVER STATE; without it only row counts are compared.
+    cursor = conn.cursor()
+    try:
+        cursor.execute(TABLE_ROWS_QUERY, schema_name)
+        rows = {row[0]: int(row[1] or 0) for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+    try:
+        updates = load_table_versions(conn)
+    except Exception:
+        updates = {}
+    return {table: TableVersion(count, updates.get(table.lower())) for table, count in rows.items()}
+
+
+def column_kind(data_type: str) -> str:
+    data_type = (data_type or "").lower()
+    if data_type in BINARY_TYPES:
+        return "binary"
+    if data_type in LONG_TEXT_TYPES or data_type in OPAQUE_TYPES:
+        return "longText" if data_type in LONG_TEXT_TYPES else "opaque"
+    if data_type in TEXT_TYPES:
+        return "text"
+    return "value"
+
+
+def _quote(name: str) -> str:
+    return "[" + name.replace("]", "]]") + "]"
+
+
+def profile_query(schema_name: str, table: str, columns: List[Tuple[str, str]], sample_rows: int,
+                  row_count: Optional[int]) -> str:
+    # Size-only columns are read as DATALENGTH. Tables larger than the sample are
+    # read through TABLESAMPLE (whole pages at random, roughly twice the rows
+    # needed since page fill varies), cut to `sample_rows` rows.
+    expressions = ", ".join(
+        f"DATALENGTH({_quote(name)}) AS {_quote(name)}" if column_kind(data_type) not in ("text", "value")
+        else _quote(name)
+        for name, data_type in columns
+    )
+    sql = f"SELECT TOP ({sample_rows}) {expressions} FROM {_quote(schema_name)}.{_quote(table)}"
+    if row_count is not None and row_count > sample_rows:
+        percent = min(100.0, math.ceil(200.0 * sample_rows / row_count * 1000) / 1000)
+        sql += f" TABLESAMPLE ({percent:g} PERCENT)"
+    return sql
+
+
+def _plain(value: Any) -> Any:
+    # JSON-friendly and short, for profiles that end up in prompts and caches
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, bool) or isinstance(value, (int, float)):
+        return value
+    text = str(value)
+    return text if len(text) <= MAX_VALUE_CHARS else text[:MAX_VALUE_CHARS] + "…"
+
+
+def estimate_distinct(counts: Counter, sampled: int, population: int) -> int:
+    # GEE estimator (Charikar et al.): values seen once in the sample stand for
+    # sqrt(population / sample) distinct values each, the others for one
+    if sampled >= population:
+        return len(counts)
+    singletons = sum(1 for count in counts.values() if count == 1)
+    estimate = math.sqrt(population / sampled) * singletons + (len(counts) - singletons)
+    return min(population, max(len(counts), round(estimate)))
+
+
+def profile_column(data_type: str, values: List[Any], row_count: Optional[int], exact: bool,
+                   top_k: int) -> Dict[str, Any]:
+    kind = column_kind(data_type)
+    present = [value for value in values if value is not None]
+    profile: Dict[str, Any] = {"type": data_type}
+    if values:
+        profile["nullFraction"] = round(1 - len(present) / len(values), 3)
+    if not present:
+        return profile
+
+    if kind in ("binary", "longText", "opaque"):
+        # Values are DATALENGTHs
+        sizes = [int(value) for value in present]
+        profile.update(summary=kind, avgBytes=round(sum(sizes) / len(sizes)), maxBytes=max(sizes))
+        return profile
+
+    if kind == "text":
+        lengths = [len(value) for value in present]
+        average = sum(lengths) / len(lengths)
+        if average > LONG_TEXT_CHARS:
+            profile.update(summary="longText", avgLength=round(average), maxLength=max(lengths))
+            return profile
+
+    counts = Counter(present)
+    if exact:
+        distinct = len(counts)
+    else:
+        population = round(row_count * len(present) / len(values)) if row_count else len(present)
+        distinct = estimate_distinct(counts, len(present), max(population, len(present)))
+    profile["distinct"] = distinct
+    profile["distinctExact"] = exact
+    try:
+        profile["min"] = _plain(min(present))
+        profile["max"] = _plain(max(present))
+    except TypeError:
+        pass  # values that do not compare (mixed types)
+    if len(counts) == len(present):
+        profile["unique"] = True  # every sampled value differs: top values would say nothing
+    else:
+        profile["topValues"] = [
+            [_plain(value), round(count / len(values), 3)]
+            for value, count in counts.most_common(top_k) if count > 1 and count / len(values) >= MIN_TOP_SHARE
+        ]
+    return profile
+
+
+def profile_table(conn, schema_name: str, table: str, columns: List[Tuple[str, str]],
+                  row_count: Optional[int], sample_rows: int = 1000, top_k: int = 5) -> Dict[str, Any]:
+    # Blocking: run on the DB executor. `columns` are (name, data type) pairs from the schema.
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    try:
+        sql = profile_query(schema_name, table, columns, sample_rows, row_count)
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+        if "TABLESAMPLE" in sql and len(rows) < sample_rows // 4:
+            # Too few pages came back (small or skewed table): read the first rows instead
+            cursor.execute(profile_query(schema_name, table, columns, sample_rows, None))
+            rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    exact = row_count is not None and len(rows) >= row_count
+    return {
+        "rowCount": row_count,
+        "sampledRows": len(rows),
+        "exact": exact,
+        "columns": {
+            name: profile_column(data_type, [row[i] for row in rows], row_count, exact, top_k)
+            for i, (name, data_type) in enumerate(columns)
+        },
+        "durationMs": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _format_value(value: Any) -> str:
+    return str(value) if isinstance(value, (int, float)) else repr(str(value))
+
+
+def encode_column_profile(name: str, column: Dict[str, Any], top_values: bool = True) -> str:
+    # "Color: 18% null; 'Black'..'Silver'; 3 distinct; top 'Black' 30%, 'Red' 28%"
+    parts = []
+    null_fraction = column.get("nullFraction")
+    if null_fraction:
+        parts.append(f"{null_fraction:.0%} null")
+    summary = column.get("summary")
+    if summary in ("binary", "opaque"):
+        parts.append(f"{summary}, avg {column['avgBytes']} bytes")
+    elif summary == "longText":
+        average = column.get("avgLength", column.get("avgBytes"))
+        unit = "chars" if "avgLength" in column else "bytes"
+        parts.append(f"long text, avg {average} {unit}")
+    elif "min" in column and column["min"] == column["max"]:
+        parts.append(f"always {_format_value(column['min'])}")
+    else:
+        if "min" in column:
+            parts.append(f"{_format_value(column['min'])}..{_format_value(column['max'])}")
+        if column.get("unique"):
+            parts.append("unique")
+        elif "distinct" in column:
+            parts.append(f"{'' if column.get('distinctExact') else '~'}{column['distinct']} distinct")
+        if top_values and column.get("topValues"):
+            parts.append("top " + ", ".join(f"{_format_value(v)} {f:.0%}" for v, f in column["topValues"]))
+    if not parts:
+        parts.append("all null" if null_fraction == 1 else "no rows")
+    return f"{name}: {'; '.join(parts)}"
+
+
+def encode_table_profile(table: str, profile: Optional[Dict[str, Any]], top_values: bool = True) -> str:
+    if not profile:
+        return ""
+    rows = profile.get("rowCount")
+    header = f"{table} ({rows} rows)" if rows is not None else table
+    lines = [header] + [
+        "  " + encode_column_profile(name, column, top_values) for name, column in profile["columns"].items()
+    ]
+    return "\n".join(lines)
+
+
+def encode_profiles(profiles: Dict[str, Optional[Dict[str, Any]]], top_values: bool = True) -> str:
+    return "\n".join(
+        text for text in (encode_table_profile(t, p, top_values) for t, p in profiles.items()) if text
+    )
+
+
+class ProfileEntry:
+    __slots__ = ("profile", "version", "profiled_at")
+
+    def __init__(self, profile: Dict[str, Any], version: Optional[TableVersion]):
+        self.profile = profile
+        self.version = version
+        self.profiled_at = time.monotonic()
+
+
+class TableProfileCache:
+    # Table profiles keyed by (server, database, schema, table), computed once
+    # and kept until the table changes (or `ttl` passes):
+    #  - the row counts and last writes of a schema (`version_loader`) are
+    #    checked at most every `check_interval` seconds
+    #  - a table whose row count moved by more than `change_fraction`, or that
+    #    was written to and was profiled over `refresh_interval` seconds ago, is
+    #    re-profiled in the background while its previous profile is served
+    #  - a table without a profile is profiled while the caller waits;
+    #    single-flight per table, at most `concurrency` profiles at a time
+    #  - a failed profile is not cached; the table is left out of the prompt
+    def __init__(
+        self,
+        profiler: Callable[[Hashable, str, Optional[TableVersion]], Awaitable[Dict[str, Any]]],
+        version_loader: Callable[[Hashable], Awaitable[Dict[str, TableVersion]]],
+        ttl: Optional[float] = 86400.0,
+        max_entries: int = 5000,
+        check_interval: float = 60.0,
+        refresh_interval: float = 600.0,
+        change_fraction: float = 0.1,
+        concurrency: int = 2,
+    ):
+        self._profiler = profiler
+        self._version_loader = version_loader
+        self._entries = TTLCache(ttl=ttl, max_entries=max_entries)
+        self.check_interval = check_interval
+        self.refresh_interval = refresh_interval
+        self.change_fraction = change_fraction
+        self.concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._versions: Dict[Hashable, Dict[str, TableVersion]] = {}
+        self._versions_checked_at: Dict[Hashable, float] = {}
+        self._version_tasks: Dict[Hashable, asyncio.Task] = {}
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+        self.profiled = 0
+        self.refreshes = 0
+        self.profile_errors = 0
+        self.version_checks = 0
+        self.version_check_errors = 0
+
+    async def get_many(self, schema_key: Hashable, tables: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        # schema_key is (server, database, schema)
+        versions = await self._current_versions(schema_key)
+
+        async def get(table):
+            key = schema_key + (table,)
+            version = versions.get(table)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._changed(entry, version):
+                    self._profile(key, version, background=True)
+                return entry.profile
+            try:
+                return await asyncio.shield(self._profile(key, version))
+            except Exception:
+                return None
+
+        profiles = await asyncio.gather(*(get(table) for table in tables))
+        return dict(zip(tables, profiles))
+
+    def _changed(self, entry: ProfileEntry, version: Optional[TableVersion]) -> bool:
+        if version is None or entry.version is None:
+            return False  # not in the metadata (a view, or no access): only the TTL applies
+        if abs(version.rows - entry.version.rows) > self.change_fraction * max(entry.version.rows, 1):
+            return True
+        return (version.last_update != entry.version.last_update
+                and time.monotonic() - entry.profiled_at >= self.refresh_interval)
+
+    async def _current_versions(self, schema_key: Hashable) -> Dict[str, TableVersion]:
+        checked_at = self._versions_checked_at.get(schema_key)
+        if checked_at is not None and time.monotonic() - checked_at < self.check_interval:
+            return self._versions.get(schema_key, {})
+        task = self._version_tasks.get(schema_key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._load_versions(schema_key))
+            self._version_tasks[schema_key] = task
+            task.add_done_callback(lambda t, key=schema_key: self._version_tasks.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _load_versions(self, schema_key: Hashable) -> Dict[str, TableVersion]:
+        self.version_checks += 1
+        try:
+            self._versions[schema_key] = await self._version_loader(schema_key)
+        except Exception as e:
+            self.version_check_errors += 1
+            print(f"Table change check failed for {schema_key}: {e}")
+        self._versions_checked_at[schema_key] = time.monotonic()
+        return self._versions.get(schema_key, {})
+
+    def _profile(self, key: Hashable, version: Optional[TableVersion], background: bool = False) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            if background:
+                self.refreshes += 1
+            task = asyncio.get_running_loop().create_task(self._run_profile(key, version))
+            self._inflight[key] = task
+
+            def done(t, key=key):
+                if self._inflight.get(key) is t:
+                    del self._inflight[key]
+                if not t.cancelled() and t.exception() is not None:
+                    self.profile_errors += 1
+                    print(f"Profiling failed for {key}: {t.exception()}")
+
+            task.add_done_callback(done)
+        return task
+
+    async def _run_profile(self, key: Hashable, version: Optional[TableVersion]) -> Dict[str, Any]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            profile = await self._profiler(key[:-1], key[-1], version)
+        self._entries.set(key, ProfileEntry(profile, version))
+        self.profiled += 1
+        return profile
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        for schema_key in [key for key in self._versions_checked_at if predicate(key)]:
+            self._versions.pop(schema_key, None)
+            del self._versions_checked_at[schema_key]
+        return self._entries.pop_where(predicate)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._entries.stats()
+        stats.update(
+            profiled=self.profiled,
+            refreshes=self.refreshes,
+            profiling=len(self._inflight),
+            profileErrors=self.profile_errors,
+            changeChecks=self.version_checks,
+            changeCheckErrors=self.version_check_errors,
+        )
+        return stats
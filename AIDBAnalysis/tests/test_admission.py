@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+
+from admission import CLIENT_LIMIT, QUEUE_FULL, QUEUE_TIMEOUT, AdmissionController, AdmissionRejectedError
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_client_over_its_cap_gets_429():
+    async def scenario():
+        controller = AdmissionController(10, max_per_client=2)
+        tickets = [await controller.acquire("a"), await controller.acquire("a")]
+
+        with pytest.raises(AdmissionRejectedError) as rejected:
+            await controller.acquire("a")
+        assert rejected.value.status_code == 429
+        assert rejected.value.reason == CLIENT_LIMIT
+        assert rejected.value.retry_after >= 1
+
+        # Other clients are not affected, and a released slot counts again
+        (await controller.acquire("b")).release()
+        tickets[0].release()
+        (await controller.acquire("a")).release()
+        assert controller.stats()["shed"][CLIENT_LIMIT] == 1
+
+    run(scenario())
+
+
+def test_full_queue_gets_503():
+    async def scenario():
+        controller = AdmissionController(1, max_queue=1)
+        ticket = await controller.acquire("a")
+        waiting = asyncio.ensure_future(controller.acquire("b"))
+        await asyncio.sleep(0)
+        assert controller.queued == 1
+
+        with pytest.raises(AdmissionRejectedError) as rejected:
+            await controller.acquire("c")
+        assert rejected.value.status_code == 503
+        assert rejected.value.reason == QUEUE_FULL
+
+        ticket.release()
+        (await waiting).release()
+        assert controller.stats()["inFlight"] == 0
+
+    run(scenario())
+
+
+def test_wait_timeout_gets_503_and_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(1, queue_timeout=0.05)
+        ticket = await controller.acquire("a")
+
+        with pytest.raises(AdmissionRejectedError) as rejected:
+            await controller.acquire("b")
+        assert rejected.value.status_code == 503
+        assert rejected.value.reason == QUEUE_TIMEOUT
+        assert controller.queued == 0
+
+        ticket.release()
+        assert controller.in_flight == 0
+
+    run(scenario())
+
+
+def test_cancelled_waiter_gives_up_its_queue_place():
+    async def scenario():
+        controller = AdmissionController(1, max_queue=1, max_per_client=1)
+        ticket = await controller.acquire("a")
+        waiting = asyncio.ensure_future(controller.acquire("b"))
+        await asyncio.sleep(0)
+        assert controller.queued == 1
+
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert controller.queued == 0
+
+        # The place and the client's share are free again
+        queued_again = asyncio.ensure_future(controller.acquire("b"))
+        await asyncio.sleep(0)
+        assert controller.queued == 1
+        ticket.release()
+        (await queued_again).release()
+        assert controller.in_flight == 0
+
+    run(scenario())
+
+
+def test_slots_go_to_clients_in_turn():
+    async def scenario():
+        controller = AdmissionController(1)
+        ticket = await controller.acquire("a")
+        order = []
+
+        async def analysis(client):
+            admitted = await controller.acquire(client)
+            order.append(client)
+            await asyncio.sleep(0)
+            admitted.release()
+
+        tasks = [asyncio.ensure_future(analysis(client)) for client in ("a", "a", "a", "b")]
+        await asyncio.sleep(0)
+        ticket.release()
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b", "a", "a"]
+
+    run(scenario())
+
+
+def test_waiting_work_is_never_shed():
+    # A batch with more goals than max_per_client, behind a full queue that
+    # times out: every goal waits for a slot and runs
+    async def scenario():
+        controller = AdmissionController(2, max_queue=1, queue_timeout=0.01, max_per_client=2)
+        semaphore = asyncio.Semaphore(8)
+        completed = []
+
+        async def goal(index):
+            async with semaphore:
+                ticket = await controller.acquire("batch-client", wait=True)
+                try:
+                    await asyncio.sleep(0.02)
+                    completed.append(index)
+                finally:
+                    ticket.release()
+
+        await asyncio.gather(*(goal(index) for index in range(12)))
+        assert sorted(completed) == list(range(12))
+        stats = controller.stats()
+        assert stats["shed"] == {QUEUE_FULL: 0, QUEUE_TIMEOUT: 0, CLIENT_LIMIT: 0}
+        assert stats["inFlight"] == 0 and stats["queued"] == 0
+
+        # A direct request from the same client still sees the cap while the
+        # waiting work holds its share
+        ticket = await controller.acquire("batch-client", wait=True)
+        other = await controller.acquire("batch-client", wait=True)
+        with pytest.raises(AdmissionRejectedError):
+            await controller.acquire("batch-client")
+        ticket.release()
+        other.release()
+
+    run(scenario())
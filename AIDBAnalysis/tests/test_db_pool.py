@@ -0,0 +1,206 @@
+import asyncio
+import threading
+
+import pytest
+
+from db_pool import BrokenConnectionError, ConnectionPool, PoolTimeoutError
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, *params):
+        if not self.conn.healthy:
+            raise RuntimeError("connection lost")
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.healthy = True
+        self.can_rollback = True
+        self.rollbacks = 0
+        self.closed = threading.Event()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        if not self.can_rollback:
+            raise RuntimeError("rollback failed")
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed.set()
+
+
+class Connector:
+    def __init__(self):
+        self.opened = []
+
+    def __call__(self):
+        conn = FakeConnection(len(self.opened))
+        self.opened.append(conn)
+        return conn
+
+
+def make_pool(**options):
+    connector = Connector()
+    options.setdefault("min_size", 0)
+    options.setdefault("reap_interval", 3600)
+    return ConnectionPool(connector, **options), connector
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_connection_is_reused_and_rolled_back_after_a_normal_return():
+    async def scenario():
+        pool, connector = make_pool()
+        async with pool.connection() as conn:
+            first = conn
+        async with pool.connection() as conn:
+            assert conn is first
+        assert first.rollbacks == 2
+        assert len(connector.opened) == 1
+        await pool.close()
+
+    run(scenario())
+
+
+def test_connection_that_cannot_be_rolled_back_is_discarded():
+    async def scenario():
+        pool, connector = make_pool()
+        async with pool.connection() as conn:
+            conn.can_rollback = False
+        async with pool.connection() as conn:
+            assert conn is not connector.opened[0]
+        assert pool.stats()["discarded"] == 1
+        await pool.close()
+
+    run(scenario())
+
+
+def test_broken_connection_is_discarded():
+    async def scenario():
+        pool, connector = make_pool()
+        with pytest.raises(BrokenConnectionError):
+            async with pool.connection():
+                raise BrokenConnectionError()
+        assert pool.stats()["discarded"] == 1
+        assert pool.stats()["size"] == 0
+        await pool.close()
+
+    run(scenario())
+
+
+def test_waiters_are_served_in_order_and_time_out():
+    async def scenario():
+        pool, _ = make_pool(max_size=1, acquire_timeout=0.2)
+        order = []
+        holder = await pool.acquire()
+
+        async def wait(name):
+            async with pool.connection():
+                order.append(name)
+
+        waiters = [asyncio.ensure_future(wait(name)) for name in ("a", "b", "c")]
+        await asyncio.sleep(0.01)
+        assert pool.stats()["waiting"] == 3
+        pool.release(holder)
+        await asyncio.gather(*waiters)
+        assert order == ["a", "b", "c"]
+
+        holder = await pool.acquire()
+        with pytest.raises(PoolTimeoutError):
+            await pool.acquire()
+        assert pool.stats()["timeouts"] == 1
+        pool.release(holder)
+        await pool.close()
+
+    run(scenario())
+
+
+def test_cancelled_use_discards_the_connection():
+    async def scenario():
+        pool, connector = make_pool()
+        started = asyncio.Event()
+
+        async def use():
+            async with pool.connection():
+                started.set()
+                await asyncio.sleep(10)
+
+        task = asyncio.ensure_future(use())
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        stats = pool.stats()
+        assert stats["discarded"] == 1 and stats["inUse"] == 0 and stats["size"] == 0
+        assert connector.opened[0].rollbacks == 0
+        await asyncio.get_running_loop().run_in_executor(None, connector.opened[0].closed.wait, 1)
+        assert connector.opened[0].closed.is_set()
+        await pool.close()
+
+    run(scenario())
+
+
+def test_expired_and_unhealthy_connections_are_replaced():
+    async def scenario():
+        pool, connector = make_pool(max_lifetime=0.05, health_check_after=None)
+        async with pool.connection():
+            pass
+        await asyncio.sleep(0.06)
+        async with pool.connection() as conn:
+            assert conn is connector.opened[1]
+        await pool.close()
+
+        pool, connector = make_pool(health_check_after=0)
+        async with pool.connection() as conn:
+            conn.healthy = False
+        async with pool.connection() as conn:
+            assert conn is connector.opened[1]
+        assert pool.stats()["healthCheckFailures"] == 1
+        await pool.close()
+
+    run(scenario())
+
+
+def test_reaper_keeps_min_size():
+    async def scenario():
+        pool, connector = make_pool(min_size=2, max_size=4, idle_timeout=0.05, reap_interval=0.02)
+        await pool.start()
+        assert pool.stats()["idle"] == 2
+        held = [await pool.acquire() for _ in range(4)]
+        for pooled in held:
+            pool.release(pooled)
+        assert pool.stats()["size"] == 4
+        await asyncio.sleep(0.2)
+        # Surplus idle connections are closed, down to min_size and no further
+        assert pool.stats()["size"] == 2
+        assert pool.stats()["idle"] == 2
+        await pool.close()
+
+    run(scenario())
+
+
+def test_reaper_refills_to_min_size():
+    async def scenario():
+        pool, connector = make_pool(min_size=2, max_lifetime=0.05, reap_interval=0.02)
+        await pool.start()
+        await asyncio.sleep(0.2)
+        # Expired connections were closed and reopened to keep min_size open
+        assert len(connector.opened) > 2
+        assert pool.stats()["size"] == 2
+        await pool.close()
+
+    run(scenario())
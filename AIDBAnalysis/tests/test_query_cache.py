@@ -0,0 +1,35 @@
+from datetime import datetime
+
+import pytest
+
+from query_cache import QueryResultCache, normalize_sql, query_result_key, referenced_tables
+
+
+@pytest.mark.parametrize(
+    "sql, tables",
+    [
+        ("SELECT * FROM SalesLT.Customer", {"customer"}),
+        ("select * from saleslt.customer c, saleslt.address a", {"customer", "address"}),
+        (
+            "SELECT * FROM Customer c JOIN SalesLT.SalesOrderHeader h ON h.CustomerID = c.CustomerID, [Address] a",
+            {"customer", "salesorderheader", "address"},
+        ),
+        ("SELECT * FROM Customer WHERE CustomerID IN (SELECT CustomerID FROM dbo.Orders)", {"customer", "orders"}),
+        ("WITH recent AS (SELECT * FROM Orders) SELECT * FROM recent, Region", {"orders", "region"}),
+        ("SELECT COALESCE(a, b), 'from x, y' FROM Product", {"product"}),
+    ],
+)
+def test_referenced_tables(sql, tables):
+    assert referenced_tables(normalize_sql(sql)) == tables
+
+
+def test_comma_joined_table_change_invalidates():
+    cache = QueryResultCache(ttl=60)
+    database = ("server", "db")
+    key = query_result_key(*database, "SELECT * FROM SalesLT.Customer c, SalesLT.Address a", "rows")
+    old = {"customer": datetime(2024, 1, 1), "address": datetime(2024, 1, 1)}
+    cache.apply_versions(database, old)
+    cache.set(key, {"rows": []})
+
+    assert cache.apply_versions(database, dict(old, address=datetime(2024, 2, 1))) == 1
+    assert key not in cache._cache
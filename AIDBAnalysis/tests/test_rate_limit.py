@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+import rate_limit
+from rate_limit import LLMRateLimiter, TokenBucket
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    real_sleep = asyncio.sleep
+    slept = []
+
+    # Sleeping moves the fake clock instead of waiting
+    async def sleep(delay, *args):
+        slept.append(delay)
+        clock.now += delay
+        await real_sleep(0)
+
+    monkeypatch.setattr(rate_limit.asyncio, "sleep", sleep)
+    clock.slept = slept
+    return clock
+
+
+def test_bucket_refills_at_rate_up_to_capacity(clock):
+    bucket = TokenBucket(60, 1, clock)
+    assert run(bucket.acquire(60)) == 0
+    assert bucket.available == 0
+
+    clock.now += 10
+    assert bucket.available == 10
+
+    clock.now += 1000
+    assert bucket.available == 60
+
+
+def test_acquire_waits_for_missing_tokens(clock):
+    bucket = TokenBucket(60, 2, clock)
+    run(bucket.acquire(50))
+
+    waited = run(bucket.acquire(30))
+    assert waited == pytest.approx(10)
+    assert clock.slept == [pytest.approx(10)]
+    assert bucket.available == pytest.approx(0)
+
+
+def test_reservation_larger_than_bucket_is_clamped(clock):
+    bucket = TokenBucket(100, 10, clock)
+
+    # Taken at once from a full bucket instead of waiting forever
+    assert run(bucket.acquire(250)) == 0
+    assert bucket.available == 0
+
+    waited = run(bucket.acquire(250))
+    assert waited == pytest.approx(10)
+    assert bucket.available == pytest.approx(0)
+
+
+def test_refund_returns_unused_tokens_up_to_capacity(clock):
+    bucket = TokenBucket(100, 1, clock)
+    run(bucket.acquire(80))
+
+    bucket.refund(30)
+    assert bucket.available == 50
+
+    bucket.refund(500)
+    assert bucket.available == 100
+
+    bucket.refund(-10)
+    assert bucket.available == 100
+
+
+def test_limiter_refund_shortens_the_next_wait(clock):
+    limiter = LLMRateLimiter(tokens_per_minute=600, clock=clock)
+    run(limiter.acquire(500))
+
+    # The completion used 100 of the 500 reserved tokens
+    limiter.refund(400)
+    run(limiter.acquire(500))
+    assert clock.slept == []
+    assert limiter.throttled == 0
+    assert limiter.stats()["tokensRefunded"] == 400
+
+
+def test_limiter_pause_uses_clock(clock):
+    limiter = LLMRateLimiter(tokens_per_minute=600, clock=clock)
+    limiter.pause(5)
+
+    run(limiter.acquire(10))
+    assert clock.slept == [pytest.approx(5)]
+    assert limiter.wait_time_total == pytest.approx(5)
@@ -0,0 +1,175 @@
+import asyncio
+import json
+
+import pytest
+
+from result_store import InvalidCursorError, ResultStore, decode_cursor, encode_cursor
+
+COLUMNS = ["id", "name"]
+
+
+def encode(values):
+    return json.dumps(values, separators=(",", ":"), default=str)
+
+
+def rows(start, stop):
+    return [{"id": i, "name": f"row {i}"} for i in range(start, stop)]
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_cursor_round_trip():
+    token = encode_cursor("abc123", 500)
+    assert "=" not in token
+    assert decode_cursor(token, "abc123") == 500
+
+
+def test_cursor_from_another_result_is_rejected():
+    token = encode_cursor("abc123", 500)
+    with pytest.raises(InvalidCursorError, match="another result"):
+        decode_cursor(token, "def456")
+
+
+@pytest.mark.parametrize("token", ["", "not a cursor!", encode_cursor("abc123", 0)[:-2] + "@@"])
+def test_malformed_cursor_is_rejected(token):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(token, "abc123")
+
+
+def test_negative_offset_is_rejected():
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(encode_cursor("abc123", -1), "abc123")
+
+
+def test_pages_in_memory():
+    async def scenario():
+        store = ResultStore(encode)
+        try:
+            result = await store.store_rows(COLUMNS, [rows(0, 10), {"id": [10, 11], "name": ["a", "b"]}], False)
+            assert not result.spilled
+            assert result.row_count == 12
+            assert await store.read(result, 0, 3) == [[0, "row 0"], [1, "row 1"], [2, "row 2"]]
+            assert await store.read(result, 10, 5) == [[10, "a"], [11, "b"]]
+            assert await store.read(result, 12, 5) == []
+        finally:
+            await store.close()
+
+    run(scenario())
+
+
+def test_paging_across_the_spill_boundary(tmp_path):
+    async def scenario():
+        store = ResultStore(encode, directory=str(tmp_path), spill_bytes=200)
+        try:
+            result = store.create()
+            await store.append(result, COLUMNS, rows(0, 5))
+            assert not result.spilled
+            await store.append(result, COLUMNS, rows(5, 20))
+            assert result.spilled
+            await store.append(result, COLUMNS, rows(20, 30))
+            store.finish(result, truncated=True)
+
+            expected = [[i, f"row {i}"] for i in range(30)]
+            pages, offset = [], 0
+            while True:
+                page = await store.read(result, offset, 7)
+                if not page:
+                    break
+                pages.extend(page)
+                offset += len(page)
+            assert pages == expected
+            # A page that starts in rows spilled from memory and ends in rows written later
+            assert await store.read(result, 3, 20) == expected[3:23]
+            assert result.describe()["truncated"] is True
+        finally:
+            await store.close()
+        assert list(tmp_path.iterdir()) == []
+
+    run(scenario())
+
+
+def test_read_while_still_writing(tmp_path):
+    async def scenario():
+        store = ResultStore(encode, directory=str(tmp_path), spill_bytes=0)
+        try:
+            result = store.create()
+            for start in range(0, 50, 5):
+                await store.append(result, COLUMNS, rows(start, start + 5))
+                assert result.spilled and not result.complete
+                # Everything appended so far is readable before the result is finished
+                assert await store.read(result, 0, 1000) == [[i, f"row {i}"] for i in range(start + 5)]
+            store.finish(result, truncated=False)
+        finally:
+            await store.close()
+
+    run(scenario())
+
+
+def test_concurrent_reads_see_whole_rows(tmp_path):
+    async def scenario():
+        store = ResultStore(encode, directory=str(tmp_path), spill_bytes=0)
+        try:
+            result = store.create()
+
+            async def write():
+                for start in range(0, 200, 10):
+                    await store.append(result, COLUMNS, rows(start, start + 10))
+                    await asyncio.sleep(0)
+                store.finish(result, truncated=False)
+
+            writer = asyncio.ensure_future(write())
+            while not writer.done():
+                page = await store.read(result, 0, 1000)
+                assert page == [[i, f"row {i}"] for i in range(len(page))]
+                await asyncio.sleep(0)
+            await writer
+            assert len(await store.read(result, 0, 1000)) == 200
+        finally:
+            await store.close()
+
+    run(scenario())
+
+
+def test_eviction_skips_incomplete_and_locked_results():
+    async def scenario():
+        store = ResultStore(encode, max_entries=1)
+        try:
+            running = store.create()
+            await store.append(running, COLUMNS, rows(0, 3))
+            done = await store.store_rows(COLUMNS, [rows(0, 3)], False)
+            # `running` is older but still being written, so only `done` could go,
+            # and the newest entry is never evicted on its own creation
+            assert store.get(running.result_id) is running
+            assert store.get(done.result_id) is done
+
+            store.finish(running, truncated=False)
+            async with running._lock:  # e.g. a write still holding it
+                newest = store.create()
+                assert store.get(running.result_id) is running
+            assert store.get(done.result_id) is None
+            assert store.evicted == 1
+
+            store.finish(newest, truncated=False)
+            store.create()
+            assert store.get(running.result_id) is None
+            assert store.evicted >= 2
+        finally:
+            await store.close()
+
+    run(scenario())
+
+
+def test_evicted_result_reads_as_gone(tmp_path):
+    async def scenario():
+        store = ResultStore(encode, directory=str(tmp_path), spill_bytes=0)
+        try:
+            result = await store.store_rows(COLUMNS, [rows(0, 5)], False)
+            assert store.delete(result.result_id)
+            assert store.get(result.result_id) is None
+            assert await store.read(result, 0, 5) is None
+        finally:
+            await store.close()
+
+    run(scenario())
@@ -0,0 +1,166 @@
+import asyncio
+from contextvars import ContextVar
+from datetime import datetime
+
+from schema_cache import COLUMNS_QUERY, VERSIONS_QUERY, SchemaCache, SchemaSnapshot, load_schema_snapshot
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Loader:
+    # Loads "version N" schemas, each taking `delay` seconds
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self, key, previous):
+        self.calls += 1
+        version = self.calls
+        await asyncio.sleep(self.delay)
+        return SchemaSnapshot({"version": version}, None, "full")
+
+
+def test_concurrent_getters_share_one_load():
+    async def scenario():
+        loader = Loader()
+        cache = SchemaCache(loader, ttl=60, refresh_ahead=10)
+        schemas = await asyncio.gather(*(cache.get(("db", "SalesLT")) for _ in range(10)))
+        assert loader.calls == 1
+        assert all(schema == {"version": 1} for schema in schemas)
+        assert await cache.get(("db", "other")) == {"version": 2}
+        assert loader.calls == 2
+
+    run(scenario())
+
+
+def test_refresh_ahead_serves_the_stale_schema_while_refreshing():
+    async def scenario():
+        loader = Loader(delay=0.1)
+        cache = SchemaCache(loader, ttl=60, refresh_ahead=10)
+        key = ("db", "SalesLT")
+        await cache.get(key)
+        cache.peek(key).loaded_at -= 55  # inside the refresh-ahead window
+
+        # Served at once from the old entry, while one refresh runs behind it
+        assert await asyncio.wait_for(cache.get(key), 0.05) == {"version": 1}
+        assert await cache.get(key) == {"version": 1}
+        assert loader.calls == 2
+        assert cache.stats()["refreshing"] == 1
+        assert cache.stats()["backgroundRefreshes"] == 1
+
+        await asyncio.sleep(0.15)
+        assert await cache.get(key) == {"version": 2}
+        assert cache.stats()["refreshing"] == 0
+
+    run(scenario())
+
+
+def test_background_refresh_keeps_the_context_that_started_it():
+    # AnalyzeThis routes loads through a ContextVar; a refresh still running
+    # after its request has finished must load from that request's database
+    route = ContextVar("route", default="default")
+
+    async def scenario():
+        seen = []
+
+        async def loader(key, previous):
+            await asyncio.sleep(0.01)
+            seen.append(route.get())
+            return SchemaSnapshot({"version": len(seen)}, None, "full")
+
+        cache = SchemaCache(loader, ttl=60, refresh_ahead=10)
+        key = ("tenant", "SalesLT")
+
+        async def request():
+            route.set("tenant")
+            return await cache.get(key)
+
+        await asyncio.create_task(request())
+        cache.peek(key).loaded_at -= 55
+        await asyncio.create_task(request())  # returns before the refresh runs
+        await asyncio.sleep(0.05)
+        assert seen == ["tenant", "tenant"]
+
+    run(scenario())
+
+
+def test_failed_refresh_keeps_the_previous_schema():
+    async def scenario():
+        calls = []
+
+        async def loader(key, previous):
+            calls.append(key)
+            if previous is not None:
+                raise RuntimeError("database down")
+            return SchemaSnapshot({"version": 1}, None, "full")
+
+        cache = SchemaCache(loader, ttl=60, refresh_ahead=10)
+        await cache.get("key")
+        cache.peek("key").loaded_at -= 61  # expired
+        assert await cache.get("key") == {"version": 1}
+        assert cache.stats()["staleServed"] == 1
+
+    run(scenario())
+
+
+class FakeCursor:
+    # Answers the version, column and foreign key queries from `tables`:
+    # {table: (modify_date, [column names])}
+    def __init__(self, tables, log):
+        self.tables = tables
+        self.log = log
+        self.rows = []
+
+    def execute(self, query, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = tuple(params[0])
+        if query == VERSIONS_QUERY:
+            self.rows = [(table, modified, None) for table, (modified, _) in self.tables.items()]
+        elif query.startswith(COLUMNS_QUERY.split("{")[0]):
+            wanted = list(params[1:]) or sorted(self.tables)
+            self.log.append(wanted)
+            self.rows = [
+                (table, column, "int", "NO", None) for table in wanted for column in self.tables[table][1]
+            ]
+        else:
+            self.rows = []
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, tables):
+        self.tables = tables
+        self.loaded = []
+
+    def cursor(self):
+        return FakeCursor(self.tables, self.loaded)
+
+
+def test_only_changed_tables_are_reloaded():
+    old, new = datetime(2024, 1, 1), datetime(2024, 2, 1)
+    conn = FakeConnection({
+        "Address": (old, ["AddressID"]),
+        "Customer": (old, ["CustomerID"]),
+        "Vendor": (old, ["VendorID"]),
+    })
+    first = load_schema_snapshot(conn, "SalesLT")
+    assert first.mode == "full"
+    assert load_schema_snapshot(conn, "SalesLT", first).mode == "unchanged"
+
+    conn.tables["Address"] = (new, ["AddressID", "City"])
+    conn.tables["Product"] = (new, ["ProductID"])
+    del conn.tables["Customer"]
+    conn.loaded.clear()
+    second = load_schema_snapshot(conn, "SalesLT", first)
+    assert second.mode == "incremental"
+    assert conn.loaded == [["Address", "Product"]]
+    assert list(second.schema) == ["Address", "Product", "Vendor"]
+    assert [c["name"] for c in second.schema["Address"]["columns"]] == ["AddressID", "City"]
+    assert second.schema["Vendor"] is first.schema["Vendor"]
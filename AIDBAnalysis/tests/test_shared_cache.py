@@ -0,0 +1,74 @@
+import asyncio
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import pytest
+
+from shared_cache import CacheBackend, SharedCache, SQLiteCacheBackend, decode_value, encode_value
+
+
+def test_values_keep_their_types():
+    value = {
+        "when": datetime(2024, 5, 1, 12, 30, 15, 250000),
+        "day": date(2024, 5, 1),
+        "at": time(8, 15),
+        "amount": Decimal("12345.6789"),
+        "blob": b"\x00\xffdata",
+        "rows": [{"id": 1, "name": "x", "missing": None}],
+    }
+    assert decode_value(encode_value(value)) == value
+
+
+def test_unknown_types_are_refused():
+    with pytest.raises(TypeError):
+        encode_value({"value": object()})
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        CacheBackend()
+
+
+def test_load_is_single_flight(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+
+    async def scenario():
+        # Two caches on one file stand for two workers
+        workers = [SharedCache(SQLiteCacheBackend(path), poll_interval=0.01) for _ in range(2)]
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return {"loadedAt": datetime(2024, 1, 1)}
+
+        try:
+            entries = await asyncio.gather(*(w.load("schema", ("db", "s"), loader, 60) for w in workers * 2))
+        finally:
+            for worker in workers:
+                worker.close()
+        assert len(calls) == 1
+        assert sum(entry.loaded for entry in entries) == 1
+        assert all(entry.value == {"loadedAt": datetime(2024, 1, 1)} for entry in entries)
+
+    asyncio.run(scenario())
+
+
+def test_lock_is_renewed_during_a_slow_load(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+
+    async def scenario():
+        holder = SharedCache(SQLiteCacheBackend(path), lock_lease=0.3)
+        other = SharedCache(SQLiteCacheBackend(path), lock_lease=0.3)
+        try:
+            async with holder.locked("llm", "key") as entry:
+                assert entry is None
+                await asyncio.sleep(1.0)  # several leases
+                # Still held: another worker cannot take it over
+                assert not other.backend.acquire("llm", "key", other.owner, 0.3)
+            assert other.backend.acquire("llm", "key", other.owner, 0.3)
+        finally:
+            holder.close()
+            other.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,152 @@
+import pytest
+
+from sql_guard import SqlRejectedError, guard_query, qualify_tables
+
+
+def test_plain_select_gets_top():
+    guarded = guard_query("SELECT Name FROM Product", 100)
+    assert guarded.sql == "SELECT TOP (100) Name FROM Product"
+    assert guarded.changes == ["Added TOP (100)"]
+
+
+def test_extra_rows_are_fetched_but_not_reported():
+    guarded = guard_query("SELECT Name FROM Product", 100, extra_rows=1)
+    assert guarded.sql == "SELECT TOP (101) Name FROM Product"
+    assert guarded.changes == ["Added TOP (100)"]
+
+
+def test_top_is_clamped():
+    guarded = guard_query("SELECT TOP 5000 Name FROM Product", 100, extra_rows=1)
+    assert guarded.sql == "SELECT TOP (101) Name FROM Product"
+    assert guarded.changes == ["Replaced TOP 5000 with TOP (100)"]
+
+
+def test_downgrade_is_reported_with_its_row_limit():
+    guarded = guard_query("SELECT Name FROM Product", 100, extra_rows=1)
+    assert guarded.max_rows == 100
+    assert "rowLimit" not in guarded.report()
+
+    guarded.downgraded = True
+    report = guarded.report()
+    assert report["downgraded"] is True
+    assert report["rowLimit"] == 100
+
+
+def test_top_within_limit_is_kept():
+    guarded = guard_query("SELECT TOP 10 Name FROM Product", 100)
+    assert guarded.sql == "SELECT TOP 10 Name FROM Product"
+    assert guarded.changes == []
+
+
+def test_top_percent_is_replaced():
+    guarded = guard_query("SELECT TOP 50 PERCENT Name FROM Product", 100)
+    assert guarded.sql.startswith("SELECT TOP (100) ")
+    assert "PERCENT" not in guarded.sql
+
+
+def test_fetch_is_added_after_offset():
+    guarded = guard_query("SELECT Name FROM Product ORDER BY Name OFFSET 10 ROWS", 100)
+    assert guarded.sql.endswith("OFFSET 10 ROWS FETCH NEXT 100 ROWS ONLY")
+    assert guarded.changes == ["Added FETCH NEXT 100 ROWS ONLY"]
+
+
+def test_fetch_is_clamped():
+    guarded = guard_query("SELECT Name FROM Product ORDER BY Name OFFSET 0 ROWS FETCH NEXT 500 ROWS ONLY", 100, 1)
+    assert guarded.sql.endswith("FETCH NEXT 101 ROWS ONLY")
+    assert guarded.changes == ["Clamped FETCH 500 ROWS to 100"]
+
+
+def test_cte_outer_select_is_limited():
+    guarded = guard_query("WITH c AS (SELECT Name FROM Product) SELECT Name FROM c", 100)
+    assert guarded.sql == "WITH c AS (SELECT Name FROM Product) SELECT TOP (100) Name FROM c"
+
+
+@pytest.mark.parametrize("operator", ["UNION", "UNION ALL", "EXCEPT", "INTERSECT"])
+def test_set_operations_pass_through(operator):
+    sql = f"SELECT Name FROM Product {operator} SELECT Name FROM ProductArchive"
+    guarded = guard_query(sql, 100)
+    assert guarded.sql == sql
+    assert len(guarded.changes) == 1
+    assert "not limited in SQL" in guarded.changes[0]
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT 1; SELECT 2",
+        "SELECT Name FROM Product; DROP TABLE Product",
+        "SELECT 1; ; SELECT 2",
+    ],
+)
+def test_multiple_statements_rejected(sql):
+    with pytest.raises(SqlRejectedError):
+        guard_query(sql, 100)
+
+
+def test_trailing_semicolon_is_dropped():
+    assert guard_query("SELECT Name FROM Product;  ", 100).sql == "SELECT TOP (100) Name FROM Product"
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT Name INTO Copy FROM Product",
+        "WITH c AS (SELECT 1 AS x) DELETE FROM Product",
+        "SELECT Name FROM Product WHERE 1 = 1 UPDATE Product SET Name = ''",
+        "SELECT * FROM OPENROWSET('SQLNCLI', 'x', 'SELECT 1')",
+        "SELECT Name FROM Product WAITFOR DELAY '00:00:05'",
+        "SELECT * FROM xp_cmdshell('dir')",
+    ],
+)
+def test_forbidden_keywords_rejected(sql):
+    with pytest.raises(SqlRejectedError):
+        guard_query(sql, 100)
+
+
+def test_keywords_in_strings_and_comments_are_ignored():
+    sql = "SELECT Name FROM Product WHERE Name = 'DROP TABLE; INTO' -- DELETE"
+    guarded = guard_query(sql, 100)
+    assert guarded.sql.startswith("SELECT TOP (100) Name")
+
+
+@pytest.mark.parametrize("sql", ["", "   ", "UPDATE Product SET Name = ''", "SELECT (Name FROM Product"])
+def test_invalid_queries_rejected(sql):
+    with pytest.raises(SqlRejectedError):
+        guard_query(sql, 100)
+
+
+TABLES = {"Customer": [], "SalesOrderHeader": [], "Address": []}
+
+
+def test_qualify_from_and_join():
+    sql = "SELECT * FROM Customer c JOIN SalesOrderHeader h ON h.CustomerID = c.CustomerID"
+    assert qualify_tables(sql, "SalesLT", TABLES) == (
+        "SELECT * FROM SalesLT.Customer c JOIN SalesLT.SalesOrderHeader h ON h.CustomerID = c.CustomerID"
+    )
+
+
+def test_qualify_comma_list():
+    sql = "SELECT * FROM Customer c, Address a WHERE a.AddressID = c.CustomerID"
+    assert qualify_tables(sql, "SalesLT", TABLES) == (
+        "SELECT * FROM SalesLT.Customer c, SalesLT.Address a WHERE a.AddressID = c.CustomerID"
+    )
+
+
+def test_qualify_comma_list_after_join_condition():
+    sql = "SELECT * FROM Customer c JOIN SalesOrderHeader h ON h.CustomerID = c.CustomerID, Address a"
+    assert qualify_tables(sql, "SalesLT", TABLES).endswith(", SalesLT.Address a")
+
+
+def test_qualify_leaves_other_names_alone():
+    sql = (
+        "SELECT Customer, COALESCE(Address, 'x') FROM SalesLT.Customer "
+        "WHERE CustomerID IN (SELECT CustomerID FROM dbo.Address) AND COALESCE(Customer, Address) = 'y'"
+    )
+    assert qualify_tables(sql, "SalesLT", TABLES) == sql
+
+
+def test_qualify_brackets_and_subquery():
+    sql = "SELECT * FROM [Customer] WHERE CustomerID IN (SELECT CustomerID FROM SalesOrderHeader)"
+    assert qualify_tables(sql, "SalesLT", TABLES) == (
+        "SELECT * FROM SalesLT.[Customer] WHERE CustomerID IN (SELECT CustomerID FROM SalesLT.SalesOrderHeader)"
+    )
@@ -0,0 +1,140 @@
+import asyncio
+import json
+
+from sse_sessions import HEARTBEAT, SessionManager
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def parse(frame):
+    # (event id, message) of an encoded frame
+    lines = dict(line.split(": ", 1) for line in frame.strip().split("\n"))
+    return lines["id"], json.loads(lines["data"])
+
+
+async def read(manager, session, count):
+    frames = []
+    stream = manager.stream(session)
+    async for frame in stream:
+        frames.append(parse(frame))
+        if len(frames) == count:
+            break
+    await stream.aclose()
+    return frames
+
+
+def test_frames_carry_session_scoped_ids():
+    async def scenario():
+        manager = SessionManager("/send")
+        session = manager.create()
+        for n in range(3):
+            manager.send(session, {"n": n})
+        frames = await read(manager, session, 3)
+        assert [event_id for event_id, _ in frames] == [f"{session.session_id}:{n}" for n in (1, 2, 3)]
+        assert [message["n"] for _, message in frames] == [0, 1, 2]
+        # Without a resume window the session ends with its stream
+        assert manager.get(session.session_id) is None
+        await manager.close()
+
+    run(scenario())
+
+
+def test_resume_replays_after_the_last_event_id():
+    async def scenario():
+        manager = SessionManager("/send", replay_size=8, resume_timeout=30)
+        session = manager.create()
+        for n in range(5):
+            manager.send(session, {"n": n})
+        frames = await read(manager, session, 4)
+        # The client saw events 1-4 but only processed up to 2 when it dropped
+        assert manager.get(session.session_id) is session
+        assert manager.resume(frames[1][0]) is session
+        assert manager.resume(frames[1][0]) is None  # already taken by the new stream
+
+        manager.send(session, {"n": 5})
+        resumed = await read(manager, session, 4)
+        assert [message["n"] for _, message in resumed] == [2, 3, 4, 5]
+        assert session.dropped == 0
+        stats = manager.stats()
+        assert stats["resumed"] == 1 and stats["replayed"] == 2
+        await manager.close()
+
+    run(scenario())
+
+
+def test_resume_beyond_the_replay_buffer_counts_missing_events():
+    async def scenario():
+        manager = SessionManager("/send", replay_size=2, resume_timeout=30)
+        session = manager.create()
+        for n in range(5):
+            manager.send(session, {"n": n})
+        await read(manager, session, 5)
+        assert manager.resume(f"{session.session_id}:1") is session
+        assert session.dropped == 2  # events 2 and 3 are no longer kept
+        assert [message["n"] for _, message in await read(manager, session, 2)] == [3, 4]
+        await manager.close()
+
+    run(scenario())
+
+
+def test_unknown_or_malformed_last_event_ids_are_not_resumed():
+    async def scenario():
+        manager = SessionManager("/send", replay_size=4, resume_timeout=30)
+        session = manager.create()
+        assert manager.resume("no-such-session:1") is None
+        assert manager.resume(f"{session.session_id}:abc") is None
+        assert manager.resume("garbage") is None
+        await manager.close()
+
+    run(scenario())
+
+
+def test_detached_sessions_expire():
+    async def scenario():
+        manager = SessionManager("/send", replay_size=4, resume_timeout=0.05, idle_timeout=None)
+        session = manager.create()
+        kept = manager.create()
+        manager.send(session, {"n": 0})
+        await read(manager, session, 1)
+        manager.reap()
+        assert manager.get(session.session_id) is session  # still within its window
+        await asyncio.sleep(0.06)
+        manager.reap()
+        assert manager.get(session.session_id) is None
+        assert session.closed
+        assert manager.resume(f"{session.session_id}:1") is None
+        # A session that never had a stream is not detached, so it is kept
+        assert manager.get(kept.session_id) is kept
+        assert manager.stats()["resumeExpired"] == 1
+        await manager.close()
+
+    run(scenario())
+
+
+def test_idle_sessions_are_closed_and_heartbeats_sent():
+    async def scenario():
+        manager = SessionManager("/send", heartbeat_interval=0.01, idle_timeout=0.05)
+        session = manager.create()
+        assert await session.next_frame(0.01) == HEARTBEAT
+        await asyncio.sleep(0.06)
+        manager.reap()
+        assert manager.get(session.session_id) is None
+        assert manager.stats()["idleClosed"] == 1
+        await manager.close()
+
+    run(scenario())
+
+
+def test_overflow_drops_the_oldest_message():
+    async def scenario():
+        manager = SessionManager("/send", queue_size=2)
+        session = manager.create()
+        for n in range(4):
+            assert manager.send(session, {"n": n})
+        assert [message["n"] for _, message in await read(manager, session, 2)] == [2, 3]
+        assert manager.stats()["dropped"] == 2
+        await manager.close()
+
+    run(scenario())
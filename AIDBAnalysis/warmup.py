@@ -0,0 +1,97 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+PENDING = "pending"
+OK = "ok"
+FAILED = "failed"
+
+
+class Warmup:
+    # Start-up work done ahead of the first request instead of during it.
+    #  - steps run concurrently in a background task, so the server already
+    #    answers probes while they run; a failed step is retried every
+    #    `retry_interval` seconds until it succeeds
+    #  - `ready` turns true once every step has succeeded (at once without steps)
+    #  - timings: import (set by the app), each step, start -> ready, and the
+    #    latency of the first request that was not a probe
+    def __init__(self, started_at: Optional[float] = None, retry_interval: float = 10.0):
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.retry_interval = retry_interval
+        self.import_seconds: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self.first_request: Optional[Dict[str, Any]] = None
+        self._first_request_claimed = False
+        self._steps: List[Tuple[str, Callable[[], Awaitable[Any]]]] = []
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, name: str, fn: Callable[[], Awaitable[Any]]):
+        self._steps.append((name, fn))
+        self._results[name] = {"status": PENDING, "attempts": 0, "durationMs": None, "error": None}
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    def start(self):
+        if not self._steps:
+            self.ready_at = time.monotonic()
+        elif self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        pending = list(self._steps)
+        while True:
+            outcomes = await asyncio.gather(*(self._step(name, fn) for name, fn in pending))
+            pending = [step for step, ok in zip(pending, outcomes) if not ok]
+            if not pending:
+                break
+            await asyncio.sleep(self.retry_interval)
+        self.ready_at = time.monotonic()
+        print(f"Warm-up finished in {self.ready_at - self.started_at:.2f}s")
+
+    async def _step(self, name: str, fn: Callable[[], Awaitable[Any]]) -> bool:
+        result = self._results[name]
+        result["attempts"] += 1
+        started = time.perf_counter()
+        try:
+            await fn()
+        except Exception as e:
+            result.update(status=FAILED, error=str(e) or type(e).__name__)
+            print(f"Warm-up step {name} failed (attempt {result['attempts']}): {e}")
+            return False
+        finally:
+            result["durationMs"] = round((time.perf_counter() - started) * 1000, 1)
+        result.update(status=OK, error=None)
+        return True
+
+    def claim_first_request(self) -> bool:
+        # True exactly once, for the request whose latency is recorded
+        if self._first_request_claimed:
+            return False
+        self._first_request_claimed = True
+        return True
+
+    def record_first_request(self, path: str, seconds: float):
+        self.first_request = {
+            "path": path,
+            "latencyMs": round(seconds * 1000, 1),
+            "beforeReady": not self.ready,
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "importMs": round(self.import_seconds * 1000, 1) if self.import_seconds is not None else None,
+            "startupMs": round((self.ready_at - self.started_at) * 1000, 1) if self.ready else None,
+            "uptimeMs": round((time.monotonic() - self.started_at) * 1000, 1),
+            "steps": {name: dict(result) for name, result in self._results.items()},
+            "firstRequest": self.first_request,
+        }
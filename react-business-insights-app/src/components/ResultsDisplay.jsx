@@ -1,10 +1,82 @@
 import React, { useState } from 'react';
+import { fetchResultPage } from '../services/api';
 import { Bar } from 'react-chartjs-2';
 import { Chart as ChartJS, CategoryScale, LinearScale, BarElement, Title, Tooltip, Legend } from 'chart.js';
 
 // Register Chart.js components
 ChartJS.register(CategoryScale, LinearScale, BarElement, Title, Tooltip, Legend);
 
+// Rows of one query: the first page arrives with the analysis, later pages are
+// loaded from the server's result store with the nextCursor of the page before
+const QueryResultTable = ({ queryResult }) => {
+    const [rows, setRows] = useState(queryResult.results || []);
+    const [nextCursor, setNextCursor] = useState(queryResult.nextCursor);
+    const [loadingPage, setLoadingPage] = useState(false);
+    const [pageError, setPageError] = useState(null);
+
+    const loadMore = async () => {
+        setLoadingPage(true);
+        setPageError(null);
+        try {
+            const page = await fetchResultPage(queryResult.resultId, nextCursor);
+            setRows((previous) => previous.concat(page.results));
+            setNextCursor(page.nextCursor);
+        } catch (err) {
+            setPageError('Could not load more rows; the result may have expired.');
+        } finally {
+            setLoadingPage(false);
+        }
+    };
+
+    return (
+        <div>
+            <h6>Results{queryResult.rowCount !== undefined && ` (${rows.length} of ${queryResult.rowCount} rows)`}:</h6>
+            <table border="1" style={{ borderCollapse: 'collapse', width: '100%', marginTop: '10px' }}>
+                <thead>
+                    <tr style={{ backgroundColor: '#0078d4', color: '#fff' }}>
+                        {rows.length > 0 &&
+                            Object.keys(rows[0]).map((column, index) => (
+                                <th key={index} style={{ padding: '10px', textAlign: 'left' }}>
+                                    {column}
+                                </th>
+                            ))}
+                    </tr>
+                </thead>
+                <tbody>
+                    {rows.map((row, rowIndex) => (
+                        <tr key={rowIndex} style={{ backgroundColor: rowIndex % 2 === 0 ? '#f9f9f9' : '#fff' }}>
+                            {Object.values(row).map((value, colIndex) => (
+                                <td key={colIndex} style={{ padding: '10px' }}>
+                                    {value}
+                                </td>
+                            ))}
+                        </tr>
+                    ))}
+                </tbody>
+            </table>
+            {pageError && <p style={{ color: 'red' }}>{pageError}</p>}
+            {nextCursor && queryResult.resultId && (
+                <button
+                    onClick={loadMore}
+                    disabled={loadingPage}
+                    style={{
+                        marginTop: '10px',
+                        backgroundColor: '#0078d4',
+                        color: '#fff',
+                        border: 'none',
+                        padding: '5px 10px',
+                        borderRadius: '4px',
+                        cursor: 'pointer',
+                        fontSize: '12px',
+                    }}
+                >
+                    {loadingPage ? 'Loading...' : 'Load More Rows'}
+                </button>
+            )}
+        </div>
+    );
+};
+
 const ResultsDisplay = ({ results, dbSchema }) => {
     const [showFullSuggestions, setShowFullSuggestions] = useState(false);
 
@@ -74,32 +146,7 @@ const ResultsDisplay = ({ results, dbSchema }) => {
                             {queryResult.error ? (
                                 <p style={{ color: 'red' }}>Error: {queryResult.error}</p>
                             ) : (
-                                <div>
-                                    <h6>Results:</h6>
-                                    <table border="1" style={{ borderCollapse: 'collapse', width: '100%', marginTop: '10px' }}>
-                                        <thead>
-                                            <tr style={{ backgroundColor: '#0078d4', color: '#fff' }}>
-                                                {queryResult.results.length > 0 &&
-                                                    Object.keys(queryResult.results[0]).map((column, index) => (
-                                                        <th key={index} style={{ padding: '10px', textAlign: 'left' }}>
-                                                            {column}
-                                                        </th>
-                                                    ))}
-                                            </tr>
-                                        </thead>
-                                        <tbody>
-                                            {queryResult.results.map((row, rowIndex) => (
-                                                <tr key={rowIndex} style={{ backgroundColor: rowIndex % 2 === 0 ? '#f9f9f9' : '#fff' }}>
-                                                    {Object.values(row).map((value, colIndex) => (
-                                                        <td key={colIndex} style={{ padding: '10px' }}>
-                                                            {value}
-                                                        </td>
-                                                    ))}
-                                                </tr>
-                                            ))}
-                                        </tbody>
-                                    </table>
-                                </div>
+                                <QueryResultTable queryResult={queryResult} />
                             )}
                         </div>
                     ))}
@@ -1,13 +1,16 @@
 import axios from 'axios';
 
-const API_URL = 'http://localhost:8000/analyze'; // Adjust the URL as needed
+const API_BASE_URL = 'http://localhost:8000'; // Adjust the URL as needed
+const API_URL = `${API_BASE_URL}/analyze`;
+const RESULT_PAGE_SIZE = 100; // Rows per query returned with the analysis; the rest are fetched page by page
 
 export const fetchAnalysis = async (analysisGoal, tables, executeQueries = true) => {
     try {
         const response = await axios.post(API_URL, {
             analysisGoal,
             tables,
-            executeQueries
+            executeQueries,
+            resultPageSize: RESULT_PAGE_SIZE
         });
         console.log('API response:', response.data); // Log the response data
         if (response.status !== 200) {
@@ -26,4 +29,17 @@ export const fetchAnalysis = async (analysisGoal, tables, executeQueries = true)
         console.error('Error fetching analysis:', error);
         throw error;
     }
-};
\ No newline at end of file
+};
+
+// Next page of a stored query result; `cursor` is the nextCursor of the page before
+export const fetchResultPage = async (resultId, cursor, limit = RESULT_PAGE_SIZE) => {
+    try {
+        const response = await axios.get(`${API_BASE_URL}/results/${resultId}`, {
+            params: { cursor, limit }
+        });
+        return response.data;
+    } catch (error) {
+        console.error('Error fetching result page:', error);
+        throw error;
+    }
+};